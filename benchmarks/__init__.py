@@ -0,0 +1 @@
+"""Performance benchmarks and load tests for the NPO API, run from the repository root."""
@@ -0,0 +1,144 @@
+"""Helpers shared by the benchmark and load-test scripts.
+
+The npo settings are read from the environment when npo.config is imported, so call
+setup_environment() before importing any npo module.
+"""
+
+import os
+import random
+import statistics
+import threading
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import pyvips
+
+
+def setup_environment(work_dir: Path) -> None:
+    """Point the npo settings to a throw-away working directory (unless already configured)."""
+    os.environ.setdefault("NPO_DATABASE_URI", "sqlite+aiosqlite:///:memory:")
+    os.environ.setdefault("NPO_ADMIN_EMAIL", "benchmark@example.com")
+    os.environ.setdefault("NPO_UPLOADS_DIR", str(work_dir / "uploads"))
+    os.environ.setdefault("NPO_STORAGE_DIR", str(work_dir / "storage"))
+    # Tile reads are timed on the tile store, set it to time them through the tile cache
+    os.environ.setdefault("NPO_TILE_CACHE_BYTES", "0")
+    (work_dir / "uploads").mkdir(parents=True, exist_ok=True)
+    (work_dir / "storage").mkdir(parents=True, exist_ok=True)
+
+
+def generate_image(path: Path, width: int, height: int, seed: int | None = None) -> Path:
+    """
+    Write a synthetic photo-like image: a random gradient (so that perceptual hashes differ
+    between images) with gaussian noise (so that it does not compress unrealistically well).
+    The format follows the path suffix (.jpg, .png, .tif...).
+    """
+    rng = random.Random(seed)
+    xyz = pyvips.Image.xyz(width, height)
+    bands = []
+    for _ in range(3):
+        gradient = xyz[0] * rng.uniform(-1, 1) * 255 / width
+        gradient += xyz[1] * rng.uniform(-1, 1) * 255 / height
+        bands.append((gradient + rng.uniform(0, 255)).abs() % 256)
+    noise = pyvips.Image.gaussnoise(width, height, sigma=12)
+    image = (bands[0].bandjoin(bands[1:]) + noise).cast("uchar")
+    image.write_to_file(str(path))
+    return path
+
+
+def percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def median(values: list[float]) -> float:
+    return statistics.median(values) if values else 0.0
+
+
+def _current_rss() -> int:
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+class PeakMemory:
+    """Context manager sampling the process RSS in a thread to report the peak growth.
+
+    libvips allocates outside of the Python allocator, so tracemalloc alone would miss most
+    of the memory used by decoding and pyramid generation.
+    """
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.start_rss = 0
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, _current_rss())
+
+    def __enter__(self) -> "PeakMemory":
+        self.start_rss = self.peak_rss = _current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, _current_rss())
+
+    @property
+    def growth(self) -> int:
+        return self.peak_rss - self.start_rss
+
+
+@asynccontextmanager
+async def asgi_client(base_url: str | None = None):
+    """
+    Yield an httpx client: against a running server if base_url is given, otherwise against
+    the application in-process through the ASGI transport, with a fresh SQLite database.
+    """
+    from httpx import ASGITransport, AsyncClient, Limits, Timeout  # noqa: PLC0415
+
+    timeout = Timeout(300.0)
+    if base_url:
+        limits = Limits(max_connections=1000, max_keepalive_connections=1000)
+        async with AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+            yield client
+        return
+
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: PLC0415
+    from sqlalchemy.pool import StaticPool  # noqa: PLC0415
+
+    from npo.database import Base, get_session  # noqa: PLC0415
+    from npo.main import app  # noqa: PLC0415
+
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def get_benchmark_session():
+        async with session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_session] = get_benchmark_session
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(
+            transport=transport, base_url="http://bench", timeout=timeout
+        ) as client:
+            yield client
+    finally:
+        app.dependency_overrides.clear()
+        await engine.dispose()
@@ -0,0 +1,315 @@
+"""Load test simulating deep zoom viewers and bulk importers.
+
+Viewers pan and zoom at random across the pyramids, fetching a viewport of tiles at a time like
+OpenSeadragon does, while importers post batches of new images to /files/upload. Latency
+percentiles, throughput and error rates are reported per route, tiles being split according to
+whether an upload was in flight when they were requested, to show how ingestion hurts viewers:
+
+    # In-process, through the ASGI transport, on a throw-away database
+    python -m benchmarks.loadtest --viewers 50 --importers 2 --duration 60
+    # Against a running server, e.g. `uvicorn npo.main:app --workers 4`
+    python -m benchmarks.loadtest --url http://localhost:8000 --existing 100
+
+Images are generated before the run starts, so that their generation does not load the machine
+during the measures.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from benchmarks.common import asgi_client, generate_image, percentile, setup_environment
+
+TILE_SIZE = 256
+# Visible tiles around the viewport centre, as (columns, rows)
+VIEWPORT = (4, 3)
+# Random walk of a viewer: relative weights of its next move
+MOVES = {"pan": 6, "zoom_in": 3, "zoom_out": 2, "next_image": 1}
+HTTP_ERROR_STATUS = 400
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="base URL of a running server, default to in-process ASGI")
+    parser.add_argument("--viewers", type=int, default=20, help="concurrent deep zoom viewers")
+    parser.add_argument("--importers", type=int, default=1, help="concurrent bulk importers")
+    parser.add_argument("--duration", type=float, default=30.0, help="load duration in seconds")
+    parser.add_argument("--think-time", type=float, default=0.2, help="pause between viewer moves")
+    parser.add_argument("--batch-size", type=int, default=5, help="images per upload request")
+    parser.add_argument("--seed-images", type=int, default=5, help="images uploaded before load")
+    parser.add_argument(
+        "--import-images", type=int, default=20, help="images available to the importers"
+    )
+    parser.add_argument(
+        "--existing",
+        type=int,
+        default=0,
+        help="also view up to N images already stored on the server",
+    )
+    parser.add_argument("--image-size", default="2000x1500", help="generated images WIDTHxHEIGHT")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the simulation")
+    parser.add_argument("--output", type=Path, help="write the report as JSON")
+    return parser.parse_args(argv)
+
+
+@dataclass
+class Pyramid:
+    pixel_hash: str
+    width: int
+    height: int
+
+    @property
+    def max_zoom(self) -> int:
+        return max(0, math.ceil(math.log2(max(self.width, self.height) / TILE_SIZE)))
+
+    def grid(self, zoom: int) -> tuple[int, int]:
+        """Number of tile columns and rows at a zoom level (Google layout, image at top left)."""
+        scale = 2 ** (self.max_zoom - zoom)
+        columns = math.ceil(math.ceil(self.width / scale) / TILE_SIZE)
+        rows = math.ceil(math.ceil(self.height / scale) / TILE_SIZE)
+        return columns, rows
+
+
+@dataclass
+class RouteStats:
+    latencies: list[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+    exceptions: Counter = field(default_factory=Counter)
+    bytes: int = 0
+    # Successful responses without content, e.g. tiles missing from a pyramid
+    empty: int = 0
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def errors(self) -> int:
+        server_errors = sum(
+            count for status, count in self.statuses.items() if status >= HTTP_ERROR_STATUS
+        )
+        return server_errors + sum(self.exceptions.values())
+
+    def to_dict(self, duration: float) -> dict:
+        return {
+            "requests": self.requests,
+            "throughput_rps": self.requests / duration,
+            "throughput_mb_s": self.bytes / duration / 1e6,
+            "error_rate": self.errors / self.requests if self.requests else 0.0,
+            "p50_ms": percentile(self.latencies, 50) * 1000,
+            "p95_ms": percentile(self.latencies, 95) * 1000,
+            "p99_ms": percentile(self.latencies, 99) * 1000,
+            "max_ms": max(self.latencies, default=0) * 1000,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "exceptions": dict(self.exceptions),
+            "empty_responses": self.empty,
+        }
+
+
+class LoadTest:
+    def __init__(self, client, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.pyramids: list[Pyramid] = []
+        self.stats: dict[str, RouteStats] = {}
+        self.uploads_in_flight = 0
+        self.deadline = 0.0
+
+    async def request(self, route: str, method: str, url: str, **kwargs):
+        stats = self.stats.setdefault(route, RouteStats())
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except Exception as error:  # noqa: BLE001
+            stats.latencies.append(time.perf_counter() - start)
+            stats.exceptions[type(error).__name__] += 1
+            return None
+        stats.latencies.append(time.perf_counter() - start)
+        stats.statuses[response.status_code] += 1
+        stats.bytes += len(response.content)
+        if response.is_success and not response.content:
+            stats.empty += 1
+        return response
+
+    async def upload(self, images: list[Path], route: str = "upload") -> None:
+        sizes = {image.name: generated_size(image) for image in images}
+        opened = [open(image, "rb") for image in images]  # noqa: SIM115
+        self.uploads_in_flight += 1
+        try:
+            files = [
+                ("files", (image.name, image_file, "image/jpeg"))
+                for image, image_file in zip(images, opened, strict=True)
+            ]
+            response = await self.request(route, "POST", "/files/upload", files=files)
+        finally:
+            self.uploads_in_flight -= 1
+            for image_file in opened:
+                image_file.close()
+        if response is not None and response.is_success:
+            for name, infos in response.json().items():
+                self.pyramids.append(Pyramid(infos["pixel_hash"], *sizes[name]))
+
+    async def load_existing(self, limit: int) -> None:
+        """Add pyramids of images already stored, their size being read from their metadata."""
+        response = await self.request("search", "GET", "/files/search", params={"limit": limit})
+        if response is None or not response.is_success:
+            return
+        for item in response.json()["items"]:
+            metadata = await self.request("metadata", "GET", f"/metadata/{item['pixel_hash']}")
+            if metadata is None or not metadata.is_success:
+                continue
+            meta = metadata.json() or {}
+            width = meta.get("File:ImageWidth") or meta.get("EXIF:ExifImageWidth")
+            height = meta.get("File:ImageHeight") or meta.get("EXIF:ExifImageHeight")
+            if width and height:
+                self.pyramids.append(Pyramid(item["pixel_hash"], int(width), int(height)))
+
+    async def viewer(self) -> None:
+        pyramid = self.random.choice(self.pyramids)
+        zoom, x, y = 0, 0, 0
+        while time.perf_counter() < self.deadline:
+            route = "tile (during ingest)" if self.uploads_in_flight else "tile (idle)"
+            columns, rows = pyramid.grid(zoom)
+            tiles = [
+                (column, row)
+                for column in range(x - VIEWPORT[0] // 2, x + (VIEWPORT[0] + 1) // 2)
+                for row in range(y - VIEWPORT[1] // 2, y + (VIEWPORT[1] + 1) // 2)
+                if 0 <= column < columns and 0 <= row < rows
+            ]
+            # The pyramids use the Google layout, whose tile paths are zoom/row/column
+            await asyncio.gather(
+                *(
+                    self.request(
+                        route, "GET", f"/files/{pyramid.pixel_hash}/{zoom}/{row}/{column}.jpg"
+                    )
+                    for column, row in tiles
+                )
+            )
+            if self.args.think_time > 0:
+                await asyncio.sleep(self.random.expovariate(1 / self.args.think_time))
+
+            move = self.random.choices(list(MOVES), weights=list(MOVES.values()))[0]
+            if move == "zoom_in" and zoom < pyramid.max_zoom:
+                zoom, x, y = (
+                    zoom + 1,
+                    2 * x + self.random.randint(0, 1),
+                    2 * y + self.random.randint(0, 1),
+                )
+            elif move == "zoom_out" and zoom > 0:
+                zoom, x, y = zoom - 1, x // 2, y // 2
+            elif move == "next_image":
+                pyramid = self.random.choice(self.pyramids)
+                zoom, x, y = 0, 0, 0
+            else:
+                x, y = x + self.random.randint(-1, 1), y + self.random.randint(-1, 1)
+            columns, rows = pyramid.grid(zoom)
+            x, y = min(max(0, x), columns - 1), min(max(0, y), rows - 1)
+
+    async def importer(self, queue: list[Path]) -> None:
+        while queue and time.perf_counter() < self.deadline:
+            batch = [queue.pop() for _ in range(min(self.args.batch_size, len(queue)))]
+            await self.upload(batch)
+
+    async def run(self, import_images: list[Path]) -> float:
+        start = time.perf_counter()
+        self.deadline = start + self.args.duration
+        await asyncio.gather(
+            *(self.viewer() for _ in range(self.args.viewers)),
+            *(self.importer(import_images) for _ in range(self.args.importers)),
+        )
+        return time.perf_counter() - start
+
+
+def generated_size(image: Path) -> tuple[int, int]:
+    width, height = image.stem.rsplit("-", 1)[-1].split("x")
+    return int(width), int(height)
+
+
+def generate_images(directory: Path, prefix: str, count: int, size: str, seed: int) -> list[Path]:
+    width, height = (int(value) for value in size.split("x"))
+    return [
+        generate_image(
+            directory / f"{prefix}{index}-{width}x{height}.jpg", width, height, seed + index
+        )
+        for index in range(count)
+    ]
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{'route':<22} {'requests':>9} {'req/s':>9} {'MB/s':>8} {'errors':>8}"
+        f" {'p50':>9} {'p95':>9} {'p99':>9}"
+    )
+    for route, stats in report["routes"].items():
+        print(
+            f"{route:<22} {stats['requests']:>9} {stats['throughput_rps']:>9.1f}"
+            f" {stats['throughput_mb_s']:>8.2f} {stats['error_rate']:>7.1%}"
+            f" {stats['p50_ms']:>7.1f}ms {stats['p95_ms']:>7.1f}ms {stats['p99_ms']:>7.1f}ms"
+        )
+        if stats["exceptions"]:
+            print(f"{'':<22} exceptions: {stats['exceptions']}")
+        if stats["empty_responses"]:
+            print(f"{'':<22} empty responses: {stats['empty_responses']}")
+
+
+async def run(args: argparse.Namespace, work_dir: Path) -> dict:
+    images_dir = work_dir / "loadtest-images"
+    images_dir.mkdir()
+    seed_images = generate_images(images_dir, "seed", args.seed_images, args.image_size, 0)
+    import_images = generate_images(
+        images_dir, "import", args.import_images, args.image_size, args.seed_images
+    )
+
+    async with asgi_client(args.url) as client:
+        load_test = LoadTest(client, args)
+        if args.existing:
+            await load_test.load_existing(args.existing)
+        for index in range(0, len(seed_images), args.batch_size):
+            await load_test.upload(seed_images[index : index + args.batch_size], route="seed")
+        if not load_test.pyramids:
+            seed = load_test.stats.get("seed", RouteStats())
+            raise SystemExit(
+                "No image to view: seed uploads failed and no existing image found "
+                f"(statuses: {dict(seed.statuses)}, exceptions: {dict(seed.exceptions)})."
+            )
+
+        # Setup requests are reported apart from the load itself
+        setup_stats, load_test.stats = load_test.stats, {}
+        duration = await load_test.run(import_images)
+
+    return {
+        "duration_s": duration,
+        "viewers": args.viewers,
+        "importers": args.importers,
+        "pyramids": len(load_test.pyramids),
+        "routes": {route: stats.to_dict(duration) for route, stats in load_test.stats.items()},
+        "setup": {route: stats.to_dict(duration) for route, stats in setup_stats.items()},
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="npo-loadtest-") as tmp:
+        work_dir = Path(tmp)
+        if not args.url:
+            setup_environment(work_dir)
+        report = asyncio.run(run(args, work_dir))
+
+    print_report(report)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    errors = sum(stats["error_rate"] * stats["requests"] for stats in report["routes"].values())
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
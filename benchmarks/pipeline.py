@@ -0,0 +1,305 @@
+"""Micro-benchmarks of the ingestion stages and tile serving.
+
+Each stage of routers/files/services.py is timed in isolation on synthetic images of several
+sizes and formats, then the upload and tile routes are timed end to end through the ASGI app.
+Results can be saved as a baseline and later runs compared against it:
+
+    python -m benchmarks.pipeline --output baseline.json
+    python -m benchmarks.pipeline --baseline baseline.json --threshold 0.2 \
+        --stage-threshold create_dzi=0.5
+
+The exit code is 1 when a stage median is slower than the baseline by more than its threshold.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.common import (
+    PeakMemory,
+    asgi_client,
+    generate_image,
+    median,
+    percentile,
+    setup_environment,
+)
+
+# Image sizes as (width, height)
+IMAGE_SPECS = {
+    "small": (1024, 768),
+    "medium": (4000, 3000),
+    "large": (8000, 6000),
+}
+IMAGE_FORMATS = {"jpeg": ".jpg", "png": ".png", "tiff": ".tif"}
+TILES_PER_RUN = 200
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", nargs="+", default=["small", "medium"], choices=list(IMAGE_SPECS)
+    )
+    parser.add_argument("--formats", nargs="+", default=["jpeg"], choices=list(IMAGE_FORMATS))
+    parser.add_argument("--repeat", type=int, default=5, help="runs per stage and image")
+    parser.add_argument("--skip-e2e", action="store_true", help="skip the ASGI end to end runs")
+    parser.add_argument("--output", type=Path, help="write the results as JSON (e.g. a baseline)")
+    parser.add_argument("--baseline", type=Path, help="compare the results with this JSON file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed slowdown ratio of a stage median compared with the baseline",
+    )
+    parser.add_argument(
+        "--stage-threshold",
+        action="append",
+        default=[],
+        metavar="STAGE=RATIO",
+        help="override the threshold of one stage, may be repeated",
+    )
+    return parser.parse_args(argv)
+
+
+class StageResult:
+    def __init__(self, name: str, work: float, unit: str):
+        self.name = name
+        self.work = work
+        self.unit = unit
+        self.durations: list[float] = []
+        self.peak_memory: list[int] = []
+        self.python_peak: list[int] = []
+        self.skipped: str | None = None
+
+    def to_dict(self) -> dict:
+        if self.skipped:
+            return {"skipped": self.skipped}
+        median_duration = median(self.durations)
+        return {
+            "median_s": median_duration,
+            "p95_s": percentile(self.durations, 95),
+            "throughput": self.work / median_duration if median_duration else None,
+            "unit": self.unit,
+            "peak_rss_mb": max(self.peak_memory) / 2**20,
+            "peak_python_mb": max(self.python_peak) / 2**20,
+        }
+
+
+async def measure(result: StageResult, repeat: int, run) -> StageResult:
+    """
+    Run an async callable `repeat` times, recording its duration and peak RSS growth, then once
+    more under tracemalloc for the Python peak: its hooks slow every allocation down, so that the
+    timed runs go without them.
+    """
+    try:
+        for _ in range(repeat):
+            with PeakMemory() as memory:
+                start = time.perf_counter()
+                await run()
+                result.durations.append(time.perf_counter() - start)
+            result.peak_memory.append(memory.growth)
+
+        tracemalloc.start()
+        try:
+            await run()
+            result.python_peak.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    except (ImportError, FileNotFoundError) as error:
+        # Tool missing on this machine (exiftool, libvips): other errors fail the run
+        result.skipped = f"{type(error).__name__}: {error}"
+    return result
+
+
+async def bench_stages(image_path: Path, repeat: int) -> list[StageResult]:
+    import pyvips  # noqa: PLC0415
+
+    from npo.core.tiles import get_tile_store  # noqa: PLC0415
+    from npo.routers.files import services  # noqa: PLC0415
+    from npo.routers.files.schemas import File  # noqa: PLC0415
+
+    header = pyvips.Image.new_from_file(str(image_path))
+    megapixels = header.width * header.height / 1e6
+    megabytes = image_path.stat().st_size / 1e6
+
+    def new_file() -> File:
+        return File(name=image_path.name, path=str(image_path), size=image_path.stat().st_size)
+
+    results = [
+        await measure(
+            StageResult("compute_hash", megabytes, "MB/s"),
+            repeat,
+            lambda: services.compute_hash(new_file()),
+        ),
+        await measure(
+            StageResult("compute_perceptual_hash", megapixels, "MP/s"),
+            repeat,
+            lambda: services.compute_perceptual_hash(new_file()),
+        ),
+        await measure(
+            StageResult("compute_pixel_hash", megapixels, "MP/s"),
+            repeat,
+            lambda: services.compute_pixel_hash(new_file()),
+        ),
+        await measure(
+            StageResult("extract_metadata", 1, "files/s"),
+            repeat,
+            lambda: services.extract_metadata(new_file()),
+        ),
+    ]
+
+    stored = new_file()
+    await services.compute_pixel_hash(stored)
+    await services.compute_hash_pathes(stored)
+    Path(services.get_storage_path(stored)).parent.mkdir(parents=True, exist_ok=True)
+    results.append(
+        await measure(
+            StageResult("create_dzi", megapixels, "MP/s"),
+            repeat,
+            lambda: services.create_dzi(stored),
+        )
+    )
+
+    tiles_result = StageResult("get_tile_from_dzi", TILES_PER_RUN, "tiles/s")
+    tiles = get_tile_store().list_tiles(stored)
+    if not tiles:
+        tiles_result.skipped = "no pyramid created"
+        return [*results, tiles_result]
+
+    async def read_tiles():
+        for zoom, x, y in random.choices(tiles, k=TILES_PER_RUN):
+            await services.get_tile_from_dzi(stored, zoom, x, y)
+
+    results.append(await measure(tiles_result, repeat, read_tiles))
+    return results
+
+
+async def bench_e2e(images: list[Path], repeat: int) -> list[StageResult]:
+    megabytes = sum(image.stat().st_size for image in images) / len(images) / 1e6
+    upload = StageResult("upload_e2e", megabytes, "MB/s")
+    tiles = StageResult("tile_e2e", TILES_PER_RUN, "tiles/s")
+    uploaded: list[str] = []
+
+    async with asgi_client() as client:
+        queue = list(images)
+
+        async def post_upload():
+            image = queue.pop()
+            with open(image, "rb") as image_file:
+                response = await client.post(
+                    "/files/upload", files={"files": (image.name, image_file, "image/jpeg")}
+                )
+            response.raise_for_status()
+            uploaded.append(response.json()[image.name]["pixel_hash"])
+
+        await measure(upload, min(repeat, len(images) - 1), post_upload)
+
+        async def get_tiles():
+            for _ in range(TILES_PER_RUN):
+                pixel_hash = random.choice(uploaded)
+                response = await client.get(f"/files/{pixel_hash}/0/0/0.jpg")
+                response.raise_for_status()
+
+        if uploaded:
+            await measure(tiles, repeat, get_tiles)
+        else:
+            tiles.skipped = "no uploaded image"
+
+    return [upload, tiles]
+
+
+def compare(results: dict, baseline: dict, threshold: float, stage_thresholds: dict) -> list[str]:
+    regressions = []
+    # Stages, sizes and formats of this run (see --sizes, --formats, --skip-e2e): the others in
+    # the baseline are not compared
+    stages = {key.split("[", 1)[0] for key in results}
+    labels = {key.split("[", 1)[1] for key in results}
+    for key, reference in baseline.items():
+        stage, label = key.split("[", 1)
+        if "median_s" not in reference or stage not in stages or label not in labels:
+            continue
+        current = results.get(key, {})
+        if "median_s" not in current:
+            reason = current.get("skipped", "not run")
+            regressions.append(f"{key}: no measurement ({reason}) but one in the baseline")
+            continue
+        allowed = stage_thresholds.get(stage, threshold)
+        ratio = current["median_s"] / reference["median_s"]
+        current["baseline_ratio"] = ratio
+        if ratio > 1 + allowed:
+            regressions.append(f"{key}: {ratio:.2f}x slower than baseline (allowed {1 + allowed}x)")
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    print(
+        f"{'stage':<45} {'median':>10} {'p95':>10} {'throughput':>16} {'peak RSS':>10} {'ratio':>7}"
+    )
+    for key, result in results.items():
+        if "skipped" in result:
+            print(f"{key:<45} skipped ({result['skipped']})")
+            continue
+        throughput = f"{result['throughput']:.1f} {result['unit']}" if result["throughput"] else "-"
+        ratio = f"{result['baseline_ratio']:.2f}" if "baseline_ratio" in result else "-"
+        print(
+            f"{key:<45} {result['median_s'] * 1000:>8.1f}ms {result['p95_s'] * 1000:>8.1f}ms"
+            f" {throughput:>16} {result['peak_rss_mb']:>8.1f}MB {ratio:>7}"
+        )
+
+
+async def run(args: argparse.Namespace, work_dir: Path) -> dict:
+    results = {}
+    images_dir = work_dir / "images"
+    images_dir.mkdir()
+    for size in args.sizes:
+        width, height = IMAGE_SPECS[size]
+        for image_format in args.formats:
+            label = f"{size}-{image_format}"
+            suffix = IMAGE_FORMATS[image_format]
+            image = generate_image(images_dir / f"{label}{suffix}", width, height, seed=0)
+            for result in await bench_stages(image, args.repeat):
+                results[f"{result.name}[{label}]"] = result.to_dict()
+
+            if not args.skip_e2e and image_format == "jpeg":
+                e2e_images = [
+                    generate_image(images_dir / f"{label}-{seed}{suffix}", width, height, seed)
+                    # One more for the memory run of measure()
+                    for seed in range(1, args.repeat + 2)
+                ]
+                for result in await bench_e2e(e2e_images, args.repeat):
+                    results[f"{result.name}[{label}]"] = result.to_dict()
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    stage_thresholds = {
+        stage: float(ratio)
+        for stage, ratio in (item.split("=", 1) for item in args.stage_threshold)
+    }
+
+    with tempfile.TemporaryDirectory(prefix="npo-bench-") as tmp:
+        work_dir = Path(tmp)
+        setup_environment(work_dir)
+        results = asyncio.run(run(args, work_dir))
+
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.threshold, stage_thresholds)
+    print_results(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
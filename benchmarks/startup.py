@@ -0,0 +1,120 @@
+"""Startup time of the application.
+
+Each measure runs in a fresh interpreter, like a uvicorn worker: the import of npo.main, the
+startup (directories and database migrations, as done by the lifespan) and the first request.
+Scenarios:
+
+- cold: empty SQLite database, all the migrations are run
+- warm: database already at the head revision, the usual restart
+- concurrent: several workers starting together on an empty database, only one migrates
+
+    python -m benchmarks.startup --repeat 5 --workers 4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import median
+
+WORKER = """
+import asyncio, json, time
+start = time.perf_counter()
+from npo.main import app
+from npo.database import init_db
+from npo.dependencies import prepare_directories
+imported = time.perf_counter()
+
+async def main():
+    prepare_directories()
+    migrated = await init_db()
+    started = time.perf_counter()
+    from httpx import ASGITransport, AsyncClient
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://startup") as client:
+        response = await client.get("/health/ping")
+        response.raise_for_status()
+    return migrated, started
+
+migrated, started = asyncio.run(main())
+print(json.dumps({
+    "import_s": imported - start,
+    "startup_s": started - imported,
+    "first_request_s": time.perf_counter() - started,
+    "migrated": migrated,
+}))
+"""
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per scenario")
+    parser.add_argument("--workers", type=int, default=4, help="workers of the concurrent runs")
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    return parser.parse_args(argv)
+
+
+def start_workers(work_dir: Path, count: int) -> list[dict]:
+    """Start `count` workers at once on the database of work_dir and return their measures."""
+    env = {
+        **os.environ,
+        "NPO_DATABASE_URI": f"sqlite+aiosqlite:///{work_dir}/db/npo.db",
+        "NPO_ADMIN_EMAIL": "benchmark@example.com",
+        "NPO_UPLOADS_DIR": str(work_dir / "uploads"),
+        "NPO_STORAGE_DIR": str(work_dir / "storage"),
+    }
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-c", WORKER],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        for _ in range(count)
+    ]
+    measures = []
+    for worker in workers:
+        output, _ = worker.communicate()
+        if worker.returncode:
+            raise RuntimeError(f"Worker failed with exit code {worker.returncode}")
+        measures.append(json.loads(output.splitlines()[-1]))
+    return measures
+
+
+def summarize(measures: list[dict]) -> dict:
+    summary = {
+        key: median([measure[key] for measure in measures])
+        for key in ("import_s", "startup_s", "first_request_s")
+    }
+    summary["total_s"] = sum(summary.values())
+    summary["migrations_run"] = sum(measure["migrated"] for measure in measures)
+    return summary
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    results: dict[str, list[dict]] = {"cold": [], "warm": [], "concurrent": []}
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory(prefix="npo-startup-") as tmp:
+            results["cold"] += start_workers(Path(tmp), 1)
+            results["warm"] += start_workers(Path(tmp), 1)
+        with tempfile.TemporaryDirectory(prefix="npo-startup-") as tmp:
+            results["concurrent"] += start_workers(Path(tmp), args.workers)
+
+    summaries = {scenario: summarize(measures) for scenario, measures in results.items()}
+    columns = ("import_s", "startup_s", "first_request_s", "total_s")
+    print(f"{'scenario':<12}" + "".join(f"{column:>17}" for column in columns) + "  migrations")
+    for scenario, summary in summaries.items():
+        durations = "".join(f"{summary[column] * 1000:>15.0f}ms" for column in columns)
+        print(f"{scenario:<12}{durations}  {summary['migrations_run']:>10}")
+    if args.output:
+        args.output.write_text(json.dumps(summaries, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Add search columns and indexes
+
+Revision ID: 3f9a2c71b5e4
+Revises: d18168929294
+Create Date: 2026-10-19 09:12:40.318204
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3f9a2c71b5e4"
+down_revision: Union[str, Sequence[str], None] = "d18168929294"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_INDEXES = {
+    "ix_files_camera_make_camera_model_id": ["camera_make", "camera_model", "id"],
+    "ix_files_lens_model_id": ["lens_model", "id"],
+    "ix_files_mime_id": ["mime", "id"],
+    "ix_files_datetime_shooting_id": ["datetime_shooting", "id"],
+    "ix_files_iso_id": ["iso", "id"],
+    "ix_files_focal_length_id": ["focal_length", "id"],
+}
+# Files read and updated per round trip by the backfill
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _text(value) -> str | None:
+    value = str(value).strip() if value is not None else ""
+    return value[:100] or None
+
+
+def _number(value, cast):
+    if isinstance(value, str):
+        value = value.split()[0] if value.split() else None
+    try:
+        return cast(float(value)) if value is not None else None
+    except (ValueError, TypeError):
+        return None
+
+
+def _backfill_search_columns() -> None:
+    """Copy the searchable EXIF fields of already stored files into the new columns."""
+    files = sa.table(
+        "files",
+        sa.column("id", sa.Integer),
+        sa.column("meta_data", sa.JSON),
+        sa.column("camera_make", sa.String),
+        sa.column("camera_model", sa.String),
+        sa.column("lens_model", sa.String),
+        sa.column("iso", sa.Integer),
+        sa.column("focal_length", sa.Float),
+    )
+    bind = op.get_bind()
+    # The columns to set are given by the parameters of each row
+    update = files.update().where(files.c.id == sa.bindparam("file_id"))
+    last_id = 0
+    while True:
+        # Paged by id, so that the whole table is never held in memory
+        rows = bind.execute(
+            sa.select(files.c.id, files.c.meta_data)
+            .where(files.c.id > last_id, files.c.meta_data.is_not(None))
+            .order_by(files.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        values = []
+        for row in rows:
+            meta = row.meta_data or {}
+            values.append(
+                {
+                    "file_id": row.id,
+                    "camera_make": _text(meta.get("EXIF:Make")),
+                    "camera_model": _text(meta.get("EXIF:Model")),
+                    "lens_model": _text(meta.get("EXIF:LensModel")),
+                    "iso": _number(meta.get("EXIF:ISO") or meta.get("EXIF:ISOSpeedRatings"), int),
+                    "focal_length": _number(meta.get("EXIF:FocalLength"), float),
+                }
+            )
+        bind.execute(update, values)
+        last_id = rows[-1].id
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("files") as batch_op:
+        batch_op.add_column(sa.Column("camera_make", sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column("camera_model", sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column("lens_model", sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column("iso", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("focal_length", sa.Float(), nullable=True))
+
+    _backfill_search_columns()
+
+    for name, columns in SEARCH_INDEXES.items():
+        op.create_index(name, "files", columns)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name in SEARCH_INDEXES:
+        op.drop_index(name, table_name="files")
+
+    with op.batch_alter_table("files") as batch_op:
+        batch_op.drop_column("focal_length")
+        batch_op.drop_column("iso")
+        batch_op.drop_column("lens_model")
+        batch_op.drop_column("camera_model")
+        batch_op.drop_column("camera_make")
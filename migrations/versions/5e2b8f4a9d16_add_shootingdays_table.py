@@ -0,0 +1,111 @@
+"""Add shootingdays table
+
+Revision ID: 5e2b8f4a9d16
+Revises: c4d7e9a1f302
+Create Date: 2026-10-19 13:48:05.662190
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5e2b8f4a9d16"
+down_revision: Union[str, Sequence[str], None] = "c4d7e9a1f302"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Files read per round trip by the backfill
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _iter_shot_files(files: sa.TableClause):
+    """Shot files ordered by date, read by pages on (datetime_shooting, id) to bound memory."""
+    bind = op.get_bind()
+    query = (
+        sa.select(files.c.id, files.c.datetime_shooting, files.c.pixel_hash)
+        .where(files.c.datetime_shooting.is_not(None))
+        .order_by(files.c.datetime_shooting, files.c.id)
+        .limit(BACKFILL_BATCH_SIZE)
+    )
+    rows = bind.execute(query).all()
+    while rows:
+        for row in rows:
+            yield row.datetime_shooting, row.pixel_hash
+        last = rows[-1]
+        rows = bind.execute(
+            query.where(
+                sa.or_(
+                    files.c.datetime_shooting > last.datetime_shooting,
+                    sa.and_(
+                        files.c.datetime_shooting == last.datetime_shooting,
+                        files.c.id > last.id,
+                    ),
+                )
+            )
+        ).all()
+
+
+def _backfill_shooting_days(shooting_days: sa.Table) -> None:
+    """Roll up the already stored files by shooting day (dates handling differs between
+    SQLite and PostgreSQL, so days are computed in Python from the ordered files)."""
+    files = sa.table(
+        "files",
+        sa.column("id", sa.Integer),
+        sa.column("datetime_shooting", sa.DateTime),
+        sa.column("pixel_hash", sa.String),
+    )
+    days: dict = {}
+    for shot_at, pixel_hash in _iter_shot_files(files):
+        day = days.get(shot_at.date())
+        if day is None:
+            days[shot_at.date()] = {
+                "day": shot_at.date(),
+                "count": 1,
+                "first_datetime": shot_at,
+                "first_pixel_hash": pixel_hash,
+                "last_datetime": shot_at,
+                "last_pixel_hash": pixel_hash,
+            }
+        else:
+            day["count"] += 1
+            day["last_datetime"], day["last_pixel_hash"] = shot_at, pixel_hash
+    if days:
+        op.bulk_insert(shooting_days, list(days.values()))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    shooting_days = op.create_table(
+        "shootingdays",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("first_datetime", sa.DateTime(), nullable=False),
+        sa.Column("first_pixel_hash", sa.String(length=32), nullable=True),
+        sa.Column("last_datetime", sa.DateTime(), nullable=False),
+        sa.Column("last_pixel_hash", sa.String(length=32), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=False,
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("day"),
+    )
+
+    _backfill_shooting_days(shooting_days)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("shootingdays")
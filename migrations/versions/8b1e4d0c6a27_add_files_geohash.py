@@ -0,0 +1,103 @@
+"""Add files geohash
+
+Revision ID: 8b1e4d0c6a27
+Revises: 3f9a2c71b5e4
+Create Date: 2026-10-19 10:02:17.904561
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8b1e4d0c6a27"
+down_revision: Union[str, Sequence[str], None] = "3f9a2c71b5e4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Copy of the geohash encoding of the application at this revision, so that this migration does
+# not change along with the application code
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 12
+# Files read and updated per round trip by the backfill
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _cell_index(value: float, minimum: float, span: float, bits: int) -> int:
+    index = int((value - minimum) / span * (1 << bits))
+    return min(max(index, 0), (1 << bits) - 1)
+
+
+def _encode_geohash(latitude: float, longitude: float) -> str:
+    total_bits = GEOHASH_PRECISION * 5
+    lon_bits, lat_bits = (total_bits + 1) // 2, total_bits // 2
+    lon_index = _cell_index(longitude, -180.0, 360.0, lon_bits)
+    lat_index = _cell_index(latitude, -90.0, 180.0, lat_bits)
+    value = 0
+    for bit in range(total_bits):
+        # Even bits come from the longitude, odd bits from the latitude (most significant first)
+        if bit % 2 == 0:
+            lon_bits -= 1
+            value = (value << 1) | ((lon_index >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            value = (value << 1) | ((lat_index >> lat_bits) & 1)
+
+    chars = []
+    for _ in range(GEOHASH_PRECISION):
+        chars.append(GEOHASH_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def _backfill_geohash() -> None:
+    files = sa.table(
+        "files",
+        sa.column("id", sa.Integer),
+        sa.column("latitude", sa.Float),
+        sa.column("longitude", sa.Float),
+        sa.column("geohash", sa.String),
+    )
+    bind = op.get_bind()
+    update = files.update().where(files.c.id == sa.bindparam("file_id"))
+    last_id = 0
+    while True:
+        # Paged by id, so that the whole table is never held in memory
+        rows = bind.execute(
+            sa.select(files.c.id, files.c.latitude, files.c.longitude)
+            .where(
+                files.c.id > last_id, files.c.latitude.is_not(None), files.c.longitude.is_not(None)
+            )
+            .order_by(files.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        bind.execute(
+            update,
+            [
+                {"file_id": row.id, "geohash": _encode_geohash(row.latitude, row.longitude)}
+                for row in rows
+            ],
+        )
+        last_id = rows[-1].id
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("files") as batch_op:
+        batch_op.add_column(sa.Column("geohash", sa.String(length=12), nullable=True))
+
+    _backfill_geohash()
+
+    op.create_index("ix_files_geohash_id", "files", ["geohash", "id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_files_geohash_id", table_name="files")
+
+    with op.batch_alter_table("files") as batch_op:
+        batch_op.drop_column("geohash")
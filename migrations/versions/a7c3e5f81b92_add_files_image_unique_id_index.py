@@ -0,0 +1,27 @@
+"""Add files image_unique_id index
+
+Revision ID: a7c3e5f81b92
+Revises: 5e2b8f4a9d16
+Create Date: 2026-10-19 16:41:08.212417
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "a7c3e5f81b92"
+down_revision: Union[str, Sequence[str], None] = "5e2b8f4a9d16"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_files_image_unique_id", "files", ["image_unique_id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_files_image_unique_id", table_name="files")
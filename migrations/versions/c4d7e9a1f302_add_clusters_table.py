@@ -0,0 +1,85 @@
+"""Add clusters table
+
+Revision ID: c4d7e9a1f302
+Revises: 8b1e4d0c6a27
+Create Date: 2026-10-19 11:26:54.217839
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c4d7e9a1f302"
+down_revision: Union[str, Sequence[str], None] = "8b1e4d0c6a27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MAX_CLUSTER_PRECISION = 8
+
+
+def _backfill_clusters(clusters: sa.Table) -> None:
+    """Aggregate the already geotagged files for every cluster precision."""
+    files = sa.table(
+        "files",
+        sa.column("latitude", sa.Float),
+        sa.column("longitude", sa.Float),
+        sa.column("geohash", sa.String),
+        sa.column("pixel_hash", sa.String),
+    )
+    for precision in range(1, MAX_CLUSTER_PRECISION + 1):
+        cell = sa.func.substr(files.c.geohash, 1, precision)
+        op.execute(
+            clusters.insert().from_select(
+                ["precision", "geohash", "count", "latitude_sum", "longitude_sum", "pixel_hash"],
+                sa.select(
+                    sa.literal(precision),
+                    cell,
+                    sa.func.count(),
+                    sa.func.sum(files.c.latitude),
+                    sa.func.sum(files.c.longitude),
+                    sa.func.min(files.c.pixel_hash),
+                )
+                .where(files.c.geohash.is_not(None))
+                .group_by(cell),
+            )
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    clusters = op.create_table(
+        "clusters",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("precision", sa.Integer(), nullable=False),
+        sa.Column("geohash", sa.String(length=12), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("latitude_sum", sa.Float(), nullable=False),
+        sa.Column("longitude_sum", sa.Float(), nullable=False),
+        sa.Column("pixel_hash", sa.String(length=32), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=False,
+        ),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(),
+            server_default=sa.text("(CURRENT_TIMESTAMP)"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("geohash"),
+    )
+    op.create_index("ix_clusters_precision_geohash", "clusters", ["precision", "geohash"])
+
+    _backfill_clusters(clusters)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_clusters_precision_geohash", table_name="clusters")
+    op.drop_table("clusters")
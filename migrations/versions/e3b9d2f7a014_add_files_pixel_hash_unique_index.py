@@ -0,0 +1,27 @@
+"""Add files pixel_hash unique index
+
+Revision ID: e3b9d2f7a014
+Revises: a7c3e5f81b92
+Create Date: 2026-10-19 18:12:45.530219
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e3b9d2f7a014"
+down_revision: Union[str, Sequence[str], None] = "a7c3e5f81b92"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_files_pixel_hash", "files", ["pixel_hash"], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_files_pixel_hash", table_name="files")
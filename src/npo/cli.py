@@ -0,0 +1,247 @@
+"""Command line interface of NPO: `npo <command> --help`."""
+
+import argparse
+import asyncio
+import hashlib
+import sys
+from pathlib import Path
+
+
+def _default_checkpoint(directory: Path) -> Path:
+    digest = hashlib.sha1(str(directory.resolve()).encode(), usedforsecurity=False).hexdigest()
+    return Path(f"npo-import-{digest[:12]}.jsonl")
+
+
+async def _open_database():
+    """Prepare the directories and database like the API startup does, and return a session."""
+    from sqlalchemy.ext.asyncio import AsyncSession  # noqa: PLC0415
+    from sqlalchemy.orm import sessionmaker  # noqa: PLC0415
+
+    from npo.database import engine, init_db  # noqa: PLC0415
+    from npo.dependencies import prepare_directories  # noqa: PLC0415
+
+    # The SQL statements echo is meant for the API logs, not for the console
+    engine.echo = False
+    prepare_directories()
+    await init_db()
+    return sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)()
+
+
+async def import_command(args: argparse.Namespace) -> int:
+    from npo.importer import Importer  # noqa: PLC0415
+
+    checkpoint = args.checkpoint or _default_checkpoint(args.directory)
+    print(f"Importing {args.directory} (checkpoint: {checkpoint})", file=sys.stderr)
+    async with await _open_database() as db:
+        importer = Importer(
+            db,
+            checkpoint,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            copy=args.copy,
+            progress_interval=args.progress_interval,
+        )
+        stats = await importer.run(args.directory)
+    return 1 if stats.errors else 0
+
+
+async def watch_command(args: argparse.Namespace) -> int:
+    from npo.importer import Importer  # noqa: PLC0415
+    from npo.watcher import Watcher  # noqa: PLC0415
+
+    async with await _open_database() as db:
+        importer = Importer(
+            db,
+            args.journal,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            copy=args.copy,
+            progress_interval=args.progress_interval,
+            remove_sources=not args.keep_sources,
+        )
+        watcher = Watcher(
+            importer,
+            args.directory,
+            settle_time=args.settle_time,
+            queue_size=args.queue_size,
+            rescan_interval=args.rescan_interval,
+        )
+        await watcher.run()
+    return 0
+
+
+async def rebalance_command(args: argparse.Namespace) -> int:
+    from npo.core.storage import plan_rebalance, rebalance  # noqa: PLC0415
+
+    if args.dry_run:
+        moves = list(plan_rebalance())
+        for move in moves:
+            print(f"{move.shard}: {move.source} -> {move.target}")
+        print(f"{len(moves)} shards to move", file=sys.stderr)
+        return 0
+
+    def on_move(move, count: int) -> None:
+        print(f"{move.shard}: {count} files moved from {move.source} to {move.target}")
+
+    async with await _open_database() as db:
+        moves = await rebalance(db, jobs=args.jobs, on_move=on_move)
+    print(f"{len(moves)} shards moved", file=sys.stderr)
+    return 0
+
+
+async def tiles_convert_command(args: argparse.Namespace) -> int:
+    from npo.core.tiles import convert_archives  # noqa: PLC0415
+
+    def on_convert(path: str, tiles: int) -> None:
+        print(f"{path}: {tiles} tiles")
+
+    count = await asyncio.to_thread(convert_archives, args.remove_archives, on_convert)
+    print(f"{count} archives converted", file=sys.stderr)
+    return 0
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="npo", description="Nature Photo Organizer tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser(
+        "import",
+        help="import a directory tree of photos",
+        description=(
+            "Import the images of a directory tree, running the ingestion pipeline in a pool of "
+            "processes. Interrupted imports resume where they stopped when run again."
+        ),
+    )
+    import_parser.add_argument("directory", type=Path)
+    import_parser.add_argument(
+        "--workers", type=int, default=None, help="worker processes (default: CPU count)"
+    )
+    import_parser.add_argument(
+        "--batch-size", type=int, default=100, help="files written per database transaction"
+    )
+    import_parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        default=None,
+        help="JSONL file of the processed files (default: npo-import-<hash of directory>.jsonl)",
+    )
+    import_parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="copy the files into the storage instead of hardlinking them",
+    )
+    import_parser.add_argument(
+        "--progress-interval", type=float, default=5.0, help="seconds between progress lines"
+    )
+    import_parser.set_defaults(handler=import_command)
+
+    watch_parser = commands.add_parser(
+        "watch",
+        help="ingest the files dropped in a directory",
+        description=(
+            "Watch a drop directory and ingest its files once they stop changing, through a pool "
+            "of processes. Imported files and duplicates are removed from the directory."
+        ),
+    )
+    watch_parser.add_argument(
+        "directory", type=Path, nargs="?", help="directory to watch (default: NPO_WATCH_DIR)"
+    )
+    watch_parser.add_argument(
+        "--workers", type=int, default=None, help="worker processes (default: CPU count)"
+    )
+    watch_parser.add_argument(
+        "--settle-time",
+        type=float,
+        default=2.0,
+        help="seconds without change before a file is ingested",
+    )
+    watch_parser.add_argument(
+        "--queue-size", type=int, default=1000, help="settled files waiting for a worker"
+    )
+    watch_parser.add_argument(
+        "--rescan-interval",
+        type=float,
+        default=300.0,
+        help="seconds between scans of the directory for missed events, 0 to disable",
+    )
+    watch_parser.add_argument(
+        "--batch-size", type=int, default=100, help="files written per database transaction"
+    )
+    watch_parser.add_argument(
+        "--journal", type=Path, default=None, help="JSONL file of the processed files"
+    )
+    watch_parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="copy the files into the storage instead of hardlinking them",
+    )
+    watch_parser.add_argument(
+        "--keep-sources",
+        action="store_true",
+        help="leave the ingested files in the directory",
+    )
+    watch_parser.add_argument(
+        "--progress-interval", type=float, default=60.0, help="seconds between progress lines"
+    )
+    watch_parser.set_defaults(handler=watch_command)
+
+    rebalance_parser = commands.add_parser(
+        "rebalance",
+        help="move the stored files to the volume their hash places them on",
+        description=(
+            "Move the shards of the storage (top-level directories of the hashed layout) which "
+            "are not on the volume NPO_STORAGE_VOLUMES places them on, after volumes were added, "
+            "removed or reweighted. Files stay readable while moved, an interrupted rebalance "
+            "resumes when run again."
+        ),
+    )
+    rebalance_parser.add_argument(
+        "--dry-run", action="store_true", help="only list the shards to move"
+    )
+    rebalance_parser.add_argument(
+        "--jobs", type=int, default=4, help="shards moved at the same time"
+    )
+    rebalance_parser.set_defaults(handler=rebalance_command)
+
+    tiles_parser = commands.add_parser("tiles", help="manage the tiles of the image pyramids")
+    tiles_commands = tiles_parser.add_subparsers(dest="tiles_command", required=True)
+    convert_parser = tiles_commands.add_parser(
+        "convert",
+        help="copy the tiles of the .szi archives to the SQLite packs",
+        description=(
+            "Copy the tiles of the pyramid archives (.szi) of every storage volume to the SQLite "
+            "packs of the pack tile backend (NPO_TILE_BACKEND=pack). Images not converted yet "
+            "are served from their archive, the conversion can run while the API serves tiles "
+            "and be run again after an interruption."
+        ),
+    )
+    convert_parser.add_argument(
+        "--remove-archives", action="store_true", help="remove each archive once converted"
+    )
+    convert_parser.set_defaults(handler=tiles_convert_command)
+
+    args = parser.parse_args(argv)
+    if args.command in ("rebalance", "tiles"):
+        return args
+    if args.command == "watch" and args.directory is None:
+        from npo import config  # noqa: PLC0415
+
+        if not config.settings.watch_dir:
+            parser.error("no directory given and NPO_WATCH_DIR is not set")
+        args.directory = Path(config.settings.watch_dir)
+    if not args.directory.is_dir():
+        parser.error(f"{args.directory} is not a directory")
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    try:
+        return asyncio.run(args.handler(args))
+    except KeyboardInterrupt:
+        print("Interrupted, run the same command again to resume.", file=sys.stderr)
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,8 @@
 """Application configuration settings."""
 
-from pydantic import field_validator
+from typing import Literal
+
+from pydantic import Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -16,10 +18,22 @@ class BackendSettings(CommonSettings):
     database_uri: str
     logger_name: str = "uvicorn.info"
     admin_email: str
+    admin_token: str | None = None
     uploads_dir: str
+    upload_expiry: int = 86400
     storage_dir: str
+    storage_volumes: dict[str, float] = {}
+    watch_dir: str | None = None
     hash_dir_parts_count: int = 6
     hash_dir_step: int = 2
+    tile_backend: Literal["szi", "pack"] = "szi"
+    tile_pack_dir: str | None = None
+    tile_pack_prefix_length: int = Field(1, ge=0, le=8)
+    tile_cache_bytes: int = Field(64 * 1024 * 1024, ge=0)
+    shared_cache_path: str | None = None
+    shared_cache_bytes: int = Field(256 * 1024 * 1024, ge=1024 * 1024)
+    trace_file: str | None = None
+    trace_sample_rate: float = Field(1.0, ge=0.0, le=1.0)
 
     model_config = SettingsConfigDict(env_file=".env", env_prefix="npo_", extra="ignore")
 
@@ -30,11 +44,20 @@ class BackendSettings(CommonSettings):
             return f"{v}/"
         return v
 
+    @field_validator("storage_volumes")
+    @classmethod
+    def check_storage_volumes(cls, v: dict[str, float]) -> dict[str, float]:
+        # A volume of weight 0 is drained by `npo rebalance` before being removed
+        if v and (min(v.values()) < 0 or max(v.values()) <= 0):
+            raise ValueError("storage volume weights must be positive or 0")
+        return {path if path.endswith("/") else f"{path}/": weight for path, weight in v.items()}
+
 
 class FrontendSettings(CommonSettings):
     """Frontend application settings."""
 
     zoom_max: int = 4
+    hash_partial_match_length: int = Field(6, ge=1, le=32)
 
     model_config = SettingsConfigDict(env_file=".env", env_prefix="npo_", extra="ignore")
 
@@ -1,21 +1,171 @@
-from sqlalchemy import select
+import json
+import time
+from dataclasses import asdict, dataclass
+
+from sqlalchemy import or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from npo import config
+from npo.core.hash_index import HASH_LENGTH, AmbiguousHashError, hash_index, is_hash_prefix
+from npo.core.shared_cache import get_shared_cache
 from npo.models.file import File as FileStorage
 
+# Seconds between two reads of the files stored by the other workers into the hash index
+HASH_INDEX_SYNC_INTERVAL = 5.0
+# Ids below the last one read which are read again by each sync: a transaction committed after
+# a later one (an import batch, for instance) makes rows with lower ids visible afterwards
+HASH_INDEX_SYNC_WINDOW = 1000
+# Prefixes missing from the hash index looked up in the database by a single query
+PREFIX_LOOKUP_CHUNK_SIZE = 100
+
+
+@dataclass(frozen=True)
+class FileLocation:
+    """Fields of a stored file needed to serve its image and tiles."""
+
+    pixel_hash: str
+    path_hash_dir: str
+    path_hash_file: str
+    mime: str | None
+
 
 async def get_file_by_file_hash(file_hash: str, db: AsyncSession) -> FileStorage | None:
-    stmt = select(FileStorage).filter(FileStorage.hash.ilike(f"{file_hash}%"))
+    stmt = select(FileStorage).filter_by(file_hash=file_hash)
     result = await db.execute(stmt)
     return result.scalar_one_or_none()
 
 
+async def sync_hash_index(db: AsyncSession, force: bool = False) -> None:
+    """
+    Add to the hash index the files stored since its last sync, by this worker or another one,
+    at most every HASH_INDEX_SYNC_INTERVAL seconds unless forced. The last HASH_INDEX_SYNC_WINDOW
+    ids already read are read again, for the rows committed late.
+    """
+    now = time.monotonic()
+    if (
+        not force
+        and hash_index.synced_at is not None
+        and now - hash_index.synced_at < HASH_INDEX_SYNC_INTERVAL
+    ):
+        return
+    hash_index.synced_at = now
+    stmt = (
+        select(FileStorage.id, FileStorage.pixel_hash)
+        .where(FileStorage.id > hash_index.synced_id - HASH_INDEX_SYNC_WINDOW)
+        .order_by(FileStorage.id)
+    )
+    rows = (await db.execute(stmt)).all()
+    if rows:
+        hash_index.update(
+            row.pixel_hash for row in rows if row.pixel_hash and row.id not in hash_index.recent_ids
+        )
+        hash_index.synced_id = max(hash_index.synced_id, rows[-1].id)
+        window_start = hash_index.synced_id - HASH_INDEX_SYNC_WINDOW
+        hash_index.recent_ids = {row.id for row in rows if row.id > window_start}
+
+
+async def resolve_pixel_hash(pixel_hash: str, db: AsyncSession) -> str | None:
+    """
+    Complete pixel hash of the stored file whose hash starts with the given one, resolved by
+    the hash index without querying the database. A prefix missing from the index (a file just
+    stored by another worker) is still looked up in the database. Raise AmbiguousHashError when
+    several files match.
+    """
+    if len(pixel_hash) == HASH_LENGTH:
+        return pixel_hash.lower()
+    await sync_hash_index(db)
+    matches = hash_index.find(pixel_hash)
+    if not matches and is_hash_prefix(pixel_hash):
+        stmt = (
+            select(FileStorage.pixel_hash)
+            .filter(FileStorage.pixel_hash.ilike(f"{pixel_hash}%"))
+            .limit(2)
+        )
+        matches = list((await db.execute(stmt)).scalars())
+        hash_index.update(matches)
+    if len(matches) > 1:
+        raise AmbiguousHashError(pixel_hash)
+    return matches[0] if matches else None
+
+
+async def resolve_pixel_hashes(pixel_hashes: list[str], db: AsyncSession) -> dict[str, str]:
+    """
+    Complete pixel hashes of several hashes or prefixes, like resolve_pixel_hash, those not
+    found being left out. The prefixes missing from the hash index are looked up together.
+    """
+    resolved = {}
+    missing = []
+    for pixel_hash in dict.fromkeys(pixel_hashes):
+        if len(pixel_hash) == HASH_LENGTH:
+            resolved[pixel_hash] = pixel_hash.lower()
+        elif is_hash_prefix(pixel_hash):
+            missing.append(pixel_hash)
+    if missing:
+        await sync_hash_index(db)
+        missing = [pixel_hash for pixel_hash in missing if not hash_index.find(pixel_hash)]
+    # Only files stored since the last sync can match, whatever the length of the prefixes
+    for start in range(0, len(missing), PREFIX_LOOKUP_CHUNK_SIZE):
+        chunk = missing[start : start + PREFIX_LOOKUP_CHUNK_SIZE]
+        stmt = select(FileStorage.pixel_hash).where(
+            or_(*(FileStorage.pixel_hash.ilike(f"{pixel_hash}%") for pixel_hash in chunk))
+        )
+        hash_index.update((await db.execute(stmt)).scalars())
+    for pixel_hash in pixel_hashes:
+        if pixel_hash in resolved or not is_hash_prefix(pixel_hash):
+            continue
+        matches = hash_index.find(pixel_hash)
+        if len(matches) > 1:
+            raise AmbiguousHashError(pixel_hash)
+        if matches:
+            resolved[pixel_hash] = matches[0]
+    return resolved
+
+
+def get_short_hash(pixel_hash: str | None) -> str | None:
+    """
+    Shortest prefix of the pixel hash matching only this file among the files stored so far,
+    for short URLs. It may need to be longer once other files are stored.
+    """
+    if pixel_hash is None:
+        return None
+    return hash_index.shortest_prefix(pixel_hash, config.settings.hash_partial_match_length)
+
+
 async def get_file_by_pixel_hash(pixel_hash: str, db: AsyncSession) -> FileStorage | None:
-    stmt = select(FileStorage).filter(FileStorage.pixel_hash.ilike(f"{pixel_hash}%"))
+    """Stored file of a pixel hash or of a prefix of it, see resolve_pixel_hash."""
+    full_pixel_hash = await resolve_pixel_hash(pixel_hash, db)
+    if full_pixel_hash is None:
+        return None
+    stmt = select(FileStorage).filter_by(pixel_hash=full_pixel_hash)
     result = await db.execute(stmt)
     return result.scalar_one_or_none()
 
 
+async def get_file_location(pixel_hash: str, db: AsyncSession) -> FileLocation | None:
+    """
+    Resolve a pixel hash like get_file_by_pixel_hash, through the cache shared by the workers
+    if configured. Only complete hashes are cached: a prefix could match another file later.
+    Unlike the tile and image reads, concurrent lookups are not coalesced: a session belongs to
+    the request which opened it.
+    """
+    cache = get_shared_cache()
+    if cache and (data := cache.view("file").get((pixel_hash,))):
+        return FileLocation(**json.loads(data))
+
+    file_storage = await get_file_by_pixel_hash(pixel_hash, db)
+    if file_storage is None:
+        return None
+    location = FileLocation(
+        pixel_hash=file_storage.pixel_hash,
+        path_hash_dir=file_storage.path_hash_dir,
+        path_hash_file=file_storage.path_hash_file,
+        mime=file_storage.mime,
+    )
+    if cache and file_storage.pixel_hash == pixel_hash:
+        cache.view("file").put((pixel_hash,), json.dumps(asdict(location)).encode())
+    return location
+
+
 async def get_file_by_perceptual_hash(perceptual_hash: str, db: AsyncSession) -> FileStorage | None:
     stmt = select(FileStorage).filter(FileStorage.perceptual_hash.ilike(f"{perceptual_hash}%"))
     result = await db.execute(stmt)
@@ -26,3 +176,13 @@ async def get_file_by_image_unique_id(image_unique_id: str, db: AsyncSession) ->
     stmt = select(FileStorage).filter_by(image_unique_id=image_unique_id)
     result = await db.execute(stmt)
     return result.scalar_one_or_none()
+
+
+async def update_shard_paths(shard: str, volume: str, db: AsyncSession) -> None:
+    """Point the stored paths of the files of a shard to the volume it was moved to."""
+    stmt = (
+        update(FileStorage)
+        .where(FileStorage.path_hash_dir.startswith(f"{shard}/"))
+        .values(path=volume + FileStorage.path_hash_dir + FileStorage.path_hash_file + ".jpg")
+    )
+    await db.execute(stmt)
@@ -0,0 +1,154 @@
+"""Geohash helpers used to index and query geotagged files.
+
+A geohash interleaves longitude and latitude bits and encodes them in base 32, so files close to
+each other share a common prefix. Stored in a plain B-tree indexed column, it turns a bounding box
+query into a few range scans on both SQLite and PostgreSQL.
+"""
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 12
+# Upper bound of geohash cells used to cover a bounding box (one range scan per merged cell run)
+MAX_COVER_CELLS = 32
+
+MIN_LONGITUDE, MAX_LONGITUDE = -180.0, 180.0
+MIN_LATITUDE, MAX_LATITUDE = -90.0, 90.0
+
+
+def _bits(precision: int) -> tuple[int, int]:
+    """Return the number of longitude and latitude bits of a geohash with this precision."""
+    total = precision * 5
+    return (total + 1) // 2, total // 2
+
+
+def _cell_index(value: float, minimum: float, span: float, bits: int) -> int:
+    index = int((value - minimum) / span * (1 << bits))
+    return min(max(index, 0), (1 << bits) - 1)
+
+
+def _interleave(lon_index: int, lat_index: int, precision: int) -> str:
+    lon_bits, lat_bits = _bits(precision)
+    value = 0
+    for bit in range(precision * 5):
+        # Even bits come from the longitude, odd bits from the latitude (most significant first)
+        if bit % 2 == 0:
+            lon_bits -= 1
+            value = (value << 1) | ((lon_index >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            value = (value << 1) | ((lat_index >> lat_bits) & 1)
+
+    chars = []
+    for _ in range(precision):
+        chars.append(GEOHASH_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def encode_geohash(
+    latitude: float | None, longitude: float | None, precision: int = GEOHASH_PRECISION
+) -> str | None:
+    if latitude is None or longitude is None:
+        return None
+    lon_bits, lat_bits = _bits(precision)
+    return _interleave(
+        _cell_index(longitude, MIN_LONGITUDE, 360.0, lon_bits),
+        _cell_index(latitude, MIN_LATITUDE, 180.0, lat_bits),
+        precision,
+    )
+
+
+def next_geohash(geohash: str) -> str | None:
+    """Return the smallest geohash greater than every geohash starting with this prefix."""
+    chars = list(geohash)
+    while chars:
+        position = GEOHASH_ALPHABET.index(chars[-1])
+        if position < len(GEOHASH_ALPHABET) - 1:
+            chars[-1] = GEOHASH_ALPHABET[position + 1]
+            return "".join(chars)
+        chars.pop()
+    return None
+
+
+def _covering_indexes(
+    bbox: tuple[float, float, float, float], precision: int
+) -> tuple[range, range]:
+    min_lon, min_lat, max_lon, max_lat = bbox
+    lon_bits, lat_bits = _bits(precision)
+    lon_range = range(
+        _cell_index(min_lon, MIN_LONGITUDE, 360.0, lon_bits),
+        _cell_index(max_lon, MIN_LONGITUDE, 360.0, lon_bits) + 1,
+    )
+    lat_range = range(
+        _cell_index(min_lat, MIN_LATITUDE, 180.0, lat_bits),
+        _cell_index(max_lat, MIN_LATITUDE, 180.0, lat_bits) + 1,
+    )
+    return lon_range, lat_range
+
+
+def covering_precision(
+    bbox: tuple[float, float, float, float],
+    max_cells: int = MAX_COVER_CELLS,
+    max_precision: int = GEOHASH_PRECISION,
+) -> int:
+    """Return the finest geohash precision covering the bbox with at most max_cells cells."""
+    best = 1
+    for precision in range(1, max_precision + 1):
+        lon_range, lat_range = _covering_indexes(bbox, precision)
+        if len(lon_range) * len(lat_range) > max_cells:
+            break
+        best = precision
+    return best
+
+
+def covering_cells(bbox: tuple[float, float, float, float], precision: int) -> list[str]:
+    lon_range, lat_range = _covering_indexes(bbox, precision)
+    return sorted(
+        _interleave(lon_index, lat_index, precision)
+        for lon_index in lon_range
+        for lat_index in lat_range
+    )
+
+
+def covering_ranges(
+    bbox: tuple[float, float, float, float],
+    max_cells: int = MAX_COVER_CELLS,
+    max_precision: int = GEOHASH_PRECISION,
+) -> list[tuple[str, str | None]]:
+    """
+    Return [start, end) geohash ranges covering the bbox, end being None when unbounded.
+    Contiguous cells are merged so that each range maps to a single index range scan.
+    """
+    ranges: list[tuple[str, str | None]] = []
+    precision = covering_precision(bbox, max_cells, max_precision)
+    for cell in covering_cells(bbox, precision):
+        if ranges and ranges[-1][1] == cell:
+            ranges[-1] = (ranges[-1][0], next_geohash(cell))
+        else:
+            ranges.append((cell, next_geohash(cell)))
+    return ranges
+
+
+def zoom_to_precision(zoom: int, max_precision: int = GEOHASH_PRECISION) -> int:
+    """
+    Return the geohash precision whose cells are about a quarter of a web map tile wide
+    at this zoom level, so that a tile shows a handful of clusters.
+    """
+    for precision in range(1, max_precision + 1):
+        lon_bits, _ = _bits(precision)
+        if lon_bits >= zoom + 2:
+            return precision
+    return max_precision
+
+
+def parse_bbox(bbox: str) -> tuple[float, float, float, float]:
+    """
+    Parse a "min_lon,min_lat,max_lon,max_lat" bounding box.
+    Raises ValueError if it is malformed or crosses the antimeridian.
+    """
+    min_lon, min_lat, max_lon, max_lat = (float(part) for part in bbox.split(","))
+    if not (
+        MIN_LONGITUDE <= min_lon <= max_lon <= MAX_LONGITUDE
+        and MIN_LATITUDE <= min_lat <= max_lat <= MAX_LATITUDE
+    ):
+        raise ValueError(bbox)
+    return min_lon, min_lat, max_lon, max_lat
@@ -0,0 +1,114 @@
+"""In-memory index of the pixel hashes of the stored files, to resolve short hashes.
+
+The hashes are kept sorted as 16 bytes records of a single bytearray (16 MB for a million
+files, without an object per hash). The hashes starting with a prefix are contiguous, so that
+a prefix is resolved by a binary search, and the shortest prefix telling a hash apart from all
+the others only depends on its two neighbors. Files are never deleted: the index only grows.
+"""
+
+import os
+import string
+from collections.abc import Iterable
+
+HASH_SIZE = 16
+HASH_LENGTH = 2 * HASH_SIZE
+# Above this number of new hashes, the index is rebuilt rather than inserted into
+REBUILD_THRESHOLD = 1024
+
+
+class AmbiguousHashError(ValueError):
+    """A pixel hash prefix matching several stored files."""
+
+    def __init__(self, prefix: str):
+        super().__init__(f"Pixel hash {prefix} matches several files.")
+        self.prefix = prefix
+
+
+def is_hash_prefix(value: str) -> bool:
+    return 0 < len(value) <= HASH_LENGTH and all(char in string.hexdigits for char in value)
+
+
+class HashIndex:
+    """
+    Sorted pixel hashes, with the id of the last file row read from the database and the ids
+    read among the ones below it which sync_hash_index reads again.
+    """
+
+    def __init__(self):
+        self._hashes = bytearray()
+        self.synced_id = 0
+        self.synced_at: float | None = None
+        self.recent_ids: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._hashes) // HASH_SIZE
+
+    def _get(self, index: int) -> bytes:
+        return bytes(self._hashes[index * HASH_SIZE : (index + 1) * HASH_SIZE])
+
+    def _bisect(self, value: bytes) -> int:
+        """Index of the first hash not lower than the value."""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._get(middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __contains__(self, pixel_hash: str) -> bool:
+        value = bytes.fromhex(pixel_hash)
+        return self._get(self._bisect(value)) == value
+
+    def add(self, pixel_hash: str) -> None:
+        value = bytes.fromhex(pixel_hash)
+        index = self._bisect(value)
+        if self._get(index) != value:
+            self._hashes[index * HASH_SIZE : index * HASH_SIZE] = value
+
+    def update(self, pixel_hashes: Iterable[str]) -> None:
+        values = {bytes.fromhex(pixel_hash) for pixel_hash in pixel_hashes}
+        if len(values) < REBUILD_THRESHOLD:
+            for value in values:
+                self.add(value.hex())
+            return
+        values.update(self._get(index) for index in range(len(self)))
+        self._hashes = bytearray(b"".join(sorted(values)))
+
+    def find(self, prefix: str, limit: int = 2) -> list[str]:
+        """Hashes starting with the prefix, at most limit of them."""
+        if not is_hash_prefix(prefix):
+            return []
+        prefix = prefix.lower()
+        index = self._bisect(bytes.fromhex(prefix.ljust(HASH_LENGTH, "0")))
+        matches = []
+        while index < len(self) and len(matches) < limit:
+            pixel_hash = self._get(index).hex()
+            if not pixel_hash.startswith(prefix):
+                break
+            matches.append(pixel_hash)
+            index += 1
+        return matches
+
+    def shortest_prefix(self, pixel_hash: str, min_length: int = 1) -> str:
+        """Shortest prefix of the hash, of min_length at least, matching no other hash."""
+        value = bytes.fromhex(pixel_hash)
+        index = self._bisect(value)
+        following = index + 1 if self._get(index) == value else index
+        length = min_length
+        for neighbor in (index - 1, following):
+            if 0 <= neighbor < len(self):
+                common = os.path.commonprefix([pixel_hash, self._get(neighbor).hex()])
+                length = max(length, len(common) + 1)
+        return pixel_hash[: min(length, HASH_LENGTH)]
+
+    def clear(self) -> None:
+        self._hashes = bytearray()
+        self.synced_id = 0
+        self.synced_at = None
+        self.recent_ids = set()
+
+
+# Index of the worker, filled at startup and kept up to date by sync_hash_index
+hash_index = HashIndex()
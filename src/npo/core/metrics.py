@@ -0,0 +1,254 @@
+"""In-process metrics exposed in the Prometheus text exposition format.
+
+Metrics are kept per process: with several uvicorn workers, each worker exposes its own values
+and the scraper aggregates them.
+"""
+
+import functools
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+from npo.core.tracing import span
+
+# Latency buckets in seconds, from fast DB lookups to slow pyramid generation of large images
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: tuple[str, ...], labelvalues: tuple[str, ...], **extra) -> str:
+    pairs = [*zip(labelnames, labelvalues, strict=True), *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}{labels} {_format_number(value)}"
+
+    def render(self) -> str:
+        header = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        return "\n".join([*header, *self.samples()])
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = (*sorted(buckets), float("inf"))
+        # For each label set: [count per bucket..., sum]
+        self._observations: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            observations = self._observations.setdefault(key, [0] * len(self.buckets) + [0.0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    observations[index] += 1
+                    break
+            observations[-1] += value
+
+    def count(self, **labels) -> int:
+        observations = self._observations.get(self._key(labels))
+        return sum(observations[:-1]) if observations else 0
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            observations = [(key, list(values)) for key, values in self._observations.items()]
+        for labelvalues, values in observations:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, values[:-1], strict=True):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, le=_format_number(bound))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_number(values[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(
+    Histogram(
+        "npo_http_request_duration_seconds",
+        "HTTP request latency by route template.",
+        ("method", "route", "status"),
+    )
+)
+PIPELINE_STAGE_DURATION = REGISTRY.register(
+    Histogram(
+        "npo_pipeline_stage_duration_seconds",
+        "Latency of each ingestion and serving pipeline stage.",
+        ("stage",),
+    )
+)
+DUPLICATES_REJECTED = REGISTRY.register(
+    Counter(
+        "npo_duplicates_rejected_total",
+        "Uploaded files rejected as duplicates, by detection method.",
+        ("reason",),
+    )
+)
+INGESTED_FILES = REGISTRY.register(
+    Counter("npo_ingested_files_total", "Files stored by the ingestion pipeline.")
+)
+INGESTED_BYTES = REGISTRY.register(
+    Counter("npo_ingested_bytes_total", "Bytes of original files stored by the ingestion pipeline.")
+)
+TILES_SERVED = REGISTRY.register(Counter("npo_tiles_served_total", "Deep zoom tiles served."))
+TILE_CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "npo_tile_cache_requests_total",
+        "Tile reads looked up in the tile cache, by result (hit or miss).",
+        ("result",),
+    )
+)
+TILE_CACHE_HIT_BYTES = REGISTRY.register(
+    Counter("npo_tile_cache_hit_bytes_total", "Bytes of tiles served from the tile cache.")
+)
+TILE_CACHE_PREFETCHED = REGISTRY.register(
+    Counter("npo_tile_cache_prefetched_total", "Tiles read ahead into the tile cache.")
+)
+TILE_CACHE_SIZE = REGISTRY.register(
+    Gauge("npo_tile_cache_bytes", "Bytes of tiles held by the tile cache.")
+)
+SHARED_CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "npo_shared_cache_requests_total",
+        "Lookups in the cache shared by the workers, by kind of entry and result (hit or miss).",
+        ("kind", "result"),
+    )
+)
+SHARED_CACHE_HIT_BYTES = REGISTRY.register(
+    Counter(
+        "npo_shared_cache_hit_bytes_total",
+        "Bytes served from the cache shared by the workers, by kind of entry.",
+        ("kind",),
+    )
+)
+COALESCED_CALLS = REGISTRY.register(
+    Counter(
+        "npo_coalesced_calls_total",
+        "Calls served by an identical call already in flight, by kind of work.",
+        ("kind",),
+    )
+)
+UPLOADS_IN_PROGRESS = REGISTRY.register(
+    Gauge("npo_uploads_in_progress", "Upload requests currently being processed.")
+)
+
+
+def timed_stage(stage: str) -> Callable:
+    """
+    Decorator recording the duration of an async pipeline stage, failed calls included,
+    and opening a span of the same name in the current request trace.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with PIPELINE_STAGE_DURATION.time(stage=stage), span(stage):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,144 @@
+"""Streaming parser of multipart/form-data request bodies.
+
+Unlike Starlette's form parsing, which spools every file of the request to a temporary file
+before the endpoint runs, the files are written as their data arrives to a directory chosen by
+the caller, and hashed on the way. Each file is yielded as soon as its part ends, so that it can
+be processed while the next ones are still being received.
+"""
+
+import hashlib
+import os
+import secrets
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+class MultipartError(ValueError):
+    """Malformed multipart body."""
+
+
+@dataclass
+class ReceivedFile:
+    field_name: str
+    filename: str
+    content_type: str | None
+    path: str
+    size: int
+    md5: str
+
+
+class _Part:
+    def __init__(self):
+        self.headers: dict[bytes, bytes] = {}
+        self.field_name = ""
+        self.filename: str | None = None
+        self.content_type: str | None = None
+        self.path: str | None = None
+        self.output = None
+        self.hasher = None
+        self.size = 0
+
+
+class MultipartReceiver:
+    """Write the files of a multipart body to a directory, skipping the other fields."""
+
+    def __init__(self, content_type: str, directory: str):
+        media_type, options = parse_options_header(content_type)
+        if media_type != b"multipart/form-data" or b"boundary" not in options:
+            raise MultipartError("Expected a multipart/form-data body with a boundary.")
+        self.directory = directory
+        self.parser = MultipartParser(
+            options[b"boundary"],
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+        self._part = _Part()
+        self._header_field = b""
+        self._header_value = b""
+        self._received: list[ReceivedFile] = []
+
+    def _on_part_begin(self) -> None:
+        self._part = _Part()
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._part.headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        part = self._part
+        _, options = parse_options_header(part.headers.get(b"content-disposition", b""))
+        part.field_name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        if b"filename" not in options:
+            return
+        # Only the base name of the client path, it is used to name the stored file
+        part.filename = os.path.basename(options[b"filename"].decode("utf-8", errors="replace"))
+        if content_type := part.headers.get(b"content-type"):
+            part.content_type = content_type.decode("latin-1")
+        part.path = os.path.join(self.directory, f"{secrets.token_hex(16)}.part")
+        part.output = open(part.path, "wb")  # noqa: SIM115
+        part.hasher = hashlib.md5(usedforsecurity=False)
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        part = self._part
+        if part.output:
+            chunk = data[start:end]
+            part.output.write(chunk)
+            part.hasher.update(chunk)
+            part.size += len(chunk)
+
+    def _on_part_end(self) -> None:
+        part = self._part
+        if part.output:
+            part.output.close()
+            part.output = None
+            self._received.append(
+                ReceivedFile(
+                    field_name=part.field_name,
+                    filename=part.filename,
+                    content_type=part.content_type,
+                    path=part.path,
+                    size=part.size,
+                    md5=part.hasher.hexdigest(),
+                )
+            )
+
+    def close(self) -> None:
+        """Remove the files not handed to the caller, such as the one of an interrupted part."""
+        if self._part.output:
+            self._part.output.close()
+            self._part.output = None
+            os.remove(self._part.path)
+        for received_file in self._received:
+            os.remove(received_file.path)
+        self._received = []
+
+    async def receive(self, stream: AsyncIterator[bytes]) -> AsyncIterator[ReceivedFile]:
+        """Yield the files of the body as they are received."""
+        try:
+            async for chunk in stream:
+                if chunk:
+                    try:
+                        self.parser.write(chunk)
+                    except MultipartParseError as error:
+                        raise MultipartError(str(error)) from None
+                while self._received:
+                    yield self._received.pop(0)
+            self.parser.finalize()
+        finally:
+            self.close()
@@ -0,0 +1,297 @@
+"""Cache shared by the worker processes of a host, in a memory mapped file.
+
+The segment (a file of /dev/shm, for instance) is split into shards, each with its own lock: a
+byte range lock (fcntl) between processes and a thread lock within a process, so that workers
+only wait for each other when using the same shard. A shard holds:
+
+- a header with the write position, a count of the bytes written to the shard since its
+  creation;
+- an index of buckets of slots, each slot giving the hash of a key and the write position of
+  its record;
+- a ring of records (key hash, length, value), written one after the other at the write
+  position and wrapping around, the oldest records being overwritten by the new ones.
+
+A slot is valid while its record was not overwritten, which the write position tells, and
+while the hash in the record matches. Eviction is thus first in, first out, without any
+bookkeeping on reads. A segment full of zeros is an empty cache: the file is created and sized
+by the first worker, the others map it as is. Its name ends with a hash of the layout, so that
+workers of another size or release, during a deployment, use their own segment instead of
+emptying the one mapped by the others.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from functools import lru_cache
+
+from npo import config
+from npo.core.metrics import SHARED_CACHE_HIT_BYTES, SHARED_CACHE_REQUESTS
+
+MAGIC = b"NPOCACHE"
+VERSION = 1
+# Magic, version, shards, buckets per shard, ring bytes per shard
+SEGMENT_HEADER = struct.Struct("<8sIIIQ")
+SEGMENT_HEADER_SIZE = 4096
+SHARD_HEADER = struct.Struct("<Q")
+SHARD_HEADER_SIZE = 64
+# Hash of the key (16 bytes) and write position of the record
+SLOT = struct.Struct("<16sQ")
+SLOTS_PER_BUCKET = 4
+EMPTY_HASH = bytes(16)
+# Hash of the key (16 bytes), length of the value and padding
+RECORD_HEADER = struct.Struct("<16sI4x")
+RECORD_ALIGNMENT = 8
+
+SHARDS = 64
+# Expected mean size of the records, to size the index
+MEAN_RECORD_SIZE = 4096
+MIN_SHARD_SIZE = 64 * 1024
+# Byte of the segment locked while it is created or resized
+INIT_LOCK_OFFSET = SEGMENT_HEADER.size
+
+
+def key_hash(key: tuple) -> bytes:
+    return hashlib.blake2b("\0".join(map(str, key)).encode(), digest_size=16).digest()
+
+
+class SharedCache:
+    """Memory mapped cache of byte values by key, shared by the processes mapping its file."""
+
+    def __init__(self, path: str, size: int):
+        self.shards = max(1, min(SHARDS, size // MIN_SHARD_SIZE))
+        shard_size = (size - SEGMENT_HEADER_SIZE) // self.shards
+        self.buckets = max(1, shard_size // MEAN_RECORD_SIZE // SLOTS_PER_BUCKET)
+        index_size = self.buckets * SLOTS_PER_BUCKET * SLOT.size
+        self.ring_size = shard_size - SHARD_HEADER_SIZE - index_size
+        self.ring_size -= self.ring_size % RECORD_ALIGNMENT
+        self.shard_size = SHARD_HEADER_SIZE + index_size + self.ring_size
+        self.size = SEGMENT_HEADER_SIZE + self.shards * self.shard_size
+        self._header = SEGMENT_HEADER.pack(
+            MAGIC, VERSION, self.shards, self.buckets, self.ring_size
+        )
+        layout = hashlib.blake2b(self._header, digest_size=4).hexdigest()
+        self.path = f"{path}-{layout}"
+        self._locks = [threading.Lock() for _ in range(self.shards)]
+        self.views: dict[str, SharedCacheView] = {}
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            self._init_segment()
+        except Exception:
+            os.close(self._fd)
+            raise
+        self._map = mmap.mmap(self._fd, self.size)
+
+    def _init_segment(self) -> None:
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, INIT_LOCK_OFFSET)
+        try:
+            current = os.pread(self._fd, SEGMENT_HEADER.size, 0)
+            if current.strip(b"\0"):
+                # Never resized nor emptied: other workers may be using it
+                if current != self._header or os.fstat(self._fd).st_size != self.size:
+                    raise RuntimeError(f"Shared cache {self.path} of another layout.")
+            else:
+                # New segment, or one whose creation was interrupted
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(self._fd, self._header, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, INIT_LOCK_OFFSET)
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+    def _locate(self, hashed: bytes) -> tuple[int, int]:
+        """Shard and bucket of a key hash."""
+        number = int.from_bytes(hashed[:8], "little")
+        shard = number % self.shards
+        bucket = (number // self.shards) % self.buckets
+        return shard, bucket
+
+    def _lock(self, shard: int) -> None:
+        self._locks[shard].acquire()
+        # Locks a byte of the segment header per shard, between processes
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, INIT_LOCK_OFFSET + 1 + shard)
+
+    def _unlock(self, shard: int) -> None:
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, INIT_LOCK_OFFSET + 1 + shard)
+        self._locks[shard].release()
+
+    def _offsets(self, shard: int, bucket: int) -> tuple[int, int, int]:
+        """Offsets of the shard, of the bucket slots and of the ring."""
+        shard_offset = SEGMENT_HEADER_SIZE + shard * self.shard_size
+        slots_offset = shard_offset + SHARD_HEADER_SIZE + bucket * SLOTS_PER_BUCKET * SLOT.size
+        ring_offset = shard_offset + SHARD_HEADER_SIZE + self.buckets * SLOTS_PER_BUCKET * SLOT.size
+        return shard_offset, slots_offset, ring_offset
+
+    def _is_valid(self, position: int, write_position: int) -> bool:
+        # A record is overwritten once the write position went round the ring past it
+        return position < write_position <= position + self.ring_size
+
+    def _find(self, hashed: bytes, shard: int, bucket: int) -> tuple[int, int] | None:
+        """Slot index and record position of a key, under the shard lock."""
+        shard_offset, slots_offset, ring_offset = self._offsets(shard, bucket)
+        (write_position,) = SHARD_HEADER.unpack_from(self._map, shard_offset)
+        for index in range(SLOTS_PER_BUCKET):
+            slot_hash, position = SLOT.unpack_from(self._map, slots_offset + index * SLOT.size)
+            if slot_hash != hashed or not self._is_valid(position, write_position):
+                continue
+            record_hash, _ = RECORD_HEADER.unpack_from(
+                self._map, ring_offset + position % self.ring_size
+            )
+            if record_hash == hashed:
+                return index, position
+        return None
+
+    def get(self, key: tuple) -> bytes | None:
+        hashed = key_hash(key)
+        shard, bucket = self._locate(hashed)
+        self._lock(shard)
+        try:
+            found = self._find(hashed, shard, bucket)
+            if found is None:
+                return None
+            _, _, ring_offset = self._offsets(shard, bucket)
+            record_offset = ring_offset + found[1] % self.ring_size
+            _, length = RECORD_HEADER.unpack_from(self._map, record_offset)
+            start = record_offset + RECORD_HEADER.size
+            return self._map[start : start + length]
+        finally:
+            self._unlock(shard)
+
+    def __contains__(self, key: tuple) -> bool:
+        hashed = key_hash(key)
+        shard, bucket = self._locate(hashed)
+        self._lock(shard)
+        try:
+            return self._find(hashed, shard, bucket) is not None
+        finally:
+            self._unlock(shard)
+
+    def put(self, key: tuple, value: bytes) -> None:
+        record_size = RECORD_HEADER.size + len(value)
+        record_size += -record_size % RECORD_ALIGNMENT
+        if record_size > self.ring_size:
+            return
+        hashed = key_hash(key)
+        shard, bucket = self._locate(hashed)
+        shard_offset, slots_offset, ring_offset = self._offsets(shard, bucket)
+        self._lock(shard)
+        try:
+            (write_position,) = SHARD_HEADER.unpack_from(self._map, shard_offset)
+            # Records are contiguous: one not fitting before the end of the ring starts it over
+            remaining = self.ring_size - write_position % self.ring_size
+            if record_size > remaining:
+                write_position += remaining
+            position = write_position
+            record_offset = ring_offset + position % self.ring_size
+            RECORD_HEADER.pack_into(self._map, record_offset, hashed, len(value))
+            start = record_offset + RECORD_HEADER.size
+            self._map[start : start + len(value)] = value
+            write_position += record_size
+            SHARD_HEADER.pack_into(self._map, shard_offset, write_position)
+
+            # Slot of the same key, else a free or stale one, else the oldest one
+            slots = [
+                SLOT.unpack_from(self._map, slots_offset + index * SLOT.size)
+                for index in range(SLOTS_PER_BUCKET)
+            ]
+
+            def priority(index: int) -> tuple[int, int]:
+                slot_hash, slot_position = slots[index]
+                if slot_hash == hashed:
+                    return (0, 0)
+                if (
+                    slot_hash == EMPTY_HASH
+                    or slot_position == position
+                    or not self._is_valid(slot_position, write_position)
+                ):
+                    return (1, 0)
+                return (2, slot_position)
+
+            index = min(range(SLOTS_PER_BUCKET), key=priority)
+            SLOT.pack_into(self._map, slots_offset + index * SLOT.size, hashed, position)
+        finally:
+            self._unlock(shard)
+
+    def stats(self) -> dict:
+        written = sum(
+            SHARD_HEADER.unpack_from(self._map, SEGMENT_HEADER_SIZE + shard * self.shard_size)[0]
+            for shard in range(self.shards)
+        )
+        return {
+            "path": self.path,
+            "bytes": min(written, self.shards * self.ring_size),
+            "max_bytes": self.shards * self.ring_size,
+            "written_bytes": written,
+        }
+
+    def view(self, kind: str) -> "SharedCacheView":
+        """Entries of a kind, counting the hits and misses of this process."""
+        if kind not in self.views:
+            self.views[kind] = SharedCacheView(self, kind)
+        return self.views[kind]
+
+
+class SharedCacheView:
+    """
+    Entries of a kind (tiles, files...) of the shared cache, with the interface of TileCache
+    and the hits and misses of this process.
+    """
+
+    def __init__(self, cache: SharedCache, kind: str):
+        self.cache = cache
+        self.kind = kind
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+
+    def get(self, key: tuple) -> bytes | None:
+        data = self.cache.get((self.kind, *key))
+        if data is None:
+            self.misses += 1
+            SHARED_CACHE_REQUESTS.inc(kind=self.kind, result="miss")
+        else:
+            self.hits += 1
+            self.hit_bytes += len(data)
+            SHARED_CACHE_REQUESTS.inc(kind=self.kind, result="hit")
+            SHARED_CACHE_HIT_BYTES.inc(len(data), kind=self.kind)
+        return data
+
+    def put(self, key: tuple, data: bytes, prefetched: bool = False) -> None:  # noqa: ARG002
+        self.cache.put((self.kind, *key), data)
+
+    def __contains__(self, key: tuple) -> bool:
+        return (self.kind, *key) in self.cache
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else None,
+            "hit_bytes": self.hit_bytes,
+        }
+
+
+@lru_cache
+def _get_shared_cache(path: str, size: int, pid: int) -> SharedCache:
+    return SharedCache(path, size)
+
+
+def get_shared_cache() -> SharedCache | None:
+    """Shared cache of the host if configured, mapped once per process."""
+    if not config.settings.shared_cache_path:
+        return None
+    return _get_shared_cache(
+        config.settings.shared_cache_path, config.settings.shared_cache_bytes, os.getpid()
+    )
+
+
+def get_shared_cache_statistics() -> dict | None:
+    cache = get_shared_cache()
+    if cache is None:
+        return None
+    return {**cache.stats(), "kinds": {kind: view.stats() for kind, view in cache.views.items()}}
@@ -0,0 +1,52 @@
+"""Coalescing of concurrent identical work.
+
+When several requests need the same result at the same time (the tiles of a photo shared a
+moment ago, for instance), the first one runs the work and the others wait for its result
+instead of running it again. Nothing is kept once the work is done: caching is left to the
+caches, this only merges the calls in flight.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import TypeVar
+
+from npo.core.metrics import COALESCED_CALLS
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Calls in flight by key, within the event loop of a process."""
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieved here, for an error of a call whose callers were all cancelled not to be
+        # reported as never retrieved
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: tuple, function: Callable[[], Awaitable[T]]) -> T:
+        """
+        Return the result of the function, or of the call in flight for the same key. The call
+        runs in its own task: a caller cancelled (e.g. a client disconnecting) does not cancel
+        it for the others. Errors are raised to every caller.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(function())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            COALESCED_CALLS.inc(kind=key[0])
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+# Keys start with the kind of work ("tile", "image", "file"...), used as metric label
+flights = SingleFlight()
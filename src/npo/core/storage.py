@@ -0,0 +1,169 @@
+"""Placement of the stored files on the storage volumes.
+
+Stored files (originals and pyramids) are laid out in directories named after their pixel hash
+(see compute_hash_pathes). Each top-level directory of this layout, a shard named after the
+first characters of the pixel hash, is placed on one of the configured volumes by weighted
+rendezvous hashing: every volume scores the shard and the highest score wins. The placement only
+depends on the volumes and their weights, and adding a volume only moves the shards it wins, in
+proportion to its weight, which `npo rebalance` does.
+"""
+
+import asyncio
+import contextlib
+import errno
+import hashlib
+import math
+import os
+import shutil
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from functools import lru_cache
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from npo import config
+from npo.core.file import update_shard_paths
+
+# Directories of the volumes which are not shards of the layout (e.g. uploads being received)
+HIDDEN_PREFIX = "."
+
+
+def get_volumes() -> dict[str, float]:
+    """
+    Volumes by path with their weight, the storage directory alone if none is configured. The
+    storage directory, which holds the files stored before volumes were configured, is otherwise
+    a volume of weight 0 if not one of them: its files are found and moved by `npo rebalance`.
+    """
+    storage_dir = config.settings.storage_dir
+    volumes = config.settings.storage_volumes
+    if not volumes:
+        return {storage_dir: 1.0}
+    if os.path.normpath(storage_dir) in map(os.path.normpath, volumes):
+        return volumes
+    return {**volumes, storage_dir: 0.0}
+
+
+def get_shard(relative_path: str) -> str:
+    """Shard of a path of the layout: its first directory."""
+    return relative_path.split("/", 1)[0] if "/" in relative_path else ""
+
+
+def score(volume: str, shard: str, weight: float) -> float:
+    """Weighted rendezvous score, the shard being placed on the volume with the highest one."""
+    digest = hashlib.blake2b(f"{volume}\0{shard}".encode(), digest_size=8).digest()
+    # Uniform in ]0, 1[, -weight / ln(uniform) gives each volume a share of the shards
+    # proportional to its weight
+    uniform = (int.from_bytes(digest) + 0.5) / 2**64
+    return -weight / math.log(uniform)
+
+
+@lru_cache(maxsize=65536)
+def _select_volume(shard: str, volumes: tuple[tuple[str, float], ...]) -> str:
+    return max(volumes, key=lambda volume: score(volume[0], shard, volume[1]))[0]
+
+
+def select_volume(shard: str) -> str:
+    return _select_volume(shard, tuple(get_volumes().items()))
+
+
+def get_path(relative_path: str) -> str:
+    """Path of a file of the layout on the volume of its shard."""
+    return os.path.join(select_volume(get_shard(relative_path)), relative_path)
+
+
+def find_path(relative_path: str) -> str | None:
+    """
+    Path of an existing file of the layout. Files are looked for on the other volumes when not
+    on the volume of their shard, as after adding a volume until `npo rebalance` moved them.
+    """
+    path = get_path(relative_path)
+    if os.path.exists(path):
+        return path
+    for volume in get_volumes():
+        other_path = os.path.join(volume, relative_path)
+        if other_path != path and os.path.exists(other_path):
+            return other_path
+    # Moved by a concurrent rebalance between the lookups
+    return path if os.path.exists(path) else None
+
+
+@dataclass
+class ShardMove:
+    shard: str
+    source: str
+    target: str
+
+
+def plan_rebalance() -> Iterator[ShardMove]:
+    """Yield the shards which are not on the volume they are placed on."""
+    for volume in get_volumes():
+        if not os.path.isdir(volume):
+            continue
+        with os.scandir(volume) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                if entry.name.startswith(HIDDEN_PREFIX) or not entry.is_dir():
+                    continue
+                target = select_volume(entry.name)
+                if target != volume:
+                    yield ShardMove(shard=entry.name, source=volume, target=target)
+
+
+def _move(source: str, target: str) -> None:
+    try:
+        os.rename(source, target)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+        # Copied under a temporary name, the target volume never holds a partial file, and
+        # removed from the source once complete, so that the file is always found
+        temporary_path = f"{target}.{os.getpid()}.tmp"
+        shutil.copyfile(source, temporary_path)
+        os.replace(temporary_path, target)
+        os.remove(source)
+
+
+def move_shard(move: ShardMove) -> int:
+    """Move the files of a shard to its volume, file by file, and return their number."""
+    source_root = os.path.join(move.source, move.shard)
+    target_root = os.path.join(move.target, move.shard)
+    count = 0
+    for directory, _, names in os.walk(source_root):
+        target_directory = os.path.join(target_root, os.path.relpath(directory, source_root))
+        os.makedirs(target_directory, exist_ok=True)
+        for name in sorted(names):
+            _move(os.path.join(directory, name), os.path.join(target_directory, name))
+            count += 1
+    # Empty directories left on the source volume, deepest first
+    for directory, _, _ in sorted(os.walk(source_root), reverse=True):
+        with contextlib.suppress(OSError):
+            os.rmdir(directory)
+    return count
+
+
+async def rebalance(
+    db: AsyncSession,
+    jobs: int = 4,
+    on_move: Callable[[ShardMove, int], None] | None = None,
+) -> list[ShardMove]:
+    """
+    Move the shards which are not on their volume, several at a time, and update the stored
+    paths of their files once moved. Files stay readable in the meantime (see find_path).
+    """
+    moves = list(plan_rebalance())
+    slots = asyncio.Semaphore(jobs)
+    # Files are moved by threads, the database session is used by one shard at a time
+    db_lock = asyncio.Lock()
+
+    async def rebalance_shard(move: ShardMove) -> None:
+        async with slots:
+            count = await asyncio.to_thread(move_shard, move)
+        async with db_lock:
+            await update_shard_paths(move.shard, move.target, db)
+            await db.commit()
+        if on_move:
+            on_move(move, count)
+
+    async with asyncio.TaskGroup() as tasks:
+        for move in moves:
+            tasks.create_task(rebalance_shard(move))
+    return moves
@@ -0,0 +1,103 @@
+"""In-process cache of the most recently read tiles, bounded by the size of their data.
+
+Tiles are keyed by the pixel hash of their image, so that a cached tile never goes stale: an
+image with other pixels has another hash. Each worker process has its own cache.
+"""
+
+import threading
+from collections import OrderedDict
+
+from npo.core.metrics import (
+    TILE_CACHE_HIT_BYTES,
+    TILE_CACHE_PREFETCHED,
+    TILE_CACHE_REQUESTS,
+    TILE_CACHE_SIZE,
+)
+
+TileKey = tuple[str, int, int, int]
+
+# Approximate memory of an entry besides the tile data: key tuple, bytes header, dict slot
+ENTRY_OVERHEAD = 200
+
+
+def prefetch_coordinates(zoom: int, x: int, y: int) -> list[tuple[int, int, int]]:
+    """
+    Tiles likely to be requested after a tile by a viewer: its neighbors at the same zoom level
+    (panning) and its children at the next one (zooming in).
+    """
+    neighbors = [
+        (zoom, x + dx, y + dy)
+        for dx in (-1, 0, 1)
+        for dy in (-1, 0, 1)
+        if (dx or dy) and x + dx >= 0 and y + dy >= 0
+    ]
+    children = [(zoom + 1, 2 * x + dx, 2 * y + dy) for dx in (0, 1) for dy in (0, 1)]
+    return neighbors + children
+
+
+class TileCache:
+    """Least recently used tiles, within a budget of bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self._tiles: OrderedDict[TileKey, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: TileKey) -> bytes | None:
+        with self._lock:
+            data = self._tiles.get(key)
+            if data is None:
+                self.misses += 1
+            else:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                self.hit_bytes += len(data)
+        if data is None:
+            TILE_CACHE_REQUESTS.inc(result="miss")
+        else:
+            TILE_CACHE_REQUESTS.inc(result="hit")
+            TILE_CACHE_HIT_BYTES.inc(len(data))
+        return data
+
+    def put(self, key: TileKey, data: bytes, prefetched: bool = False) -> None:
+        cost = len(data) + ENTRY_OVERHEAD
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._tiles.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous) + ENTRY_OVERHEAD
+            self._tiles[key] = data
+            self.size += cost
+            while self.size > self.max_bytes:
+                _, evicted = self._tiles.popitem(last=False)
+                self.size -= len(evicted) + ENTRY_OVERHEAD
+            size = self.size
+        TILE_CACHE_SIZE.set(size)
+        if prefetched:
+            TILE_CACHE_PREFETCHED.inc()
+
+    def __contains__(self, key: TileKey) -> bool:
+        return key in self._tiles
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tiles.clear()
+            self.size = 0
+        TILE_CACHE_SIZE.set(0)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "tiles": len(self._tiles),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else None,
+            "hit_bytes": self.hit_bytes,
+        }
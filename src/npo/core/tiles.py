@@ -0,0 +1,362 @@
+"""Storage of the tiles of the image pyramids.
+
+Two backends, chosen by the tile_backend setting:
+
+- szi: a ZIP archive per image next to the original (`<hash>.szi`), as written by dzsave;
+- pack: SQLite pack files shared by all the images, a few of them selected by the first
+  characters of the pixel hash, where a tile is a single indexed read by
+  (pixel_hash, zoom, x, y), without opening an archive and parsing its directory per request.
+
+Tiles are keyed by the zoom level and the x and y parts of their path in the pyramid
+(`<zoom>/<x>/<y>.jpg`), the same for both backends. `npo tiles convert` copies the tiles of
+the existing archives to the packs.
+"""
+
+import io
+import os
+import re
+import sqlite3
+import threading
+from collections.abc import Callable, Iterator
+from functools import lru_cache
+from zipfile import BadZipFile, ZipFile
+
+from npo import config
+from npo.core import storage
+from npo.core.shared_cache import SharedCache, SharedCacheView, get_shared_cache
+from npo.core.tile_cache import TileCache, prefetch_coordinates
+from npo.core.tracing import span
+
+# Pyramids of Google Maps layout, 256 pixels JPEG tiles down to a single tile
+DZSAVE_OPTIONS = {
+    "layout": "google",
+    "tile_size": 256,
+    "overlap": 1,
+    "suffix": ".jpg",
+    "depth": "onetile",
+    "Q": 85,
+}
+ARCHIVE_EXTENSION = ".szi"
+PACKS_DIR = ".tiles"
+# Tiles in an archive: "<name>/<zoom>/<x>/<y>.jpg"
+ARCHIVE_TILE = re.compile(r"^[^/]+/(?P<zoom>\d+)/(?P<x>\d+)/(?P<y>\d+)\.jpg$")
+
+PACK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    pixel_hash TEXT NOT NULL,
+    zoom INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (pixel_hash, zoom, x, y)
+)
+"""
+
+
+def get_archive_relative_path(file) -> str:
+    return file.path_hash_dir + file.path_hash_file + ARCHIVE_EXTENSION
+
+
+def read_archive(archive: ZipFile) -> Iterator[tuple[int, int, int, bytes]]:
+    """Yield the (zoom, x, y, data) tiles of a pyramid archive."""
+    for name in archive.namelist():
+        if match := ARCHIVE_TILE.match(name):
+            zoom, x, y = (int(match.group(part)) for part in ("zoom", "x", "y"))
+            yield zoom, x, y, archive.read(name)
+
+
+class ArchiveTileStore:
+    """A ZIP archive per image, stored next to the original on its volume."""
+
+    def save(self, file, image) -> None:
+        dzi_path = storage.get_path(get_archive_relative_path(file))
+        with span("dzsave"):
+            image.dzsave(dzi_path, container="zip", **DZSAVE_OPTIONS)
+
+    def get(self, file, zoom: int, x: int, y: int) -> bytes | None:
+        return self.get_tiles(file, [(zoom, x, y)]).get((zoom, x, y))
+
+    def get_tiles(
+        self, file, coordinates: list[tuple[int, int, int]]
+    ) -> dict[tuple[int, int, int], bytes]:
+        """Read several tiles of an image from a single opening of its archive."""
+        dzi_path = storage.find_path(get_archive_relative_path(file))
+        if dzi_path is None:
+            return {}
+
+        with span("archive_open"):
+            zip_file = ZipFile(dzi_path, "r")
+        tiles = {}
+        with zip_file, span("tile_read"):
+            for zoom, x, y in coordinates:
+                tile_path = f"{file.path_hash_file}/{zoom}/{x}/{y}.jpg"
+                try:
+                    with zip_file.open(tile_path) as tile_file:
+                        tiles[zoom, x, y] = tile_file.read()
+                except KeyError:
+                    continue
+        return tiles
+
+    def list_tiles(self, file) -> list[tuple[int, int, int]]:
+        dzi_path = storage.find_path(get_archive_relative_path(file))
+        if dzi_path is None:
+            return []
+        with ZipFile(dzi_path) as zip_file:
+            return [
+                tuple(int(match.group(part)) for part in ("zoom", "x", "y"))
+                for name in zip_file.namelist()
+                if (match := ARCHIVE_TILE.match(name))
+            ]
+
+    def delete(self, file) -> None:
+        if dzi_path := storage.find_path(get_archive_relative_path(file)):
+            os.remove(dzi_path)
+
+
+class PackTileStore:
+    """SQLite pack files holding the tiles of all the images."""
+
+    def __init__(self):
+        # Reading connections of each thread by pack path, the SQLite ones cannot be shared
+        # between concurrent threads
+        self._local = threading.local()
+        self._readers: list[sqlite3.Connection] = []
+        # Single writing connection by pack path, used under the lock
+        self._writers: dict[str, sqlite3.Connection] = {}
+        self._lock = threading.Lock()
+
+    def get_pack_path(self, pixel_hash: str) -> str:
+        directory = config.settings.tile_pack_dir or os.path.join(
+            config.settings.storage_dir, PACKS_DIR
+        )
+        prefix = pixel_hash[: config.settings.tile_pack_prefix_length]
+        return os.path.join(directory, f"tiles-{prefix}.sqlite" if prefix else "tiles.sqlite")
+
+    @staticmethod
+    def _open(path: str) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Closed by close(), from any thread
+        connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # Readers are not blocked by the writer, which can be another process
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(PACK_SCHEMA)
+        return connection
+
+    def _connect(self, pixel_hash: str) -> sqlite3.Connection | None:
+        """Reading connection of the calling thread to the pack of an image, if it exists."""
+        path = self.get_pack_path(pixel_hash)
+        connections = self._local.__dict__.setdefault("connections", {})
+        connection = connections.get(path)
+        if connection is None:
+            if not os.path.exists(path):
+                return None
+            connection = connections[path] = self._open(path)
+            with self._lock:
+                self._readers.append(connection)
+        return connection
+
+    def _connect_writer(self, pixel_hash: str, create: bool) -> sqlite3.Connection | None:
+        """Writing connection to the pack of an image, to be used under the lock."""
+        path = self.get_pack_path(pixel_hash)
+        connection = self._writers.get(path)
+        if connection is None:
+            if not create and not os.path.exists(path):
+                return None
+            connection = self._writers[path] = self._open(path)
+        return connection
+
+    def write(self, pixel_hash: str, tiles: Iterator[tuple[int, int, int, bytes]]) -> int:
+        """Write the tiles of an image in a single transaction, replacing previous ones."""
+        rows = [(pixel_hash, zoom, x, y, data) for zoom, x, y, data in tiles]
+        with self._lock:
+            connection = self._connect_writer(pixel_hash, create=True)
+            with connection:
+                connection.execute("DELETE FROM tiles WHERE pixel_hash = ?", (pixel_hash,))
+                connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def save(self, file, image) -> None:
+        with span("dzsave"):
+            archive = image.dzsave_buffer(
+                basename=file.path_hash_file, container="zip", **DZSAVE_OPTIONS
+            )
+        with span("pack_write"), ZipFile(io.BytesIO(archive)) as zip_file:
+            self.write(file.pixel_hash, read_archive(zip_file))
+
+    def get(self, file, zoom: int, x: int, y: int) -> bytes | None:
+        return self.get_tiles(file, [(zoom, x, y)]).get((zoom, x, y))
+
+    def get_tiles(
+        self, file, coordinates: list[tuple[int, int, int]]
+    ) -> dict[tuple[int, int, int], bytes]:
+        connection = self._connect(file.pixel_hash)
+        tiles = {}
+        if connection is not None:
+            with span("tile_read"):
+                for zoom, x, y in coordinates:
+                    row = connection.execute(
+                        "SELECT data FROM tiles "
+                        "WHERE pixel_hash = ? AND zoom = ? AND x = ? AND y = ?",
+                        (file.pixel_hash, zoom, x, y),
+                    ).fetchone()
+                    if row:
+                        tiles[zoom, x, y] = row[0]
+            if tiles or self.has_tiles(file.pixel_hash):
+                return tiles
+        # Images not converted yet (`npo tiles convert`) are served from their archive
+        return ArchiveTileStore().get_tiles(file, coordinates)
+
+    def has_tiles(self, pixel_hash: str) -> bool:
+        connection = self._connect(pixel_hash)
+        return connection is not None and bool(
+            connection.execute(
+                "SELECT 1 FROM tiles WHERE pixel_hash = ? LIMIT 1", (pixel_hash,)
+            ).fetchone()
+        )
+
+    def list_tiles(self, file) -> list[tuple[int, int, int]]:
+        connection = self._connect(file.pixel_hash)
+        if connection is None:
+            return []
+        return connection.execute(
+            "SELECT zoom, x, y FROM tiles WHERE pixel_hash = ?", (file.pixel_hash,)
+        ).fetchall()
+
+    def delete(self, file) -> None:
+        with self._lock:
+            connection = self._connect_writer(file.pixel_hash, create=False)
+            if connection is not None:
+                with connection:
+                    connection.execute("DELETE FROM tiles WHERE pixel_hash = ?", (file.pixel_hash,))
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in [*self._readers, *self._writers.values()]:
+                connection.close()
+            self._readers.clear()
+            self._writers.clear()
+            self._local = threading.local()
+
+
+class CachedTileStore:
+    """
+    Tile store keeping the tiles read in a cache. On a miss, the tiles a viewer is likely to
+    request next are read along with the requested one, from the same archive opening.
+    """
+
+    def __init__(self, store: ArchiveTileStore | PackTileStore, cache: TileCache | SharedCacheView):
+        self.store = store
+        self.cache = cache
+
+    def save(self, file, image) -> None:
+        # Tiles are keyed by pixel hash, those already cached are the same
+        self.store.save(file, image)
+
+    def get(self, file, zoom: int, x: int, y: int) -> bytes | None:
+        data = self.lookup(file, zoom, x, y)
+        if data is not None:
+            return data
+        return self.load(file, zoom, x, y)
+
+    def lookup(self, file, zoom: int, x: int, y: int) -> bytes | None:
+        """Cached tile, without reading the store."""
+        return self.cache.get((file.pixel_hash, zoom, x, y))
+
+    def load(self, file, zoom: int, x: int, y: int) -> bytes | None:
+        """Read a tile missing from the cache, with the ones to prefetch, and cache them."""
+        prefetched = [
+            coordinates
+            for coordinates in prefetch_coordinates(zoom, x, y)
+            if (file.pixel_hash, *coordinates) not in self.cache
+        ]
+        tiles = self.store.get_tiles(file, [(zoom, x, y), *prefetched])
+        for coordinates, tile in tiles.items():
+            self.cache.put(
+                (file.pixel_hash, *coordinates), tile, prefetched=coordinates != (zoom, x, y)
+            )
+        return tiles.get((zoom, x, y))
+
+    def get_tiles(
+        self, file, coordinates: list[tuple[int, int, int]]
+    ) -> dict[tuple[int, int, int], bytes]:
+        return self.store.get_tiles(file, coordinates)
+
+    def list_tiles(self, file) -> list[tuple[int, int, int]]:
+        return self.store.list_tiles(file)
+
+    def delete(self, file) -> None:
+        # Only called for images never served, whose tiles cannot be in the cache
+        self.store.delete(file)
+
+
+TILE_STORES = {"szi": ArchiveTileStore, "pack": PackTileStore}
+
+
+@lru_cache
+def _get_tile_store(backend: str, cache_bytes: int, shared_cache: SharedCache | None, pid: int):
+    store = TILE_STORES[backend]()
+    if shared_cache:
+        return CachedTileStore(store, shared_cache.view("tile"))
+    if cache_bytes:
+        return CachedTileStore(store, TileCache(cache_bytes))
+    return store
+
+
+def get_tile_store() -> ArchiveTileStore | PackTileStore | CachedTileStore:
+    """
+    Tile store of the configured backend, one per process, behind the cache shared by the
+    workers if configured, else behind the tile cache of the process if enabled.
+    """
+    return _get_tile_store(
+        config.settings.tile_backend,
+        config.settings.tile_cache_bytes,
+        get_shared_cache(),
+        os.getpid(),
+    )
+
+
+def get_tile_cache_statistics() -> dict | None:
+    store = get_tile_store()
+    return store.cache.stats() if isinstance(store, CachedTileStore) else None
+
+
+def find_archives() -> Iterator[tuple[str, str]]:
+    """Yield the (pixel hash, path) of the pyramid archives of every volume."""
+    for volume in storage.get_volumes():
+        for directory, directories, names in os.walk(volume):
+            directories[:] = sorted(
+                name for name in directories if not name.startswith(storage.HIDDEN_PREFIX)
+            )
+            for name in sorted(names):
+                if name.endswith(ARCHIVE_EXTENSION):
+                    relative_path = os.path.relpath(os.path.join(directory, name), volume)
+                    pixel_hash = relative_path.removesuffix(ARCHIVE_EXTENSION).replace("/", "")
+                    yield pixel_hash, os.path.join(directory, name)
+
+
+def convert_archives(
+    remove: bool = False, on_convert: Callable[[str, int], None] | None = None
+) -> int:
+    """
+    Copy the tiles of the pyramid archives to the packs, and remove the archives if asked.
+    Converting an image again replaces its tiles, an interrupted conversion can be run again.
+    """
+    packs = PackTileStore()
+    count = 0
+    try:
+        for pixel_hash, path in find_archives():
+            try:
+                with ZipFile(path) as zip_file:
+                    tiles = packs.write(pixel_hash, read_archive(zip_file))
+            except BadZipFile:
+                # Archive being written by dzsave, converted by the next run
+                continue
+            if remove:
+                os.remove(path)
+            count += 1
+            if on_convert:
+                on_convert(path, tiles)
+    finally:
+        packs.close()
+    return count
@@ -0,0 +1,114 @@
+"""Per-request span trees, reported as a Server-Timing header and optionally as JSONL traces.
+
+A trace is started by the HTTP middleware and spans are opened with the span() context manager
+anywhere below it; outside of a request (CLI, tests calling services directly) spans are no-ops.
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Span:
+    name: str
+    start: float = field(default_factory=time.perf_counter)
+    duration: float | None = None
+    children: list["Span"] = field(default_factory=list)
+
+    def end(self) -> None:
+        self.duration = time.perf_counter() - self.start
+
+    def to_dict(self, origin: float) -> dict:
+        return {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((self.duration or 0) * 1000, 3),
+            "children": [child.to_dict(origin) for child in self.children],
+        }
+
+
+_current_span: ContextVar[Span | None] = ContextVar("npo_current_span", default=None)
+_trace_file_lock = threading.Lock()
+
+
+@contextmanager
+def span(name: str) -> Iterator[Span | None]:
+    """Record a child span of the current span, if a trace is active."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        child.end()
+        _current_span.reset(token)
+
+
+@contextmanager
+def trace(name: str) -> Iterator[Span]:
+    """Start a new trace whose root span is made current for the enclosed code."""
+    root = Span(name)
+    token = _current_span.set(root)
+    try:
+        yield root
+    finally:
+        root.end()
+        _current_span.reset(token)
+
+
+def _flatten(root: Span) -> Iterator[Span]:
+    for child in root.children:
+        yield child
+        yield from _flatten(child)
+
+
+def server_timing_header(root: Span) -> str:
+    """
+    Format the span tree as a Server-Timing header value.
+    Spans with the same name (e.g. one per uploaded file) are summed to keep the header short.
+    """
+    totals: dict[str, list[float]] = {}
+    for child in _flatten(root):
+        total = totals.setdefault(child.name, [0.0, 0])
+        total[0] += child.duration or 0
+        total[1] += 1
+
+    metrics = [f"total;dur={(root.duration or 0) * 1000:.2f}"]
+    for name, (duration, count) in totals.items():
+        description = f';desc="x{count}"' if count > 1 else ""
+        metrics.append(f"{name};dur={duration * 1000:.2f}{description}")
+    return ", ".join(metrics)
+
+
+def should_sample(sample_rate: float) -> bool:
+    return sample_rate >= 1.0 or random.random() < sample_rate
+
+
+def write_trace(trace_file: str, root: Span, attributes: dict) -> str:
+    """
+    Append the span tree to a JSONL trace file and return the trace identifier. Blocking: called
+    in a thread by the HTTP middleware, the lock keeping the lines of concurrent requests whole.
+    """
+    trace_id = uuid.uuid4().hex
+    record = {
+        "trace_id": trace_id,
+        "timestamp": time.time(),
+        **attributes,
+        **root.to_dict(root.start),
+    }
+    line = json.dumps(record, separators=(",", ":")) + "\n"
+    with _trace_file_lock, open(trace_file, "a", encoding="utf-8") as file:
+        file.write(line)
+    return trace_id
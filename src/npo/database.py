@@ -1,9 +1,13 @@
+import ast
 import asyncio
+import fcntl
+import hashlib
+import tempfile
+import tomllib
 from datetime import datetime
+from pathlib import Path
 
-from alembic import command
-from alembic.config import Config
-from sqlalchemy import Integer
+from sqlalchemy import Integer, inspect, text
 from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncAttrs, AsyncSession, create_async_engine
 from sqlalchemy.orm import (
@@ -24,14 +28,105 @@ url = make_url(db_uri)
 engine = create_async_engine(db_uri, echo=True, future=True)
 
 
-async def init_db():
-    """Initialize the database by running Alembic migrations."""
-    # Exécuter les migrations Alembic
-    alembic_cfg = Config(toml_file="pyproject.toml")
+ALEMBIC_CONFIG_FILE = "pyproject.toml"
+
+
+def _alembic_config():
+    from alembic.config import Config  # noqa: PLC0415
+
+    alembic_cfg = Config(toml_file=ALEMBIC_CONFIG_FILE)
     alembic_cfg.set_main_option("sqlalchemy.url", config.settings.database_uri)
+    return alembic_cfg
+
+
+def get_script_revisions() -> tuple[set[str], set[str]]:
+    """Return all the revisions of the migration scripts and their heads.
+
+    The `revision` and `down_revision` assignments are read from the scripts syntax tree rather
+    than through Alembic, whose import alone is slower than the whole check at startup.
+    """
+    config_path = Path(ALEMBIC_CONFIG_FILE).resolve()
+    with open(config_path, "rb") as config_file:
+        script_location = tomllib.load(config_file)["tool"]["alembic"]["script_location"]
+    versions_dir = Path(script_location.replace("%(here)s", str(config_path.parent))) / "versions"
+
+    revisions, down_revisions = set(), set()
+    for script in versions_dir.glob("*.py"):
+        for node in ast.parse(script.read_text(encoding="utf-8")).body:
+            if isinstance(node, ast.AnnAssign | ast.Assign) and node.value is not None:
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                names = {target.id for target in targets if isinstance(target, ast.Name)}
+                if "revision" in names:
+                    revisions.add(ast.literal_eval(node.value))
+                elif "down_revision" in names:
+                    value = ast.literal_eval(node.value)
+                    down_revisions.update(value if isinstance(value, tuple | list) else [value])
+    return revisions, revisions - down_revisions
+
+
+def get_head_revisions() -> set[str]:
+    """Return the head revisions of the migration scripts."""
+    return get_script_revisions()[1]
+
+
+def _read_revisions(connection) -> set[str]:
+    if not inspect(connection).has_table("alembic_version"):
+        return set()
+    return set(connection.execute(text("SELECT version_num FROM alembic_version")).scalars())
+
+
+async def get_current_revisions() -> set[str]:
+    """Return the Alembic revisions the database schema is at, empty if never migrated."""
+    async with engine.connect() as connection:
+        return await connection.run_sync(_read_revisions)
+
+
+def _migration_lock_path() -> Path:
+    if url.drivername.startswith("sqlite") and url.database and url.database != ":memory:":
+        return Path(f"{url.database}.migration.lock")
+    digest = hashlib.sha1(db_uri.encode(), usedforsecurity=False).hexdigest()[:16]
+    return Path(tempfile.gettempdir()) / f"npo-migration-{digest}.lock"
+
+
+def _acquire_migration_lock():
+    """Block until this process holds the migration lock, released when the file is closed."""
+    lock_file = open(_migration_lock_path(), "a")  # noqa: SIM115
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+
+async def init_db() -> bool:
+    """Run the Alembic migrations if the database schema is not at the head revision.
+
+    The current revision is read from the alembic_version table, which is much cheaper than
+    running an upgrade. When migrations are needed, a file lock ensures that only one worker
+    (of the same host) runs them, the others finding the schema up to date once they get it.
+    Return True if migrations were run by this process. Raise a RuntimeError if the database is
+    at a revision unknown to the migration scripts, as after being migrated by a newer release.
+    """
+    revisions, heads = get_script_revisions()
+    current_revisions = await get_current_revisions()
+    if current_revisions == heads:
+        return False
+    if unknown_revisions := current_revisions - revisions:
+        raise RuntimeError(
+            f"Database at revision {', '.join(sorted(unknown_revisions))}, unknown to the "
+            "migration scripts of this release (migrated by a newer one?)."
+        )
+
+    loop = asyncio.get_running_loop()
+    lock_file = await loop.run_in_executor(None, _acquire_migration_lock)
+    try:
+        if await get_current_revisions() == heads:
+            return False
+        # Alembic is only imported when there are migrations to run
+        from alembic import command  # noqa: PLC0415
 
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, lambda: command.upgrade(alembic_cfg, "head"))
+        alembic_cfg = _alembic_config()
+        await loop.run_in_executor(None, lambda: command.upgrade(alembic_cfg, "head"))
+        return True
+    finally:
+        lock_file.close()
 
 
 async def get_session() -> AsyncSession:
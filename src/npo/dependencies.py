@@ -1,12 +1,17 @@
 """Dependency management for NPO application."""
 
 import os
+import secrets
 from functools import lru_cache
 from pathlib import Path
+from typing import Annotated
 
+from fastapi import Header, status
 from sqlalchemy.engine import make_url
 
 from npo import config
+from npo.core.storage import get_volumes
+from npo.routers.utils import APIException
 
 
 @lru_cache
@@ -15,25 +20,64 @@ def get_frontend_settings():
     return config.frontend_settings
 
 
-def make_upload_directory():
+@lru_cache
+def ensure_directory(path: str) -> None:
+    """Create a directory if needed, only once per path for the process lifetime."""
+    os.makedirs(path, exist_ok=True)
+
+
+@lru_cache
+def get_sqlite_directory(db_uri: str) -> str | None:
+    """Return the directory of a file based SQLite database, None for other databases."""
+    url = make_url(db_uri)
+    if url.drivername.startswith("sqlite") and url.database and url.database != ":memory:":
+        return str(Path(url.database).parent)
+    return None
+
+
+def prepare_directories():
+    """Create the database, upload and storage directories, called once at startup."""
+    if db_directory := get_sqlite_directory(config.settings.database_uri):
+        ensure_directory(db_directory)
+    ensure_directory(config.settings.uploads_dir)
+    ensure_directory(config.settings.storage_dir)
+    for volume in get_volumes():
+        ensure_directory(volume)
+
+
+# The dependencies below are asynchronous so that FastAPI does not dispatch them to its
+# threadpool, and cached so that requests after the first one do not touch the filesystem.
+async def make_upload_directory():
     """Ensure the upload directory exists."""
-    if not os.path.exists(config.settings.uploads_dir):
-        os.makedirs(config.settings.uploads_dir, exist_ok=True)
+    ensure_directory(config.settings.uploads_dir)
 
 
-def make_storage_directory():
-    """Ensure the storage directory exists."""
-    if not os.path.exists(config.settings.storage_dir):
-        os.makedirs(config.settings.storage_dir, exist_ok=True)
+async def make_storage_directory():
+    """Ensure the storage directory and volumes exist."""
+    ensure_directory(config.settings.storage_dir)
+    for volume in get_volumes():
+        ensure_directory(volume)
 
 
-def make_db_directory():
+async def make_db_directory():
     """Ensure the db directory exists if we use SQLite.
     If we are using sqlite and it's a file based database,
     we need to make sure the directory exists.
     """
-    db_uri = config.settings.database_uri
-    url = make_url(db_uri)
-    if url.drivername.startswith("sqlite") and url.database and url.database != ":memory:":
-        db_path = Path(url.database)
-        db_path.parent.mkdir(parents=True, exist_ok=True)
+    if db_directory := get_sqlite_directory(config.settings.database_uri):
+        ensure_directory(db_directory)
+
+
+def require_admin(x_admin_token: Annotated[str | None, Header()] = None):
+    """Ensure the request carries the admin token, admin routes are disabled without one."""
+    admin_token = config.settings.admin_token
+    if (
+        not admin_token
+        or not x_admin_token
+        or not secrets.compare_digest(x_admin_token, admin_token)
+    ):
+        raise APIException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            code="ADMIN_FORBIDDEN",
+            message="A valid X-Admin-Token header is required.",
+        )
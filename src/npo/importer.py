@@ -0,0 +1,382 @@
+"""Bulk import of existing photo directories.
+
+The ingestion pipeline of routers/files/services.py runs directly on the files, in a pool of
+worker processes, instead of going through the upload endpoint:
+
+1. workers analyze a file in place: file hash, perceptual hash, metadata, pixel hash
+2. the main process rejects duplicates (stored or imported by the current run)
+3. workers hardlink (or copy) the file into the hashed storage layout and create its pyramid
+4. the main process writes the file rows by batches, one transaction per batch
+
+Imported files and duplicates are appended to a JSONL checkpoint once committed, so that an
+interrupted import resumes where it stopped when run again. The same pipeline ingests the files
+dropped in a watched directory (see watcher.py).
+"""
+
+import asyncio
+import atexit
+import contextlib
+import json
+import mimetypes
+import os
+import signal
+import sys
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+from pathlib import Path
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from npo import config
+from npo.core.tiles import get_tile_store
+from npo.routers.files import services
+from npo.routers.files.schemas import File
+
+# Settings used by the workers, copied from the main process (they may differ from the
+# environment, e.g. in tests or when given on the command line)
+WORKER_SETTINGS = (
+    "uploads_dir",
+    "storage_dir",
+    "storage_volumes",
+    "hash_dir_parts_count",
+    "hash_dir_step",
+    "tile_backend",
+    "tile_pack_dir",
+    "tile_pack_prefix_length",
+)
+
+CHECKPOINT_DONE_STATUSES = {"imported", "duplicate"}
+
+
+class ImportFileError(Exception):
+    """Error of a worker, with a plain message so that it crosses process boundaries."""
+
+
+def describe_error(error: Exception) -> str:
+    if isinstance(error, HTTPException) and isinstance(error.detail, dict):
+        return f"{error.detail.get('code')}: {error.detail.get('message')}"
+    return f"{type(error).__name__}: {error}"
+
+
+# Worker processes
+_worker_loop: asyncio.AbstractEventLoop | None = None
+_worker_exiftool = None
+
+
+def _init_worker(settings: dict) -> None:
+    """Apply the main process settings and start the exiftool process kept by this worker."""
+    global _worker_loop, _worker_exiftool  # noqa: PLW0603
+    import exiftool  # noqa: PLC0415
+
+    # Ctrl+C is sent to the whole process group: only the main process handles it, letting
+    # the workers (and their exiftool process, which inherits this) finish the current file
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for key, value in settings.items():
+        setattr(config.settings, key, value)
+    _worker_loop = asyncio.new_event_loop()
+    # A single exiftool process per worker, instead of one per file
+    _worker_exiftool = exiftool.ExifToolHelper()
+    _worker_exiftool.run()
+    atexit.register(_worker_exiftool.terminate)
+
+
+def _run_in_worker(coroutine):
+    try:
+        return _worker_loop.run_until_complete(coroutine)
+    except Exception as error:
+        raise ImportFileError(describe_error(error)) from None
+
+
+async def _analyze(path: str) -> dict:
+    file = File(
+        name=os.path.basename(path),
+        path=path,
+        size=os.path.getsize(path),
+        mime=mimetypes.guess_type(path)[0],
+    )
+    await services.compute_hash(file)
+    await services.compute_perceptual_hash(file)
+    for item in _worker_exiftool.get_metadata(path, params=["-n"]):
+        services.apply_metadata(file, item)
+    await services.compute_pixel_hash(file)
+    await services.compute_hash_pathes(file)
+    return file.model_dump()
+
+
+def analyze_file(path: str) -> dict:
+    """Compute the hashes and metadata of a file, without writing anything."""
+    return _run_in_worker(_analyze(path))
+
+
+async def _store(data: dict, copy: bool) -> dict:
+    file = File(**data)
+    await services.link_file(file, copy=copy)
+    await services.create_dzi(file)
+    return file.model_dump()
+
+
+def store_file(data: dict, copy: bool) -> dict:
+    """Add an analyzed file to the storage layout and create its pyramid."""
+    return _run_in_worker(_store(data, copy))
+
+
+# Main process
+def find_images(directory: Path) -> Iterator[Path]:
+    """Yield the image files of a directory tree, in a stable order."""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            mime = mimetypes.guess_type(name)[0]
+            if mime and mime.startswith("image/"):
+                yield Path(root, name)
+
+
+def load_checkpoint(checkpoint: Path) -> set[str]:
+    """Return the paths already imported or rejected as duplicates by previous runs."""
+    done = set()
+    if checkpoint.exists():
+        with open(checkpoint, encoding="utf-8") as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line truncated by an interruption
+                    continue
+                if record.get("status") in CHECKPOINT_DONE_STATUSES:
+                    done.add(record["path"])
+    return done
+
+
+@dataclass
+class ImportStats:
+    start: float = field(default_factory=time.perf_counter)
+    skipped: int = 0
+    imported: int = 0
+    duplicates: int = 0
+    errors: int = 0
+    bytes: int = 0
+
+    @property
+    def processed(self) -> int:
+        return self.imported + self.duplicates + self.errors
+
+    def progress(self) -> str:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return (
+            f"{self.processed} files ({self.imported} imported, {self.duplicates} duplicates, "
+            f"{self.errors} errors, {self.skipped} already done) "
+            f"- {self.processed / elapsed:.1f} files/s, {self.bytes / elapsed / 1e6:.1f} MB/s"
+        )
+
+
+class Importer:
+    """
+    Imports files through the worker pool, started for the files of a directory tree by
+    `running()`: `run()` imports the whole tree, the watch command the files dropped in it.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        db: AsyncSession,
+        checkpoint: Path | None,
+        *,
+        workers: int | None = None,
+        batch_size: int = 100,
+        copy: bool = False,
+        progress_interval: float = 5.0,
+        remove_sources: bool = False,
+        on_result: Callable[[Path, str], None] | None = None,
+    ):
+        self.db = db
+        self.checkpoint = checkpoint
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.copy = copy
+        self.progress_interval = progress_interval
+        self.remove_sources = remove_sources
+        self.on_result = on_result
+        self.stats = ImportStats()
+        self.directory: Path | None = None
+        self._pool: ProcessPoolExecutor | None = None
+        self._db_lock = asyncio.Lock()
+        self._batch: list[tuple[Path, File]] = []
+        # Hashes of the files accepted by this run but not committed yet, which the duplicate
+        # checks against the database cannot see
+        self._pending_perceptual_hashes: set[str] = set()
+        self._pending_image_unique_ids: set[str] = set()
+        self._checkpoint_file = None
+
+    def _record(self, path: Path, status: str, **details) -> None:
+        if self.on_result:
+            self.on_result(path, status)
+        if self._checkpoint_file:
+            record = {"path": str(path.relative_to(self.directory)), "status": status, **details}
+            self._checkpoint_file.write(json.dumps(record) + "\n")
+
+    def _remove_source(self, path: Path) -> None:
+        if self.remove_sources:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def _remove_stored(self, file: File) -> None:
+        """Remove the stored copy and the tiles of a file whose row could not be written."""
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(file.path)
+        with contextlib.suppress(FileNotFoundError):
+            get_tile_store().delete(file)
+
+    def _discard_pending(self, file: File) -> None:
+        self._pending_perceptual_hashes.discard(file.perceptual_hash)
+        self._pending_image_unique_ids.discard(file.image_unique_id)
+
+    async def _check_duplicates(self, file: File) -> None:
+        if file.perceptual_hash in self._pending_perceptual_hashes or (
+            file.image_unique_id and file.image_unique_id in self._pending_image_unique_ids
+        ):
+            raise ImportFileError("DUPLICATE: same file already imported by this run")
+        # Claimed before awaiting, so that a copy analyzed meanwhile is seen as a duplicate
+        self._pending_perceptual_hashes.add(file.perceptual_hash)
+        if file.image_unique_id:
+            self._pending_image_unique_ids.add(file.image_unique_id)
+        try:
+            async with self._db_lock:
+                await services.check_duplicates_by_perceptual_hash(file, self.db)
+                if file.image_unique_id:
+                    await services.check_duplicates_by_image_unique_id(file, self.db)
+        except Exception:
+            self._discard_pending(file)
+            raise
+
+    async def flush(self) -> None:
+        """Write the pending batch of files in a single transaction."""
+        async with self._db_lock:
+            batch, self._batch = self._batch, []
+            if not batch:
+                return
+            try:
+                for _, file in batch:
+                    await services.add_file_infos(file, self.db)
+                await self.db.commit()
+                committed = batch
+            except Exception:
+                # Fall back to one transaction per file to only lose the faulty ones
+                await self.db.rollback()
+                committed = []
+                for path, file in batch:
+                    try:
+                        await services.add_file_infos(file, self.db)
+                        await self.db.commit()
+                        committed.append((path, file))
+                    except Exception as error:  # noqa: BLE001
+                        await self.db.rollback()
+                        self.stats.errors += 1
+                        self._record(path, "error", error=describe_error(error))
+                        self._remove_stored(file)
+
+            for path, file in committed:
+                self.stats.imported += 1
+                self.stats.bytes += file.size or 0
+                self._record(path, "imported", pixel_hash=file.pixel_hash)
+                # Only once committed: the stored file is then reachable from the database
+                self._remove_source(path)
+            for _, file in batch:
+                self._discard_pending(file)
+            if self._checkpoint_file:
+                self._checkpoint_file.flush()
+
+    async def import_file(self, path: Path) -> str:
+        """
+        Import a file of the directory, returning its status: "duplicate", "error" or "pending"
+        until the batch it was added to is written.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            file = File(**await loop.run_in_executor(self._pool, analyze_file, str(path)))
+            try:
+                await self._check_duplicates(file)
+            except (HTTPException, ImportFileError) as error:
+                self.stats.duplicates += 1
+                self._record(path, "duplicate", reason=describe_error(error))
+                self._remove_source(path)
+                return "duplicate"
+
+            try:
+                data = await loop.run_in_executor(
+                    self._pool, store_file, file.model_dump(), self.copy
+                )
+            except Exception:
+                # Not imported: the same image found later in the directory is not a duplicate
+                self._discard_pending(file)
+                raise
+        except Exception as error:  # noqa: BLE001
+            self.stats.errors += 1
+            self._record(path, "error", error=describe_error(error))
+            return "error"
+
+        self._batch.append((path, File(**data)))
+        if len(self._batch) >= self.batch_size:
+            # Shielded so that an interruption cannot separate the commit from the checkpoint
+            await asyncio.shield(self.flush())
+        return "pending"
+
+    async def _report_progress(self) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            print(self.stats.progress(), file=sys.stderr, flush=True)
+
+    @contextlib.asynccontextmanager
+    async def running(self, directory: Path):
+        """Start the worker pool for the files of a directory, flushing the last batch on exit."""
+        self.directory = directory.resolve()
+        settings = {key: getattr(config.settings, key) for key in WORKER_SETTINGS}
+        # Workers are spawned rather than forked, the main process running an event loop and
+        # database connection threads
+        pool = ProcessPoolExecutor(
+            self.workers,
+            mp_context=get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(settings,),
+        )
+        checkpoint_file = (
+            open(self.checkpoint, "a", encoding="utf-8")  # noqa: SIM115
+            if self.checkpoint
+            else contextlib.nullcontext()
+        )
+        progress = asyncio.create_task(self._report_progress())
+        with pool, checkpoint_file as self._checkpoint_file:
+            self._pool = pool
+            try:
+                yield self
+            finally:
+                await self.flush()
+                progress.cancel()
+        print(self.stats.progress(), file=sys.stderr, flush=True)
+
+    async def run(self, directory: Path) -> ImportStats:
+        """Import the images of a directory tree, skipping those done by previous runs."""
+        done = load_checkpoint(self.checkpoint) if self.checkpoint else set()
+        # Enough files in flight to keep the workers busy while the main process writes
+        in_flight = asyncio.Semaphore(self.workers * 2)
+        tasks = set()
+
+        async def import_file(path: Path):
+            try:
+                await self.import_file(path)
+            finally:
+                in_flight.release()
+
+        async with self.running(directory):
+            for path in find_images(self.directory):
+                if str(path.relative_to(self.directory)) in done:
+                    self.stats.skipped += 1
+                    continue
+                await in_flight.acquire()
+                task = asyncio.create_task(import_file(path))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        return self.stats
@@ -1,31 +1,47 @@
 """Main application entry point for NPO API."""
 
+import asyncio
 import logging
 import time
 from contextlib import asynccontextmanager
 
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, status
 from fastapi.responses import HTMLResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from npo import config
-from npo.database import init_db
+from npo.core.file import sync_hash_index
+from npo.core.hash_index import hash_index
+from npo.core.metrics import HTTP_REQUEST_DURATION
+from npo.core.tracing import server_timing_header, should_sample, trace, write_trace
+from npo.database import engine, init_db
 from npo.dependencies import (
     make_db_directory,
     make_storage_directory,
     make_upload_directory,
+    prepare_directories,
 )
+from npo.routers.admin.routes import admin_router
 from npo.routers.files.routes import files_router
 from npo.routers.health.routes import health_router
 from npo.routers.metadata.routes import metadata_router
+from npo.routers.metrics.routes import metrics_router
 from npo.routers.settings.routes import settings_router
+from npo.routers.uploads.routes import uploads_router
+from npo.routers.utils import OrjsonResponse
 
 logger = logging.getLogger(config.settings.logger_name)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
-    logger.info("✅ Application started and database tables created!")
+    prepare_directories()
+    if await init_db():
+        logger.info("✅ Database migrated to the latest revision!")
+    async with AsyncSession(engine) as db:
+        await sync_hash_index(db, force=True)
+    logger.info(f"✅ {len(hash_index)} pixel hashes indexed!")
+    logger.info("✅ Application started!")
     yield
     logger.info("🛑 Application shutting down!")
 
@@ -38,18 +54,47 @@ app = FastAPI(
         Depends(make_storage_directory),
     ],
     lifespan=lifespan,
+    default_response_class=OrjsonResponse,
 )
 app.include_router(health_router)
 app.include_router(settings_router)
 app.include_router(files_router)
+app.include_router(uploads_router)
 app.include_router(metadata_router)
+app.include_router(metrics_router)
+app.include_router(admin_router)
 
 
 @app.middleware("http")
 async def log_requests(request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    response.headers["X-Response-Time"] = f"{(time.time() - start_time) * 1000:.2f}ms"
+    start_time = time.perf_counter()
+    # Unhandled exceptions are answered with a 500 by the server error middleware, outside this one
+    status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    try:
+        with trace(request.url.path) as root:
+            response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        duration = time.perf_counter() - start_time
+        # Use the route template rather than the raw path to keep the labels cardinality bounded
+        route_path = getattr(request.scope.get("route"), "path", "unmatched")
+        HTTP_REQUEST_DURATION.observe(
+            duration, method=request.method, route=route_path, status=status_code
+        )
+    response.headers["X-Response-Time"] = f"{duration * 1000:.2f}ms"
+    response.headers["Server-Timing"] = server_timing_header(root)
+
+    if config.settings.trace_file and should_sample(config.settings.trace_sample_rate):
+        attributes = {
+            "method": request.method,
+            "path": request.url.path,
+            "route": route_path,
+            "status": response.status_code,
+        }
+        # Appended in a thread, not to block the event loop on the file system
+        response.headers["X-Trace-Id"] = await asyncio.to_thread(
+            write_trace, config.settings.trace_file, root, attributes
+        )
     return response
 
 
@@ -0,0 +1,17 @@
+from sqlalchemy import Float, Index, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from npo.database import Base
+
+
+class Cluster(Base):
+    """Aggregate of the geotagged files sharing a geohash prefix, one row per cell."""
+
+    __table_args__ = (Index("ix_clusters_precision_geohash", "precision", "geohash"),)
+
+    precision: Mapped[int] = mapped_column(Integer)
+    geohash: Mapped[str] = mapped_column(String(12), unique=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    latitude_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    longitude_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    pixel_hash: Mapped[str | None] = mapped_column(String(32), default=None)
@@ -1,12 +1,28 @@
 from datetime import datetime
 
-from sqlalchemy import JSON, DateTime, Integer, String
+from sqlalchemy import JSON, DateTime, Float, Index, Integer, String
 from sqlalchemy.orm import Mapped, mapped_column
 
 from npo.database import Base
 
 
 class File(Base):
+    __table_args__ = (
+        # Composite indexes backing the /files/search filters, all ending with the primary key
+        # so that keyset pagination can walk them without an extra sort.
+        Index("ix_files_camera_make_camera_model_id", "camera_make", "camera_model", "id"),
+        Index("ix_files_lens_model_id", "lens_model", "id"),
+        Index("ix_files_mime_id", "mime", "id"),
+        Index("ix_files_datetime_shooting_id", "datetime_shooting", "id"),
+        Index("ix_files_iso_id", "iso", "id"),
+        Index("ix_files_focal_length_id", "focal_length", "id"),
+        Index("ix_files_geohash_id", "geohash", "id"),
+        # Duplicate checks and upload preflight lookups
+        Index("ix_files_image_unique_id", "image_unique_id"),
+        # Pixel hash lookups, a file of the same pixels being a duplicate
+        Index("ix_files_pixel_hash", "pixel_hash", unique=True),
+    )
+
     name: Mapped[str]
     path: Mapped[str] = mapped_column(String(250), unique=True)
     path_hash_dir: Mapped[str] = mapped_column(String(75), default="")
@@ -20,9 +36,16 @@ class File(Base):
     latitude: Mapped[float | None] = mapped_column(default=None)
     longitude: Mapped[float | None] = mapped_column(default=None)
     altitude: Mapped[float | None] = mapped_column(default=None)
+    geohash: Mapped[str | None] = mapped_column(String(12), default=None)
     datetime_shooting: Mapped[datetime | None] = mapped_column(DateTime, default=None)
     datetime_digitized: Mapped[datetime | None] = mapped_column(DateTime, default=None)
 
+    camera_make: Mapped[str | None] = mapped_column(String(100), default=None)
+    camera_model: Mapped[str | None] = mapped_column(String(100), default=None)
+    lens_model: Mapped[str | None] = mapped_column(String(100), default=None)
+    iso: Mapped[int | None] = mapped_column(Integer, default=None)
+    focal_length: Mapped[float | None] = mapped_column(Float, default=None)
+
     perceptual_hash: Mapped[str | None] = mapped_column(String(16), default=None)
     pixel_hash: Mapped[str | None] = mapped_column(String(32), default=None)
     file_hash: Mapped[str] = mapped_column(String(32), unique=True, nullable=False)
@@ -0,0 +1,17 @@
+from datetime import date, datetime
+
+from sqlalchemy import Date, DateTime, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from npo.database import Base
+
+
+class ShootingDay(Base):
+    """Rollup of the files shot on one day, maintained with the files table."""
+
+    day: Mapped[date] = mapped_column(Date, unique=True)
+    count: Mapped[int] = mapped_column(Integer, default=0)
+    first_datetime: Mapped[datetime] = mapped_column(DateTime)
+    first_pixel_hash: Mapped[str | None] = mapped_column(String(32), default=None)
+    last_datetime: Mapped[datetime] = mapped_column(DateTime)
+    last_pixel_hash: Mapped[str | None] = mapped_column(String(32), default=None)
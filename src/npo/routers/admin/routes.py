@@ -0,0 +1,117 @@
+from typing import Annotated, Literal
+
+from fastapi import APIRouter, Depends, Query, status
+from fastapi.responses import Response
+
+from npo.dependencies import require_admin
+from npo.routers.admin.services import (
+    dump_tracemalloc_snapshot,
+    format_tracemalloc_statistics,
+    get_memory_statistics,
+    get_tracemalloc_status,
+    profile_cpu_collapsed,
+    profile_cpu_pstats,
+    start_tracemalloc,
+    stop_tracemalloc,
+    take_tracemalloc_snapshot,
+)
+from npo.routers.utils import create_route_decorator
+
+admin_router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin)],
+)
+admin_route = create_route_decorator(admin_router)
+
+
+def _attachment(content: bytes, filename: str, media_type: str) -> Response:
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@admin_route(
+    "/profile/cpu",
+    summary="Capture a CPU profile of the running worker",
+    responses={200: {"content": {"application/octet-stream": {}, "text/plain": {}}}},
+    response_class=Response,
+)
+async def get_cpu_profile(
+    seconds: Annotated[float, Query(gt=0, le=300)] = 10,
+    profile_format: Annotated[Literal["pstats", "collapsed"], Query(alias="format")] = "pstats",
+    interval: Annotated[float, Query(ge=0.001, le=1)] = 0.005,
+):
+    """
+    Profile the worker for some seconds: `pstats` traces every call (load it with the `pstats`
+    module or snakeviz), `collapsed` samples thread stacks every `interval` seconds (for flame
+    graphs, e.g. with flamegraph.pl or speedscope).
+    """
+    if profile_format == "collapsed":
+        content = await profile_cpu_collapsed(seconds, interval)
+        return _attachment(content, "cpu.collapsed.txt", "text/plain")
+    content = await profile_cpu_pstats(seconds)
+    return _attachment(content, "cpu.pstats", "application/octet-stream")
+
+
+@admin_route(
+    "/memory/tracemalloc/start",
+    method="POST",
+    summary="Start tracing Python memory allocations",
+)
+async def post_tracemalloc_start(frames: Annotated[int, Query(ge=1, le=100)] = 1):
+    return start_tracemalloc(frames)
+
+
+@admin_route(
+    "/memory/tracemalloc/stop",
+    method="POST",
+    summary="Stop tracing Python memory allocations",
+)
+async def post_tracemalloc_stop():
+    return stop_tracemalloc()
+
+
+@admin_route(
+    "/memory/tracemalloc",
+    summary="Python memory allocations tracing status",
+)
+async def get_tracemalloc():
+    return get_tracemalloc_status()
+
+
+@admin_route(
+    "/memory/tracemalloc/snapshot",
+    summary="Take a snapshot of Python memory allocations",
+    responses={200: {"content": {"application/octet-stream": {}, "text/plain": {}}}},
+    response_class=Response,
+)
+async def get_tracemalloc_snapshot(
+    snapshot_format: Annotated[Literal["top", "diff", "dump"], Query(alias="format")] = "top",
+    key_type: Literal["lineno", "filename", "traceback"] = "lineno",
+    limit: Annotated[int, Query(ge=1, le=1000)] = 50,
+):
+    """
+    `top` lists the biggest allocations, `diff` compares with the previous snapshot and `dump`
+    returns the raw snapshot (load it with `tracemalloc.Snapshot.load()`).
+    """
+    snapshot, previous = take_tracemalloc_snapshot()
+    if snapshot_format == "dump":
+        return _attachment(
+            dump_tracemalloc_snapshot(snapshot), "memory.tracemalloc", "application/octet-stream"
+        )
+    content = format_tracemalloc_statistics(
+        snapshot, previous if snapshot_format == "diff" else None, key_type, limit
+    )
+    return _attachment(content, f"memory.{snapshot_format}.txt", "text/plain")
+
+
+@admin_route(
+    "/memory",
+    summary="Process and libvips memory statistics",
+    status_code=status.HTTP_200_OK,
+)
+async def get_memory():
+    return get_memory_statistics()
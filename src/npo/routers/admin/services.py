@@ -0,0 +1,201 @@
+import asyncio
+import cProfile
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from fastapi import status
+
+from npo.core.shared_cache import get_shared_cache_statistics
+from npo.core.tiles import get_tile_cache_statistics
+from npo.routers.utils import APIException
+
+# A single profiler can run at a time (cProfile relies on a process wide monitoring hook)
+_profiler_lock = asyncio.Lock()
+# Last tracemalloc snapshot taken, used as reference for the next one
+_snapshots: dict[str, tracemalloc.Snapshot] = {}
+
+
+def _profiler_busy() -> APIException:
+    return APIException(
+        status_code=status.HTTP_409_CONFLICT,
+        code="PROFILER_BUSY",
+        message="Another CPU profile is already running, try again later.",
+    )
+
+
+async def profile_cpu_pstats(seconds: float) -> bytes:
+    """Profiles every function call for some seconds and returns a pstats dump."""
+    if _profiler_lock.locked():
+        raise _profiler_busy()
+    async with _profiler_lock:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+
+    with tempfile.NamedTemporaryFile(suffix=".pstats") as dump:
+        profiler.dump_stats(dump.name)
+        return dump.read()
+
+
+def _frame_stack(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_qualname} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _sample_stacks(stacks: Counter, stop: threading.Event, interval: float) -> None:
+    sampler_id = threading.get_ident()
+    thread_names = {}
+    while not stop.wait(interval):
+        if len(thread_names) != threading.active_count():
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != sampler_id:
+                thread_name = thread_names.get(thread_id, str(thread_id))
+                stacks[f"{thread_name};{_frame_stack(frame)}"] += 1
+
+
+async def profile_cpu_collapsed(seconds: float, interval: float) -> bytes:
+    """
+    Samples the stacks of every thread for some seconds and returns them in the collapsed
+    format ("frame;frame;frame count" per line) used by flame graph tools.
+    """
+    if _profiler_lock.locked():
+        raise _profiler_busy()
+    async with _profiler_lock:
+        stacks: Counter = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=_sample_stacks, args=(stacks, stop, interval), name="npo-sampler", daemon=True
+        )
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()).encode()
+
+
+def start_tracemalloc(frames: int) -> dict:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        _snapshots.clear()
+    return get_tracemalloc_status()
+
+
+def stop_tracemalloc() -> dict:
+    tracemalloc.stop()
+    _snapshots.clear()
+    return get_tracemalloc_status()
+
+
+def get_tracemalloc_status() -> dict:
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "tracing": tracemalloc.is_tracing(),
+        "frames": tracemalloc.get_traceback_limit(),
+        "traced_memory": current,
+        "traced_memory_peak": peak,
+    }
+
+
+def take_tracemalloc_snapshot() -> tuple[tracemalloc.Snapshot, tracemalloc.Snapshot | None]:
+    """Takes a snapshot and returns it with the previous one, which it replaces."""
+    if not tracemalloc.is_tracing():
+        raise APIException(
+            status_code=status.HTTP_409_CONFLICT,
+            code="TRACEMALLOC_NOT_STARTED",
+            message="Memory tracing is not started.",
+        )
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)]
+    )
+    previous = _snapshots.get("last")
+    _snapshots["last"] = snapshot
+    return snapshot, previous
+
+
+def format_tracemalloc_statistics(
+    snapshot: tracemalloc.Snapshot,
+    previous: tracemalloc.Snapshot | None,
+    key_type: str,
+    limit: int,
+) -> bytes:
+    if previous is None:
+        title = f"Top {limit} allocations by {key_type}"
+        statistics = snapshot.statistics(key_type)
+    else:
+        title = f"Top {limit} allocation differences by {key_type} since previous snapshot"
+        statistics = snapshot.compare_to(previous, key_type)
+    lines = [title, *(str(statistic) for statistic in statistics[:limit])]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def dump_tracemalloc_snapshot(snapshot: tracemalloc.Snapshot) -> bytes:
+    """Serializes a snapshot, to be loaded with tracemalloc.Snapshot.load()."""
+    with tempfile.NamedTemporaryFile(suffix=".tracemalloc") as dump:
+        snapshot.dump(dump.name)
+        return dump.read()
+
+
+def _tracked_vips_memory() -> dict:
+    import pyvips  # noqa: PLC0415
+
+    # The tracked memory counters are not exported by every libvips binding build
+    functions = {
+        "tracked_memory": "vips_tracked_get_mem",
+        "tracked_memory_highwater": "vips_tracked_get_mem_highwater",
+        "tracked_allocations": "vips_tracked_get_allocs",
+        "tracked_files": "vips_tracked_get_files",
+    }
+    stats = {}
+    for key, function in functions.items():
+        try:
+            stats[key] = getattr(pyvips.vips_lib, function)()
+        except AttributeError:
+            stats[key] = None
+    return stats
+
+
+def _process_memory() -> dict:
+    stats = {"max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    try:
+        with open("/proc/self/status", encoding="ascii") as proc_status:
+            for line in proc_status:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":", 1)
+                    stats[key.lower()] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return stats
+
+
+def get_memory_statistics() -> dict:
+    import pyvips  # noqa: PLC0415
+
+    return {
+        "timestamp": time.time(),
+        "process": _process_memory(),
+        "vips_cache": {
+            "size": pyvips.cache_get_size(),
+            "max": pyvips.cache_get_max(),
+            "max_memory": pyvips.cache_get_max_mem(),
+            "max_files": pyvips.cache_get_max_files(),
+        },
+        "vips": _tracked_vips_memory(),
+        "tile_cache": get_tile_cache_statistics(),
+        "shared_cache": get_shared_cache_statistics(),
+    }
@@ -1,30 +1,46 @@
-import os
-from typing import Annotated
+import contextlib
+from typing import Annotated, Literal
 
-from fastapi import APIRouter, Depends, UploadFile, status
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from npo import config
-from npo.core.file import get_file_by_pixel_hash
+from npo.core.file import get_file_location
+from npo.core.geo import parse_bbox
+from npo.core.metrics import TILES_SERVED, UPLOADS_IN_PROGRESS
+from npo.core.tracing import span
 from npo.database import get_session
-from npo.routers.files.schemas import File
+from npo.routers.files.schemas import (
+    File,
+    FileClusters,
+    FilePreflight,
+    FilePreflightQuery,
+    FileSearchPage,
+    FileSearchQuery,
+    FileUploadResult,
+    Timeline,
+)
 from npo.routers.files.services import (
-    check_duplicates_by_image_unique_id,
-    check_duplicates_by_perceptual_hash,
-    compute_hash,
-    compute_hash_pathes,
-    compute_perceptual_hash,
-    compute_pixel_hash,
-    create_dzi,
-    extract_metadata,
+    EXPORT_MEDIA_TYPES,
+    get_clusters,
+    get_export_fields,
     get_image,
     get_tile_from_dzi,
-    move_file,
-    save_file,
-    store_file_infos,
+    get_timeline,
+    get_upload_result,
+    ingest_file,
+    preflight_files,
+    receive_files,
+    search_files,
+    search_files_within,
+    stream_export,
+)
+from npo.routers.utils import (
+    PIXEL_HASH_RESPONSES,
+    APIException,
+    create_route_decorator,
+    pixel_hash_conflict,
 )
-from npo.routers.utils import APIException, create_route_decorator
 
 FILE_NOT_FOUND = {
     "description": "File not found",
@@ -43,51 +59,173 @@ files_route = create_route_decorator(files_router)
     "/upload",
     summary="Upload files",
     status_code=status.HTTP_201_CREATED,
+    response_model=dict[str, FileUploadResult | File],
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "files": {
+                                "type": "array",
+                                "items": {"type": "string", "format": "binary"},
+                            }
+                        },
+                        "required": ["files"],
+                    }
+                }
+            },
+        }
+    },
 )
 async def compute_upload_files(
-    files: list[UploadFile], db: Annotated[AsyncSession, Depends(get_session)]
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_session)],
+    include: Annotated[
+        list[Literal["meta_data"]] | None,
+        Query(description="meta_data adds the metadata of the files, raw and extracted."),
+    ] = None,
 ):
+    """
+    The body is parsed while received: each file is streamed to the storage filesystem and
+    processed as soon as complete, without being spooled first. Each file is answered with its
+    hashes and storage path, its metadata (often tens of kilobytes) only if included.
+    """
     infos = {}
-    # Process each received files
-    for upload_file in files:
-        file = File(
-            name=upload_file.filename,
-            path=os.path.join(config.settings.uploads_dir, upload_file.filename),
-            size=upload_file.size,
-            mime=upload_file.content_type,
+    with UPLOADS_IN_PROGRESS.track_inprogress():
+        files = receive_files(request.headers.get("content-type", ""), request.stream())
+        async with contextlib.aclosing(files):
+            # Process each received files
+            async for file in files:
+                await ingest_file(file, db)
+                infos[file.name] = get_upload_result(file, include)
+
+    if not infos:
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            code="NO_FILES_UPLOADED",
+            message="The upload body has no file in its files field.",
         )
+    return infos
 
-        await save_file(upload_file, file)
 
-        await compute_perceptual_hash(file)
-        await check_duplicates_by_perceptual_hash(file, db)
-        await extract_metadata(file)
-        await check_duplicates_by_image_unique_id(file, db)
+@files_route(
+    "/preflight",
+    method="POST",
+    summary="Tell which files are already stored before uploading them",
+    response_model=FilePreflight,
+)
+async def post_files_preflight(
+    query: FilePreflightQuery, db: Annotated[AsyncSession, Depends(get_session)]
+):
+    """
+    Files are looked up by the MD5 of their content (`file_hash`), then by their EXIF
+    ImageUniqueID when given. The `missing` file hashes are the files to upload.
+    """
+    return await preflight_files(query, db)
 
-        await compute_hash(file)
-        await compute_pixel_hash(file)
-        await compute_hash_pathes(file)
-        await move_file(file)
-        await store_file_infos(file, db)
-        await create_dzi(file)
-        infos[file.name] = file.__dict__
 
-    return infos
+@files_route(
+    "/search",
+    summary="Search files by camera, lens, shooting date, ISO, focal length and mime",
+    response_model=FileSearchPage,
+)
+async def get_files_search(
+    query: Annotated[FileSearchQuery, Query()], db: Annotated[AsyncSession, Depends(get_session)]
+):
+    return await search_files(query, db)
+
+
+@files_route(
+    "/within",
+    summary="List geotagged files inside a bounding box",
+    response_model=FileSearchPage,
+)
+async def get_files_within(
+    bbox: Annotated[str, Query(description="min_lon,min_lat,max_lon,max_lat in WGS-84 degrees")],
+    db: Annotated[AsyncSession, Depends(get_session)],
+    limit: Annotated[int, Query(ge=1, le=1000)] = 500,
+    cursor: str | None = None,
+):
+    return await search_files_within(_parse_bbox_parameter(bbox), limit, cursor, db)
+
+
+@files_route(
+    "/clusters",
+    summary="Clusters of geotagged files inside a bounding box for a map zoom level",
+    response_model=FileClusters,
+)
+async def get_files_clusters(
+    bbox: Annotated[str, Query(description="min_lon,min_lat,max_lon,max_lat in WGS-84 degrees")],
+    zoom: Annotated[int, Query(ge=0, le=22)],
+    db: Annotated[AsyncSession, Depends(get_session)],
+):
+    return await get_clusters(_parse_bbox_parameter(bbox), zoom, db)
+
+
+@files_route(
+    "/timeline",
+    summary="Histogram of the files shooting dates",
+    response_model=Timeline,
+)
+async def get_files_timeline(
+    db: Annotated[AsyncSession, Depends(get_session)],
+    granularity: Literal["year", "month", "day"] = "month",
+):
+    return await get_timeline(granularity, db)
+
+
+@files_route(
+    "/export",
+    summary="Export the metadata of all files as NDJSON or CSV",
+    responses={200: {"content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()}}},
+    response_class=StreamingResponse,
+)
+async def get_files_export(
+    db: Annotated[AsyncSession, Depends(get_session)],
+    export_format: Annotated[Literal["ndjson", "csv"], Query(alias="format")] = "ndjson",
+    fields: Annotated[
+        str | None, Query(description="Comma separated list of fields, all but meta_data if empty.")
+    ] = None,
+    include_meta_data: bool = False,
+):
+    selected_fields = get_export_fields(fields, include_meta_data)
+    return StreamingResponse(
+        stream_export(selected_fields, export_format, db),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="files.{export_format}"'},
+    )
+
+
+def _parse_bbox_parameter(bbox: str) -> tuple[float, float, float, float]:
+    try:
+        return parse_bbox(bbox)
+    except ValueError:
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            code="INVALID_BBOX",
+            message=f"Bounding box {bbox} is invalid, expected min_lon,min_lat,max_lon,max_lat.",
+        ) from None
 
 
 @files_route(
     "/{pixel_hash}/{zoom}/{x}/{y}.jpg",
     summary="Get tile image by pixel hash, zoom level and coordinates",
-    responses={200: {"content": {"image/jpeg": {}}}},
+    responses={200: {"content": {"image/jpeg": {}}}, **PIXEL_HASH_RESPONSES},
     response_class=Response,
     override_404=FILE_NOT_FOUND,
 )
 async def get_image_tile(
     pixel_hash: str, zoom: int, x: int, y: int, db: Annotated[AsyncSession, Depends(get_session)]
 ):
-    file_storage = await get_file_by_pixel_hash(pixel_hash, db)
-    if file_storage:
-        image_bytes: bytes = await get_tile_from_dzi(file_storage, zoom, x, y)
+    with span("db_lookup"), pixel_hash_conflict():
+        file_location = await get_file_location(pixel_hash, db)
+    if file_location:
+        image_bytes: bytes = await get_tile_from_dzi(file_location, zoom, x, y)
+        if image_bytes:
+            TILES_SERVED.inc()
         return Response(content=image_bytes, media_type="image/jpeg")
     else:
         raise APIException(
@@ -100,15 +238,16 @@ async def get_image_tile(
 @files_route(
     "/{pixel_hash}",
     summary="Get file image by hash",
-    responses={200: {"content": {"image/jpeg": {}}}},
+    responses={200: {"content": {"image/jpeg": {}}}, **PIXEL_HASH_RESPONSES},
     response_class=Response,
     override_404=FILE_NOT_FOUND,
 )
 async def get_image_full(pixel_hash: str, db: Annotated[AsyncSession, Depends(get_session)]):
-    file_storage = await get_file_by_pixel_hash(pixel_hash, db)
-    if file_storage:
-        image_bytes: bytes = await get_image(file_storage)
-        return Response(content=image_bytes, media_type=file_storage.mime)
+    with span("db_lookup"), pixel_hash_conflict():
+        file_location = await get_file_location(pixel_hash, db)
+    if file_location:
+        image_bytes: bytes = await get_image(file_location)
+        return Response(content=image_bytes, media_type=file_location.mime)
     else:
         raise APIException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -1,6 +1,7 @@
 from datetime import datetime
+from typing import Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class File(BaseModel):
@@ -21,9 +22,137 @@ class File(BaseModel):
     datetime_shooting: datetime | None = None
     datetime_digitized: datetime | None = None
 
+    camera_make: str | None = None
+    camera_model: str | None = None
+    lens_model: str | None = None
+    iso: int | None = None
+    focal_length: float | None = None
+
     image_unique_id: str | None = None
     perceptual_hash: str | None = None
     pixel_hash: str | None = None
     file_hash: str = ""
 
     meta_data: dict | None = None
+
+
+class FileUploadResult(BaseModel):
+    """Compact result of the upload of a file: its hashes and where it is stored."""
+
+    name: str
+    path: str
+    path_hash_dir: str = ""
+    path_hash_file: str = ""
+    mime: str | None = None
+    size: int | None = None
+    image_unique_id: str | None = None
+    perceptual_hash: str | None = None
+    pixel_hash: str | None = None
+    file_hash: str = ""
+
+
+class FileSearchQuery(BaseModel):
+    """Query parameters accepted by the file search endpoint."""
+
+    camera_make: str | None = None
+    camera_model: str | None = None
+    lens_model: str | None = None
+    mime: str | None = None
+    date_from: datetime | None = Field(None, description="Inclusive lower bound of shooting date.")
+    date_to: datetime | None = Field(None, description="Exclusive upper bound of shooting date.")
+    iso_min: int | None = Field(None, ge=0)
+    iso_max: int | None = Field(None, ge=0)
+    focal_length_min: float | None = Field(None, ge=0)
+    focal_length_max: float | None = Field(None, ge=0)
+    sort: Literal["id", "datetime_shooting"] = "id"
+    limit: int = Field(100, ge=1, le=500)
+    cursor: str | None = Field(None, description="Opaque cursor returned by the previous page.")
+
+
+class FilePreflightItem(BaseModel):
+    """A file the client may upload, identified by the MD5 of its content."""
+
+    file_hash: str = Field(..., pattern="^[0-9a-fA-F]{32}$")
+    image_unique_id: str | None = Field(None, max_length=64)
+
+
+class FilePreflightQuery(BaseModel):
+    """Files to check before uploading them."""
+
+    files: list[FilePreflightItem] = Field(..., max_length=10000)
+
+
+class FilePreflightResult(BaseModel):
+    """Whether a file of the query is already stored, and which stored file matched it."""
+
+    file_hash: str
+    image_unique_id: str | None = None
+    exists: bool
+    matched_by: Literal["file_hash", "image_unique_id"] | None = None
+    pixel_hash: str | None = None
+
+
+class FilePreflight(BaseModel):
+    """Answer of the upload preflight, in the order of the query."""
+
+    items: list[FilePreflightResult]
+    missing: list[str] = Field(..., description="File hashes of the files to upload.")
+
+
+class FileSummary(BaseModel):
+    """Narrow projection of a stored file, used by listing endpoints."""
+
+    pixel_hash: str | None = None
+    short_hash: str | None = Field(
+        None, description="Shortest prefix of the pixel hash matching only this file so far."
+    )
+    name: str
+    mime: str | None = None
+    datetime_shooting: datetime | None = None
+    camera_make: str | None = None
+    camera_model: str | None = None
+    lens_model: str | None = None
+    iso: int | None = None
+    focal_length: float | None = None
+    latitude: float | None = None
+    longitude: float | None = None
+
+
+class FileSearchPage(BaseModel):
+    """A page of file search results."""
+
+    items: list[FileSummary]
+    next_cursor: str | None = None
+
+
+class FileCluster(BaseModel):
+    """Aggregate of the geotagged files of one geohash cell."""
+
+    geohash: str
+    count: int
+    latitude: float = Field(..., description="Latitude of the cluster centroid.")
+    longitude: float = Field(..., description="Longitude of the cluster centroid.")
+    pixel_hash: str | None = Field(None, description="Pixel hash of a representative file.")
+
+
+class FileClusters(BaseModel):
+    """Clusters of geotagged files for a map view."""
+
+    precision: int
+    items: list[FileCluster]
+
+
+class TimelineBucket(BaseModel):
+    """Number of files shot during a period."""
+
+    period: str = Field(..., description="Period formatted as YYYY, YYYY-MM or YYYY-MM-DD.")
+    count: int
+    first_pixel_hash: str | None = None
+    last_pixel_hash: str | None = None
+
+
+class Timeline(BaseModel):
+    """Histogram of the files shooting dates."""
+
+    granularity: Literal["year", "month", "day"]
+    buckets: list[TimelineBucket]
@@ -1,63 +1,240 @@
+import asyncio
+import base64
+import binascii
+import contextlib
+import csv
+import errno
 import hashlib
+import io
+import json
+import mimetypes
 import os
-from datetime import datetime
-from zipfile import ZipFile
+import re
+import shutil
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta
 
-import exiftool
-import pyvips
-from fastapi import UploadFile, status
-from pyvips.enums import ForeignDzContainer, ForeignDzDepth, ForeignDzLayout
+from fastapi import status
+from sqlalchemy import and_, case, delete, func, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from npo import config
+from npo.core import storage
 from npo.core.file import (
+    FileLocation,
+    get_file_by_file_hash,
     get_file_by_image_unique_id,
     get_file_by_perceptual_hash,
     get_file_by_pixel_hash,
+    get_short_hash,
+    sync_hash_index,
 )
+from npo.core.geo import (
+    covering_precision,
+    covering_ranges,
+    encode_geohash,
+    next_geohash,
+    zoom_to_precision,
+)
+from npo.core.hash_index import hash_index
+from npo.core.metrics import DUPLICATES_REJECTED, INGESTED_BYTES, INGESTED_FILES, timed_stage
+from npo.core.multipart import MultipartError, MultipartReceiver
+from npo.core.singleflight import flights
+from npo.core.tiles import CachedTileStore, get_tile_store
+from npo.core.tracing import span
+from npo.dependencies import ensure_directory
+from npo.models.cluster import Cluster
 from npo.models.file import File as FileStorage
-from npo.routers.files.schemas import File
+from npo.models.shooting_day import ShootingDay
+from npo.routers.files.schemas import (
+    File,
+    FileCluster,
+    FileClusters,
+    FilePreflight,
+    FilePreflightQuery,
+    FilePreflightResult,
+    FileSearchPage,
+    FileSearchQuery,
+    FileSummary,
+    FileUploadResult,
+    Timeline,
+    TimelineBucket,
+)
 from npo.routers.utils import APIException
 
+# pyvips and exiftool are imported by the functions using them, so that the application startup
+# and the code not processing images do not pay for loading libvips and exiftool bindings.
+
+# Uploaded files are received in this directory of the storage, and the field holding them
+INCOMING_DIR = ".incoming"
+UPLOAD_FIELD = "files"
+# Errors of copy_file_range for which a regular copy is done instead (e.g. older kernels not
+# supporting copies across filesystems)
+COPY_FILE_RANGE_UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL)
+
+# Header field set by libvips for the EXIF ImageUniqueID, and the format of its ASCII values:
+# "<value> (<value>, ASCII, 33 components, 33 bytes)"
+IMAGE_UNIQUE_ID_FIELD = "exif-ifd2-ImageUniqueID"
+EXIF_ASCII_VALUE = re.compile(
+    r"^.* \((?P<value>.*), ASCII, \d+ components?, \d+ bytes?\)$", re.DOTALL
+)
+
+# Clusters are kept for geohash precisions 1 (~5000 km) to 8 (~40 m)
+MAX_CLUSTER_PRECISION = 8
+# Upper bound of cluster cells returned for a single bounding box
+MAX_CLUSTER_CELLS = 4096
+
+
+def get_incoming_dir() -> str:
+    """Directory receiving the uploaded files, on the storage filesystem to move them cheaply."""
+    return os.path.join(config.settings.storage_dir, INCOMING_DIR)
+
+
+async def receive_files(content_type: str, stream: AsyncIterator[bytes]) -> AsyncIterator[File]:
+    """
+    Yield the files of a multipart upload (`files` field) as soon as each one is received,
+    written to the incoming directory and hashed while streamed. Files still in the incoming
+    directory when the consumer resumes (rejected ones) are removed.
+    """
+    incoming_dir = get_incoming_dir()
+    ensure_directory(incoming_dir)
+    try:
+        receiver = MultipartReceiver(content_type, incoming_dir)
+        async with contextlib.aclosing(receiver.receive(stream)) as received_files:
+            async for received in received_files:
+                if received.field_name != UPLOAD_FIELD or not received.filename:
+                    os.remove(received.path)
+                    continue
+                file = File(
+                    name=received.filename,
+                    path=received.path,
+                    size=received.size,
+                    mime=received.content_type or mimetypes.guess_type(received.filename)[0],
+                    file_hash=received.md5,
+                )
+                try:
+                    yield file
+                finally:
+                    if file.path == received.path:
+                        with contextlib.suppress(FileNotFoundError):
+                            os.remove(received.path)
+    except MultipartError as error:
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            code="INVALID_MULTIPART",
+            message=f"The upload body is invalid: {error}",
+        ) from None
+
+
+def get_upload_result(file: File, include: list[str] | None = None) -> FileUploadResult | File:
+    """Answer of an ingested file: compact, unless its metadata is included."""
+    if include and "meta_data" in include:
+        return file
+    return FileUploadResult(**file.model_dump(include=set(FileUploadResult.model_fields)))
 
-async def save_file(upload_file: UploadFile, file: File):
+
+async def ingest_file(file: File, db: AsyncSession) -> None:
+    """
+    Run the ingestion pipeline on a file received in the uploads directory: reject duplicates,
+    extract its metadata and hashes, move it to the storage and create its pyramid.
+    Duplicate checks run cheapest first and stop at the first hit: file hash (usually computed
+    while receiving the file), ImageUniqueID read from the image header, perceptual hash, then
+    pixel hash. Rejected files are removed.
+    """
     try:
-        with open(file.path, "wb") as buffer:
-            while True:
-                chunk = await upload_file.read(1024)
-                if not chunk:
-                    break
-                buffer.write(chunk)
-    except IOError:
-        return {"message": "There was an error uploading the file"}
-    finally:
-        await upload_file.close()
+        if not file.file_hash:
+            await compute_hash(file)
+        await check_duplicates_by_file_hash(file, db)
+        await read_image_unique_id(file)
+        await check_duplicates_by_image_unique_id(file, db)
+        await compute_perceptual_hash(file)
+        await check_duplicates_by_perceptual_hash(file, db)
 
+        header_image_unique_id = file.image_unique_id
+        await extract_metadata(file)
+        if file.image_unique_id != header_image_unique_id:
+            # Formats whose EXIF data is not exposed by libvips
+            await check_duplicates_by_image_unique_id(file, db)
+        await compute_pixel_hash(file)
+        await check_duplicates_by_pixel_hash(file, db)
+    except APIException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(file.path)
+        raise
 
+    await compute_hash_pathes(file)
+    await move_file(file)
+    await store_file_infos(file, db)
+    await create_dzi(file)
+    INGESTED_FILES.inc()
+    INGESTED_BYTES.inc(file.size or 0)
+
+
+@timed_stage("compute_hash")
 async def compute_hash(file: File) -> None:
+    # Hashed by chunks, without loading the whole file in memory
     with open(file.path, "rb") as file_to_hash:
-        data = file_to_hash.read()
-        file.file_hash = hashlib.md5(data).hexdigest()
+        file.file_hash = hashlib.file_digest(file_to_hash, "md5").hexdigest()
+
 
+@timed_stage("check_duplicates_by_file_hash")
+async def check_duplicates_by_file_hash(file: File, db: AsyncSession) -> None:
+    if await get_file_by_file_hash(file.file_hash, db):
+        DUPLICATES_REJECTED.inc(reason="file_hash")
+        raise APIException(
+            status_code=status.HTTP_409_CONFLICT,
+            code="DUPLICATE_FILE_HASH",
+            message=f"File {file.name} with file hash {file.file_hash} already exists.",
+        )
 
+
+@timed_stage("read_image_unique_id")
+async def read_image_unique_id(file: File) -> None:
+    """
+    Read the EXIF ImageUniqueID from the image header with libvips, without decoding the
+    pixels nor running exiftool, for the duplicate check to run before them.
+    """
+    import pyvips  # noqa: PLC0415
+
+    try:
+        header = pyvips.Image.new_from_file(file.path)
+        if not header.get_typeof(IMAGE_UNIQUE_ID_FIELD):
+            return
+        value = header.get(IMAGE_UNIQUE_ID_FIELD)
+    except pyvips.Error:
+        # Unreadable files are reported by the next stages
+        return
+    match = EXIF_ASCII_VALUE.match(value)
+    file.image_unique_id = (match.group("value") if match else value).strip() or None
+
+
+@timed_stage("compute_pixel_hash")
 async def compute_pixel_hash(file: File) -> None:
     """
     Computes a BLAKE2b hash based on raw image pixels via pyvips.
     Ignores metadata (EXIF, etc).
     """
+    import pyvips  # noqa: PLC0415
+
     img = pyvips.Image.new_from_file(file.path, access="sequential")
 
     # write_to_memory() forces decoding and returns pixel bytes (RGB/RGBA...)
-    data = img.write_to_memory()
+    with span("decode"):
+        data = img.write_to_memory()
     # digest_size=16 produces 128 bits (32 hex chars), same format as MD5 but faster/safer
-    file.pixel_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+    with span("blake2b"):
+        file.pixel_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
 
 
+@timed_stage("compute_perceptual_hash")
 async def compute_perceptual_hash(file: File) -> None:
     """
     Computes a perceptual hash (dHash) using pyvips.
     Resistant to resizing and compression.
     """
+    import pyvips  # noqa: PLC0415
+
     # Load and resize to 9x8 pixels (force size without preserving aspect ratio)
     # Use access="sequential" to force streaming mode and save memory
     img = pyvips.Image.new_from_file(file.path, access="sequential")
@@ -81,8 +258,10 @@ async def compute_perceptual_hash(file: File) -> None:
     file.perceptual_hash = f"{hash_val:016x}"
 
 
+@timed_stage("check_duplicates_by_perceptual_hash")
 async def check_duplicates_by_perceptual_hash(file: File, db: AsyncSession) -> None:
     if await get_file_by_perceptual_hash(file.perceptual_hash, db):
+        DUPLICATES_REJECTED.inc(reason="perceptual_hash")
         raise APIException(
             status_code=status.HTTP_409_CONFLICT,
             code="DUPLICATE_PERCEPTUAL_HASH",
@@ -92,6 +271,7 @@ async def check_duplicates_by_perceptual_hash(file: File, db: AsyncSession) -> N
         )
 
 
+@timed_stage("compute_hash_pathes")
 async def compute_hash_pathes(file: File) -> None:
     step: int = config.settings.hash_dir_step
     chunks = [file.pixel_hash[i : i + step] for i in range(0, len(file.pixel_hash), step)]
@@ -103,33 +283,116 @@ async def compute_hash_pathes(file: File) -> None:
             file.path_hash_file += chunk
 
 
-async def move_file(file: File) -> None:
+def get_relative_path(file: File | FileStorage | FileLocation, extension: str = ".jpg") -> str:
+    """Path of a file in the hashed layout, relative to the storage volumes."""
     # TODO: Use file mime type to determine file extension
-    storage_path = os.path.join(
-        config.settings.storage_dir, file.path_hash_dir, file.path_hash_file + ".jpg"
-    )
+    return file.path_hash_dir + file.path_hash_file + extension
+
+
+def get_storage_path(file: File, extension: str = ".jpg") -> str:
+    """Path of a file on the volume its pixel hash places it on."""
+    return storage.get_path(get_relative_path(file, extension))
+
+
+def copy_file(source: str, destination: str) -> None:
+    """
+    Copy a file within the kernel: copy_file_range shares the data blocks on filesystems
+    supporting reflinks (Btrfs, XFS), shutil falls back on sendfile or plain copies.
+    """
+    if hasattr(os, "copy_file_range"):
+        with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+            try:
+                remaining = os.fstat(source_file.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(
+                        source_file.fileno(), destination_file.fileno(), remaining
+                    )
+                    if not copied:
+                        break
+                    remaining -= copied
+                return
+            except OSError as error:
+                if error.errno not in COPY_FILE_RANGE_UNSUPPORTED:
+                    raise
+    shutil.copyfile(source, destination)
+
+
+@timed_stage("move_file")
+async def move_file(file: File) -> None:
+    storage_path = get_storage_path(file)
+    os.makedirs(os.path.dirname(storage_path), exist_ok=True)
+    try:
+        os.rename(file.path, storage_path)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+        # Uploads directory on another filesystem: copied under a temporary name, so that the
+        # storage never holds a partial file
+        temporary_path = f"{storage_path}.{os.getpid()}.tmp"
+        copy_file(file.path, temporary_path)
+        os.replace(temporary_path, storage_path)
+        os.remove(file.path)
+    file.path = storage_path
+
+
+@timed_stage("link_file")
+async def link_file(file: File, copy: bool = False) -> None:
+    """
+    Add the file to the storage layout while leaving the source in place: hardlinked, or copied
+    when asked or when the storage is on another filesystem (or does not support hardlinks).
+    """
+    storage_path = get_storage_path(file)
     os.makedirs(os.path.dirname(storage_path), exist_ok=True)
-    os.rename(file.path, storage_path)
+    # Written under a temporary name then renamed, an interrupted import never leaves a
+    # partial file and a resumed one can replace a file stored by the previous run.
+    temporary_path = f"{storage_path}.{os.getpid()}.tmp"
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(temporary_path)
+    try:
+        if copy:
+            copy_file(file.path, temporary_path)
+        else:
+            os.link(file.path, temporary_path)
+    except OSError as error:
+        if copy or error.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        copy_file(file.path, temporary_path)
+    os.replace(temporary_path, storage_path)
     file.path = storage_path
 
 
+@timed_stage("extract_metadata")
 async def extract_metadata(file: File) -> None:
-    with exiftool.ExifToolHelper() as et:
+    import exiftool  # noqa: PLC0415
+
+    with span("exiftool"), exiftool.ExifToolHelper() as et:
         metadata = et.get_metadata(file.path, params=["-n"])
-        for item in metadata:
-            file.meta_data = item
-            file.orientation = item.get("EXIF:Orientation")
-            file.image_unique_id = item.get("EXIF:ImageUniqueID")
+    for item in metadata:
+        apply_metadata(file, item)
+
+
+def apply_metadata(file: File, item: dict) -> None:
+    """Set the file fields from the metadata returned by exiftool (run with the -n option)."""
+    file.meta_data = item
+    file.orientation = item.get("EXIF:Orientation")
+    file.image_unique_id = item.get("EXIF:ImageUniqueID")
 
-            # GPS Data
-            check_gps_map_datum(file, item)
-            file.latitude = extract_metadata_latitude(item)
-            file.longitude = extract_metadata_longitude(item)
-            file.altitude = extract_metadata_altitude(item)
+    # GPS Data
+    check_gps_map_datum(file, item)
+    file.latitude = extract_metadata_latitude(item)
+    file.longitude = extract_metadata_longitude(item)
+    file.altitude = extract_metadata_altitude(item)
 
-            # DateTime Data
-            file.datetime_shooting = parse_exif_date(item.get("EXIF:DateTimeOriginal"))
-            file.datetime_digitized = parse_exif_date(item.get("EXIF:DateTimeDigitized"))
+    # DateTime Data
+    file.datetime_shooting = parse_exif_date(item.get("EXIF:DateTimeOriginal"))
+    file.datetime_digitized = parse_exif_date(item.get("EXIF:DateTimeDigitized"))
+
+    # Camera Data (indexed copies of the EXIF fields used by the search endpoint)
+    file.camera_make = extract_metadata_text(item, "EXIF:Make")
+    file.camera_model = extract_metadata_text(item, "EXIF:Model")
+    file.lens_model = extract_metadata_text(item, "EXIF:LensModel")
+    file.iso = extract_metadata_iso(item)
+    file.focal_length = extract_metadata_focal_length(item)
 
 
 def check_gps_map_datum(file: File, metadata: dict) -> None:
@@ -168,6 +431,33 @@ def extract_metadata_longitude(metadata: dict) -> float | None:
     return longitude
 
 
+def extract_metadata_text(metadata: dict, key: str) -> str | None:
+    value = metadata.get(key)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value[:100] or None
+
+
+def extract_metadata_iso(metadata: dict) -> int | None:
+    iso = metadata.get("EXIF:ISO") or metadata.get("EXIF:ISOSpeedRatings")
+    # Some cameras store several values (e.g. "100 0"), keep the first one
+    if isinstance(iso, str):
+        iso = iso.split()[0] if iso.split() else None
+    try:
+        return int(float(iso)) if iso is not None else None
+    except (ValueError, TypeError):
+        return None
+
+
+def extract_metadata_focal_length(metadata: dict) -> float | None:
+    focal_length = metadata.get("EXIF:FocalLength")
+    try:
+        return float(focal_length) if focal_length is not None else None
+    except (ValueError, TypeError):
+        return None
+
+
 def parse_exif_date(date_str: str | None) -> datetime | None:
     if not date_str:
         return None
@@ -177,8 +467,11 @@ def parse_exif_date(date_str: str | None) -> datetime | None:
         return None
 
 
+@timed_stage("check_duplicates_by_image_unique_id")
 async def check_duplicates_by_image_unique_id(file: File, db: AsyncSession) -> None:
-    if await get_file_by_image_unique_id(file.image_unique_id, db):
+    # Files without ImageUniqueID are not duplicates of each other
+    if file.image_unique_id and await get_file_by_image_unique_id(file.image_unique_id, db):
+        DUPLICATES_REJECTED.inc(reason="image_unique_id")
         raise APIException(
             status_code=status.HTTP_409_CONFLICT,
             code="DUPLICATE_IMAGE_UNIQUE_ID",
@@ -188,10 +481,38 @@ async def check_duplicates_by_image_unique_id(file: File, db: AsyncSession) -> N
         )
 
 
+@timed_stage("check_duplicates_by_pixel_hash")
+async def check_duplicates_by_pixel_hash(file: File, db: AsyncSession) -> None:
+    if await get_file_by_pixel_hash(file.pixel_hash, db):
+        DUPLICATES_REJECTED.inc(reason="pixel_hash")
+        raise APIException(
+            status_code=status.HTTP_409_CONFLICT,
+            code="DUPLICATE_PIXEL_HASH",
+            message=f"File {file.name} with pixel hash {file.pixel_hash} already exists.",
+        )
+
+
+@timed_stage("store_file_infos")
 async def store_file_infos(file: File, db: AsyncSession) -> None:
+    file_storage = await add_file_infos(file, db)
+    await db.commit()
+    await db.refresh(file_storage)
+    if file_storage.pixel_hash:
+        hash_index.add(file_storage.pixel_hash)
+
+
+async def add_file_infos(file: File, db: AsyncSession) -> FileStorage:
+    """
+    Insert or update the file row and its cluster and shooting day aggregates, without
+    committing, so that bulk imports can write several files per transaction.
+    """
     file_storage = await get_file_by_pixel_hash(file.pixel_hash, db)
+    previous_position = None
+    previous_datetime_shooting = None
 
     if file_storage:
+        previous_position = (file_storage.geohash, file_storage.latitude, file_storage.longitude)
+        previous_datetime_shooting = file_storage.datetime_shooting
         data = file.model_dump(exclude_none=True)
         data.pop("id", None)
         for key, value in data.items():
@@ -200,45 +521,582 @@ async def store_file_infos(file: File, db: AsyncSession) -> None:
         file_storage = FileStorage(**file.__dict__)
         db.add(file_storage)
 
-    await db.commit()
-    await db.refresh(file_storage)
+    file_storage.geohash = encode_geohash(file_storage.latitude, file_storage.longitude)
+    position = (file_storage.geohash, file_storage.latitude, file_storage.longitude)
+    if position != previous_position:
+        if previous_position:
+            await update_clusters(previous_position, file_storage.pixel_hash, -1, db)
+        await update_clusters(position, file_storage.pixel_hash, 1, db)
+
+    if file_storage.datetime_shooting != previous_datetime_shooting:
+        if previous_datetime_shooting:
+            await remove_from_shooting_day(previous_datetime_shooting, file_storage.pixel_hash, db)
+        if file_storage.datetime_shooting:
+            await add_to_shooting_day(file_storage.datetime_shooting, file_storage.pixel_hash, db)
 
+    return file_storage
+
+
+def _insert(model, db: AsyncSession):
+    """INSERT statement in the dialect of the database, for its ON CONFLICT clause."""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+async def update_clusters(
+    position: tuple[str | None, float | None, float | None],
+    pixel_hash: str | None,
+    step: int,
+    db: AsyncSession,
+) -> None:
+    """
+    Adds (step=1) or removes (step=-1) a geotagged file, given by its (geohash, latitude,
+    longitude) position, from the cluster aggregates of every precision in the caller transaction.
+    The counters are updated by the database (count = count + 1), not read and written back, so
+    that concurrent ingests (API workers, importer, watcher) neither lose updates nor conflict on
+    the creation of a cell.
+    """
+    geohash, latitude, longitude = position
+    if geohash is None:
+        return
 
+    prefixes = [geohash[:precision] for precision in range(1, MAX_CLUSTER_PRECISION + 1)]
+    if step > 0:
+        stmt = _insert(Cluster, db).values(
+            [
+                {
+                    "precision": precision,
+                    "geohash": prefix,
+                    "count": 1,
+                    "latitude_sum": latitude,
+                    "longitude_sum": longitude,
+                    "pixel_hash": pixel_hash,
+                }
+                for precision, prefix in enumerate(prefixes, start=1)
+            ]
+        )
+        await db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Cluster.geohash],
+                set_={
+                    "count": Cluster.count + 1,
+                    "latitude_sum": Cluster.latitude_sum + stmt.excluded.latitude_sum,
+                    "longitude_sum": Cluster.longitude_sum + stmt.excluded.longitude_sum,
+                    "pixel_hash": func.coalesce(Cluster.pixel_hash, stmt.excluded.pixel_hash),
+                    "updated_at": func.now(),
+                },
+            )
+        )
+        return
+
+    in_cells = Cluster.geohash.in_(prefixes)
+    await db.execute(
+        update(Cluster)
+        .where(in_cells)
+        .values(
+            count=Cluster.count - 1,
+            latitude_sum=Cluster.latitude_sum - latitude,
+            longitude_sum=Cluster.longitude_sum - longitude,
+        )
+    )
+    await db.execute(delete(Cluster).where(in_cells, Cluster.count <= 0))
+
+    # The removed file may have been the representative of its cells: pick another file of each
+    # cell through the ix_files_geohash_id index
+    result = await db.execute(
+        select(Cluster.geohash).where(in_cells, Cluster.pixel_hash == pixel_hash)
+    )
+    for prefix in result.scalars():
+        cell_files = select(FileStorage.pixel_hash).where(
+            FileStorage.geohash >= prefix, FileStorage.pixel_hash != pixel_hash
+        )
+        if (end := next_geohash(prefix)) is not None:
+            cell_files = cell_files.where(FileStorage.geohash < end)
+        representative = (
+            await db.execute(cell_files.order_by(FileStorage.geohash, FileStorage.id).limit(1))
+        ).scalar()
+        await db.execute(
+            update(Cluster).where(Cluster.geohash == prefix).values(pixel_hash=representative)
+        )
+
+
+async def add_to_shooting_day(shot_at: datetime, pixel_hash: str | None, db: AsyncSession) -> None:
+    """Count a file in its shooting day, with an upsert for the same reasons as update_clusters."""
+    stmt = _insert(ShootingDay, db).values(
+        day=shot_at.date(),
+        count=1,
+        first_datetime=shot_at,
+        first_pixel_hash=pixel_hash,
+        last_datetime=shot_at,
+        last_pixel_hash=pixel_hash,
+    )
+    # The expressions of the update all read the row as it was before it
+    is_first = stmt.excluded.first_datetime < ShootingDay.first_datetime
+    is_last = stmt.excluded.last_datetime > ShootingDay.last_datetime
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[ShootingDay.day],
+            set_={
+                "count": ShootingDay.count + 1,
+                "first_datetime": case(
+                    (is_first, stmt.excluded.first_datetime), else_=ShootingDay.first_datetime
+                ),
+                "first_pixel_hash": case(
+                    (is_first, stmt.excluded.first_pixel_hash), else_=ShootingDay.first_pixel_hash
+                ),
+                "last_datetime": case(
+                    (is_last, stmt.excluded.last_datetime), else_=ShootingDay.last_datetime
+                ),
+                "last_pixel_hash": case(
+                    (is_last, stmt.excluded.last_pixel_hash), else_=ShootingDay.last_pixel_hash
+                ),
+                "updated_at": func.now(),
+            },
+        )
+    )
+
+
+async def remove_from_shooting_day(
+    shot_at: datetime, pixel_hash: str | None, db: AsyncSession
+) -> None:
+    day = ShootingDay.day == shot_at.date()
+    await db.execute(update(ShootingDay).where(day).values(count=ShootingDay.count - 1))
+    result = await db.execute(delete(ShootingDay).where(day, ShootingDay.count <= 0))
+    if result.rowcount:
+        return
+
+    # The removed file may have been the first or last of the day: look them up again
+    # through the ix_files_datetime_shooting_id index, restricted to this day.
+    day_start = datetime.combine(shot_at.date(), datetime.min.time())
+    day_files = (
+        select(FileStorage.datetime_shooting, FileStorage.pixel_hash)
+        .where(FileStorage.datetime_shooting >= day_start)
+        .where(FileStorage.datetime_shooting < day_start + timedelta(days=1))
+        .where(FileStorage.pixel_hash != pixel_hash)
+    )
+    first = (
+        await db.execute(day_files.order_by(FileStorage.datetime_shooting, FileStorage.id).limit(1))
+    ).first()
+    last = (
+        await db.execute(
+            day_files.order_by(FileStorage.datetime_shooting.desc(), FileStorage.id.desc()).limit(1)
+        )
+    ).first()
+    if first and last:
+        await db.execute(
+            update(ShootingDay)
+            .where(day)
+            .values(
+                first_datetime=first.datetime_shooting,
+                first_pixel_hash=first.pixel_hash,
+                last_datetime=last.datetime_shooting,
+                last_pixel_hash=last.pixel_hash,
+            )
+        )
+
+
+@timed_stage("create_dzi")
 async def create_dzi(file: File) -> None:
+    """Create the tiles pyramid of the file, in the store of the configured tile backend."""
+    import pyvips  # noqa: PLC0415
+
     img = pyvips.Image.new_from_file(file.path)
     img = img.autorot()
-    dzi_path = config.settings.storage_dir + file.path_hash_dir + file.path_hash_file + ".szi"
-    img.dzsave(
-        dzi_path,
-        layout=ForeignDzLayout.GOOGLE,
-        tile_size=256,
-        overlap=1,
-        suffix=".jpg",
-        depth=ForeignDzDepth.ONETILE,
-        container=ForeignDzContainer.ZIP,
-        Q=85,
-    )
+    get_tile_store().save(file, img)
 
 
-async def get_tile_from_dzi(file: FileStorage, zoom: int, x: int, y: int) -> bytes | None:
-    dzi_path = config.settings.storage_dir + file.path_hash_dir + file.path_hash_file + ".szi"
-    if not os.path.exists(dzi_path):
-        return None
+@timed_stage("get_tile_from_dzi")
+async def get_tile_from_dzi(
+    file: FileStorage | FileLocation, zoom: int, x: int, y: int
+) -> bytes | None:
+    """
+    Tiles in the cache are returned directly, the others are read in a thread, once for all
+    the concurrent requests of the same tile.
+    """
+    store = get_tile_store()
+    if isinstance(store, CachedTileStore):
+        tile = store.lookup(file, zoom, x, y)
+        if tile is not None:
+            return tile
+        read = store.load
+    else:
+        read = store.get
+    return await flights.do(
+        ("tile", file.pixel_hash, zoom, x, y),
+        lambda: asyncio.to_thread(read, file, zoom, x, y),
+    )
 
-    with ZipFile(dzi_path, "r") as zip_file:
-        tile_path = f"{file.path_hash_file}/{zoom}/{x}/{y}.jpg"
-        try:
-            with zip_file.open(tile_path) as tile_file:
-                return tile_file.read()
-        except KeyError:
-            return None
 
+@timed_stage("get_image")
+async def get_image(file: FileStorage | FileLocation) -> bytes | None:
+    """Read the original in a thread, once for all the concurrent requests of the same file."""
+    return await flights.do(("image", file.pixel_hash), lambda: asyncio.to_thread(read_image, file))
 
-async def get_image(file: FileStorage) -> bytes | None:
-    img_path = config.settings.storage_dir + file.path_hash_dir + file.path_hash_file + ".jpg"
+
+def read_image(file: FileStorage | FileLocation) -> bytes | None:
+    img_path = storage.find_path(get_relative_path(file))
+    if img_path is None:
+        return None
 
     try:
         with open(img_path, "rb") as img_file:
             return img_file.read()
     except FileNotFoundError:
         return None
+
+
+# Values per IN list, well below the bound parameters limit of SQLite and PostgreSQL
+PREFLIGHT_CHUNK_SIZE = 500
+
+
+async def _find_stored(column, values: set[str], db: AsyncSession) -> dict[str, str | None]:
+    """Return the pixel hash of the stored files by value of an indexed column."""
+    stored = {}
+    values = sorted(values)
+    for start in range(0, len(values), PREFLIGHT_CHUNK_SIZE):
+        chunk = values[start : start + PREFLIGHT_CHUNK_SIZE]
+        result = await db.execute(select(column, FileStorage.pixel_hash).where(column.in_(chunk)))
+        stored.update(result.all())
+    return stored
+
+
+async def preflight_files(query: FilePreflightQuery, db: AsyncSession) -> FilePreflight:
+    """
+    Tell which files of a client are already stored, by file hash or else by image unique ID,
+    using index lookups only, so that only the missing ones are uploaded.
+    """
+    file_hashes = {item.file_hash.lower() for item in query.files}
+    image_unique_ids = {item.image_unique_id for item in query.files if item.image_unique_id}
+    stored_file_hashes = await _find_stored(FileStorage.file_hash, file_hashes, db)
+    stored_image_unique_ids = await _find_stored(FileStorage.image_unique_id, image_unique_ids, db)
+
+    items = []
+    for item in query.files:
+        result = FilePreflightResult(
+            file_hash=item.file_hash.lower(), image_unique_id=item.image_unique_id, exists=False
+        )
+        if result.file_hash in stored_file_hashes:
+            result.exists, result.matched_by = True, "file_hash"
+            result.pixel_hash = stored_file_hashes[result.file_hash]
+        elif item.image_unique_id in stored_image_unique_ids:
+            result.exists, result.matched_by = True, "image_unique_id"
+            result.pixel_hash = stored_image_unique_ids[item.image_unique_id]
+        items.append(result)
+    missing = list(dict.fromkeys(item.file_hash for item in items if not item.exists))
+    return FilePreflight(items=items, missing=missing)
+
+
+SEARCH_COLUMNS = (
+    FileStorage.id,
+    FileStorage.pixel_hash,
+    FileStorage.name,
+    FileStorage.mime,
+    FileStorage.datetime_shooting,
+    FileStorage.camera_make,
+    FileStorage.camera_model,
+    FileStorage.lens_model,
+    FileStorage.iso,
+    FileStorage.focal_length,
+    FileStorage.latitude,
+    FileStorage.longitude,
+)
+
+
+def encode_cursor(sort: str, row) -> str:
+    value = getattr(row, sort) if sort != "id" else None
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort, value, row.id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> tuple[datetime | str | None, int]:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        cursor_sort, value, last_id = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        if cursor_sort != sort or not isinstance(last_id, int):
+            raise ValueError(cursor)
+        if sort == "datetime_shooting":
+            value = datetime.fromisoformat(value)
+        return value, last_id
+    except (ValueError, TypeError, binascii.Error):
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            code="INVALID_CURSOR",
+            message=f"Cursor {cursor} is invalid for sort {sort}.",
+        ) from None
+
+
+def _filter_search_statement(stmt, query: FileSearchQuery):
+    equalities = {
+        FileStorage.camera_make: query.camera_make,
+        FileStorage.camera_model: query.camera_model,
+        FileStorage.lens_model: query.lens_model,
+        FileStorage.mime: query.mime,
+    }
+    for column, value in equalities.items():
+        if value is not None:
+            stmt = stmt.where(column == value)
+
+    lower_bounds = {
+        FileStorage.datetime_shooting: query.date_from,
+        FileStorage.iso: query.iso_min,
+        FileStorage.focal_length: query.focal_length_min,
+    }
+    for column, value in lower_bounds.items():
+        if value is not None:
+            stmt = stmt.where(column >= value)
+
+    if query.date_to is not None:
+        stmt = stmt.where(FileStorage.datetime_shooting < query.date_to)
+    if query.iso_max is not None:
+        stmt = stmt.where(FileStorage.iso <= query.iso_max)
+    if query.focal_length_max is not None:
+        stmt = stmt.where(FileStorage.focal_length <= query.focal_length_max)
+    return stmt
+
+
+async def search_files(query: FileSearchQuery, db: AsyncSession) -> FileSearchPage:
+    """
+    Filters stored files on indexed EXIF columns with keyset pagination.
+    Only a narrow projection is read so the composite indexes can serve most of the query.
+    """
+    stmt = _filter_search_statement(select(*SEARCH_COLUMNS), query)
+
+    if query.sort == "datetime_shooting":
+        # Files without shooting date cannot be placed on this keyset, they are left out
+        stmt = stmt.where(FileStorage.datetime_shooting.is_not(None))
+        if query.cursor:
+            last_date, last_id = decode_cursor(query.cursor, query.sort)
+            stmt = stmt.where(
+                or_(
+                    FileStorage.datetime_shooting > last_date,
+                    and_(FileStorage.datetime_shooting == last_date, FileStorage.id > last_id),
+                )
+            )
+        stmt = stmt.order_by(FileStorage.datetime_shooting, FileStorage.id)
+    else:
+        if query.cursor:
+            _, last_id = decode_cursor(query.cursor, query.sort)
+            stmt = stmt.where(FileStorage.id > last_id)
+        stmt = stmt.order_by(FileStorage.id)
+
+    # Fetch one extra row to know whether another page exists
+    result = await db.execute(stmt.limit(query.limit + 1))
+    rows = result.all()
+    next_cursor = None
+    if len(rows) > query.limit:
+        rows = rows[: query.limit]
+        next_cursor = encode_cursor(query.sort, rows[-1])
+
+    return FileSearchPage(items=await get_file_summaries(rows, db), next_cursor=next_cursor)
+
+
+async def get_file_summaries(rows: list, db: AsyncSession) -> list[FileSummary]:
+    await sync_hash_index(db)
+    summaries = [FileSummary.model_validate(row, from_attributes=True) for row in rows]
+    for summary in summaries:
+        summary.short_hash = get_short_hash(summary.pixel_hash)
+    return summaries
+
+
+def _geohash_ranges_condition(column, ranges: list[tuple[str, str | None]]):
+    conditions = []
+    for start, end in ranges:
+        condition = column >= start
+        if end is not None:
+            condition = and_(condition, column < end)
+        conditions.append(condition)
+    return or_(*conditions)
+
+
+async def search_files_within(
+    bbox: tuple[float, float, float, float], limit: int, cursor: str | None, db: AsyncSession
+) -> FileSearchPage:
+    """
+    Lists geotagged files inside a bounding box.
+    The bbox is covered by a few geohash ranges (index range scans on ix_files_geohash_id),
+    then refined with the exact coordinates. Pages follow the (geohash, id) keyset.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    stmt = (
+        select(*SEARCH_COLUMNS, FileStorage.geohash)
+        .where(_geohash_ranges_condition(FileStorage.geohash, covering_ranges(bbox)))
+        .where(FileStorage.latitude.between(min_lat, max_lat))
+        .where(FileStorage.longitude.between(min_lon, max_lon))
+    )
+    if cursor:
+        last_geohash, last_id = decode_cursor(cursor, "geohash")
+        stmt = stmt.where(
+            or_(
+                FileStorage.geohash > last_geohash,
+                and_(FileStorage.geohash == last_geohash, FileStorage.id > last_id),
+            )
+        )
+    stmt = stmt.order_by(FileStorage.geohash, FileStorage.id)
+
+    result = await db.execute(stmt.limit(limit + 1))
+    rows = result.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor("geohash", rows[-1])
+
+    return FileSearchPage(items=await get_file_summaries(rows, db), next_cursor=next_cursor)
+
+
+async def get_clusters(
+    bbox: tuple[float, float, float, float], zoom: int, db: AsyncSession
+) -> FileClusters:
+    """
+    Returns the precomputed cluster aggregates of the cells covering a bounding box.
+    The cell precision follows the map zoom, coarsened if the bbox would need too many cells.
+    """
+    precision = min(
+        zoom_to_precision(zoom, MAX_CLUSTER_PRECISION),
+        covering_precision(bbox, MAX_CLUSTER_CELLS, MAX_CLUSTER_PRECISION),
+    )
+    ranges = covering_ranges(bbox, max_precision=precision)
+    stmt = (
+        select(
+            Cluster.geohash,
+            Cluster.count,
+            Cluster.latitude_sum,
+            Cluster.longitude_sum,
+            Cluster.pixel_hash,
+        )
+        .where(Cluster.precision == precision)
+        .where(_geohash_ranges_condition(Cluster.geohash, ranges))
+        .order_by(Cluster.geohash)
+    )
+    result = await db.execute(stmt)
+
+    return FileClusters(
+        precision=precision,
+        items=[
+            FileCluster(
+                geohash=row.geohash,
+                count=row.count,
+                latitude=row.latitude_sum / row.count,
+                longitude=row.longitude_sum / row.count,
+                pixel_hash=row.pixel_hash,
+            )
+            for row in result
+        ],
+    )
+
+
+TIMELINE_PERIOD_FORMATS = {"year": "%Y", "month": "%Y-%m", "day": "%Y-%m-%d"}
+
+
+async def get_timeline(granularity: str, db: AsyncSession) -> Timeline:
+    """
+    Builds the shooting date histogram from the per-day rollup.
+    Its cost depends on the number of distinct shooting days, not on the number of files.
+    """
+    period_format = TIMELINE_PERIOD_FORMATS[granularity]
+    result = await db.execute(select(ShootingDay).order_by(ShootingDay.day))
+
+    buckets: list[TimelineBucket] = []
+    for shooting_day in result.scalars():
+        period = shooting_day.day.strftime(period_format)
+        if buckets and buckets[-1].period == period:
+            # Days are ordered, so the first file of the period is already set
+            bucket = buckets[-1]
+            bucket.count += shooting_day.count
+            bucket.last_pixel_hash = shooting_day.last_pixel_hash
+        else:
+            buckets.append(
+                TimelineBucket(
+                    period=period,
+                    count=shooting_day.count,
+                    first_pixel_hash=shooting_day.first_pixel_hash,
+                    last_pixel_hash=shooting_day.last_pixel_hash,
+                )
+            )
+
+    return Timeline(granularity=granularity, buckets=buckets)
+
+
+EXPORT_FIELDS = {
+    "pixel_hash": FileStorage.pixel_hash,
+    "file_hash": FileStorage.file_hash,
+    "perceptual_hash": FileStorage.perceptual_hash,
+    "image_unique_id": FileStorage.image_unique_id,
+    "name": FileStorage.name,
+    "mime": FileStorage.mime,
+    "size": FileStorage.size,
+    "orientation": FileStorage.orientation,
+    "latitude": FileStorage.latitude,
+    "longitude": FileStorage.longitude,
+    "altitude": FileStorage.altitude,
+    "datetime_shooting": FileStorage.datetime_shooting,
+    "datetime_digitized": FileStorage.datetime_digitized,
+    "camera_make": FileStorage.camera_make,
+    "camera_model": FileStorage.camera_model,
+    "lens_model": FileStorage.lens_model,
+    "iso": FileStorage.iso,
+    "focal_length": FileStorage.focal_length,
+    "meta_data": FileStorage.meta_data,
+}
+DEFAULT_EXPORT_FIELDS = [field for field in EXPORT_FIELDS if field != "meta_data"]
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# Rows fetched from the server-side cursor and serialized at once
+EXPORT_BATCH_SIZE = 1000
+
+
+def get_export_fields(fields: str | None, include_meta_data: bool) -> list[str]:
+    selected = [field.strip() for field in fields.split(",")] if fields else DEFAULT_EXPORT_FIELDS
+    unknown = [field for field in selected if field not in EXPORT_FIELDS]
+    if unknown:
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            code="INVALID_EXPORT_FIELD",
+            message=f"Unknown export fields: {', '.join(unknown)}.",
+        )
+    if include_meta_data and "meta_data" not in selected:
+        selected = [*selected, "meta_data"]
+    return selected
+
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _format_ndjson(fields: list[str], rows) -> str:
+    lines = [
+        json.dumps(dict(zip(fields, map(_export_value, row), strict=True)), separators=(",", ":"))
+        for row in rows
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _format_csv(rows) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(
+        [json.dumps(value) if isinstance(value, dict) else _export_value(value) for value in row]
+        for row in rows
+    )
+    return buffer.getvalue()
+
+
+async def stream_export(
+    fields: list[str], export_format: str, db: AsyncSession
+) -> AsyncIterator[str]:
+    """
+    Streams the selected columns of every stored file as NDJSON or CSV.
+    Rows are read by batches from a server-side cursor, so memory does not grow with the catalogue.
+    """
+    if export_format == "csv":
+        yield _format_csv([fields])
+
+    stmt = (
+        select(*(EXPORT_FIELDS[field] for field in fields))
+        .order_by(FileStorage.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    result = await db.stream(stmt)
+    async for rows in result.partitions():
+        yield _format_csv(rows) if export_format == "csv" else _format_ndjson(fields, rows)
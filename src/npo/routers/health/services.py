@@ -6,6 +6,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from npo import config
+from npo.core.storage import get_volumes
 from npo.database import get_session
 
 
@@ -23,4 +24,6 @@ async def check_upload_directory():
 
 
 async def check_storage_directory():
-    return os.path.exists(config.settings.storage_dir)
+    return os.path.exists(config.settings.storage_dir) and all(
+        os.path.exists(volume) for volume in get_volumes()
+    )
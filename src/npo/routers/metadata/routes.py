@@ -5,23 +5,18 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from npo.core.file import get_file_by_pixel_hash
 from npo.database import get_session
+from npo.routers.metadata.schemas import MetadataBatch, MetadataBatchQuery
 from npo.routers.metadata.services import (
-    _format_aperture,
-    _format_color_space,
-    _format_exposure_compensation,
-    _format_exposure_mode,
-    _format_exposure_program,
-    _format_flash,
-    _format_focal_length,
-    _format_metering_mode,
-    _format_orientation,
-    _format_pixels,
-    _format_scene_capture_type,
-    _format_scene_type,
-    _format_shutter_speed,
-    _format_white_balance,
+    format_photography_metadata,
+    get_photography_metadata_batch,
+)
+from npo.routers.utils import (
+    PIXEL_HASH_RESPONSES,
+    APIException,
+    OrjsonResponse,
+    create_route_decorator,
+    pixel_hash_conflict,
 )
-from npo.routers.utils import APIException, create_route_decorator
 
 RAW_METADATA_NOT_FOUND = {
     "description": "Raw metadata not found",
@@ -44,15 +39,36 @@ metadata_router = APIRouter(
 metadata_route = create_route_decorator(metadata_router)
 
 
+@metadata_route(
+    "/batch",
+    method="POST",
+    summary="Photography metadata of several files",
+    response_model=MetadataBatch,
+    responses=PIXEL_HASH_RESPONSES.copy(),
+)
+async def post_photography_metadata_batch(
+    query: MetadataBatchQuery, db: Annotated[AsyncSession, Depends(get_session)]
+):
+    """
+    The files are given by pixel hash or prefix, answered in `items` with the same fields as
+    `/metadata/{pixel_hash}/photography`, or only the requested `fields`. Files not found or
+    without metadata are listed in `missing`.
+    """
+    with pixel_hash_conflict():
+        return await get_photography_metadata_batch(query, db)
+
+
 @metadata_route(
     "/{pixel_hash}",
     summary="Raw metadata by pixel hash",
+    responses=PIXEL_HASH_RESPONSES.copy(),
     override_404=RAW_METADATA_NOT_FOUND,
 )
 async def get_raw_metadata(pixel_hash: str, db: Annotated[AsyncSession, Depends(get_session)]):
-    file_storage = await get_file_by_pixel_hash(pixel_hash, db)
+    with pixel_hash_conflict():
+        file_storage = await get_file_by_pixel_hash(pixel_hash, db)
     if file_storage:
-        return file_storage.meta_data
+        return OrjsonResponse(file_storage.meta_data)
     else:
         raise APIException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -64,44 +80,17 @@ async def get_raw_metadata(pixel_hash: str, db: Annotated[AsyncSession, Depends(
 @metadata_route(
     "/{pixel_hash}/photography",
     summary="Selected photography metadata by pixel hash",
+    responses=PIXEL_HASH_RESPONSES.copy(),
     override_404=PHOTOGRAPHY_METADATA_NOT_FOUND,
 )
 async def get_photography_metadata(
     pixel_hash: str, db: Annotated[AsyncSession, Depends(get_session)]
 ):
-    file_storage = await get_file_by_pixel_hash(pixel_hash, db)
+    with pixel_hash_conflict():
+        file_storage = await get_file_by_pixel_hash(pixel_hash, db)
     meta = file_storage.meta_data if file_storage else None
     if meta:
-        return {
-            "cameraMaker": meta.get("EXIF:Make"),
-            "cameraModel": meta.get("EXIF:Model"),
-            "lensModel": meta.get("EXIF:LensModel"),
-            "focalLength": _format_focal_length(meta.get("EXIF:FocalLength")),
-            "focalLengthIn35mmFormat": _format_focal_length(
-                meta.get("EXIF:FocalLengthIn35mmFormat")
-            ),
-            "aperture": _format_aperture(meta.get("EXIF:FNumber")),
-            "shutterSpeed": _format_shutter_speed(meta.get("EXIF:ExposureTime")),
-            "iso": meta.get("EXIF:ISO") or meta.get("EXIF:ISOSpeedRatings"),
-            "flash": _format_flash(meta.get("EXIF:Flash")),
-            "imageWidth": _format_pixels(
-                meta.get("File:ImageWidth") or meta.get("EXIF:ExifImageWidth")
-            ),
-            "imageHeight": _format_pixels(
-                meta.get("File:ImageHeight") or meta.get("EXIF:ExifImageHeight")
-            ),
-            "orientation": _format_orientation(meta.get("EXIF:Orientation")),
-            "whiteBalance": _format_white_balance(meta.get("EXIF:WhiteBalance")),
-            "exposureProgram": _format_exposure_program(meta.get("EXIF:ExposureProgram")),
-            "exposureMode": _format_exposure_mode(meta.get("EXIF:ExposureMode")),
-            "exposureCompensation": _format_exposure_compensation(
-                meta.get("EXIF:ExposureCompensation")
-            ),
-            "meteringMode": _format_metering_mode(meta.get("EXIF:MeteringMode")),
-            "sceneCaptureType": _format_scene_capture_type(meta.get("EXIF:SceneCaptureType")),
-            "sceneType": _format_scene_type(meta.get("EXIF:SceneType")),
-            "colorSpace": _format_color_space(meta.get("EXIF:ColorSpace")),
-        }
+        return OrjsonResponse(format_photography_metadata(meta))
     else:
         raise APIException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -0,0 +1,17 @@
+from typing import Any
+
+from pydantic import BaseModel, Field
+
+
+class MetadataBatchQuery(BaseModel):
+    """Files, by pixel hash or prefix, and photography fields to read, all fields by default."""
+
+    pixel_hashes: list[str] = Field(..., min_length=1, max_length=1000)
+    fields: list[str] | None = Field(None, examples=[["cameraModel", "aperture", "iso"]])
+
+
+class MetadataBatch(BaseModel):
+    """Photography metadata by pixel hash, as requested."""
+
+    items: dict[str, dict[str, Any]]
+    missing: list[str] = Field(..., description="Pixel hashes of no file with metadata.")
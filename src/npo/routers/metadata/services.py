@@ -1,3 +1,16 @@
+from collections.abc import Callable, Iterable
+from typing import Any
+
+from fastapi import status
+from sqlalchemy import String, cast, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from npo.core.file import resolve_pixel_hashes
+from npo.models.file import File as FileStorage
+from npo.routers.metadata.schemas import MetadataBatch, MetadataBatchQuery
+from npo.routers.utils import APIException
+
+
 def _format_focal_length(value: float | str | None) -> str | None:
     if value is None:
         return None
@@ -210,3 +223,85 @@ def _format_color_space(value: int | str | None) -> str | None:
         return spaces.get(val, str(val))
     except (ValueError, TypeError):
         return str(value)
+
+
+# Photography fields: metadata keys read, the first one set wins, and formatter
+PHOTOGRAPHY_FIELDS: dict[str, tuple[tuple[str, ...], Callable[[Any], Any] | None]] = {
+    "cameraMaker": (("EXIF:Make",), None),
+    "cameraModel": (("EXIF:Model",), None),
+    "lensModel": (("EXIF:LensModel",), None),
+    "focalLength": (("EXIF:FocalLength",), _format_focal_length),
+    "focalLengthIn35mmFormat": (("EXIF:FocalLengthIn35mmFormat",), _format_focal_length),
+    "aperture": (("EXIF:FNumber",), _format_aperture),
+    "shutterSpeed": (("EXIF:ExposureTime",), _format_shutter_speed),
+    "iso": (("EXIF:ISO", "EXIF:ISOSpeedRatings"), None),
+    "flash": (("EXIF:Flash",), _format_flash),
+    "imageWidth": (("File:ImageWidth", "EXIF:ExifImageWidth"), _format_pixels),
+    "imageHeight": (("File:ImageHeight", "EXIF:ExifImageHeight"), _format_pixels),
+    "orientation": (("EXIF:Orientation",), _format_orientation),
+    "whiteBalance": (("EXIF:WhiteBalance",), _format_white_balance),
+    "exposureProgram": (("EXIF:ExposureProgram",), _format_exposure_program),
+    "exposureMode": (("EXIF:ExposureMode",), _format_exposure_mode),
+    "exposureCompensation": (("EXIF:ExposureCompensation",), _format_exposure_compensation),
+    "meteringMode": (("EXIF:MeteringMode",), _format_metering_mode),
+    "sceneCaptureType": (("EXIF:SceneCaptureType",), _format_scene_capture_type),
+    "sceneType": (("EXIF:SceneType",), _format_scene_type),
+    "colorSpace": (("EXIF:ColorSpace",), _format_color_space),
+}
+
+
+def format_photography_metadata(
+    meta: dict, fields: Iterable[str] = PHOTOGRAPHY_FIELDS
+) -> dict[str, Any]:
+    """Selected photography fields of the metadata of a file, formatted for display."""
+    photography = {}
+    for field in fields:
+        keys, formatter = PHOTOGRAPHY_FIELDS[field]
+        value = None
+        for key in keys:
+            value = meta.get(key)
+            if value:
+                break
+        photography[field] = formatter(value) if formatter else value
+    return photography
+
+
+async def get_photography_metadata_batch(
+    query: MetadataBatchQuery, db: AsyncSession
+) -> MetadataBatch:
+    """
+    Photography metadata of several files in one query. Only the metadata keys of the requested
+    fields are read, extracted from the JSON column by the database, rather than the whole
+    metadata of each file (often tens of kilobytes).
+    """
+    fields = query.fields or list(PHOTOGRAPHY_FIELDS)
+    unknown = [field for field in fields if field not in PHOTOGRAPHY_FIELDS]
+    if unknown:
+        raise APIException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            code="INVALID_PHOTOGRAPHY_FIELD",
+            message=f"Unknown photography fields: {', '.join(unknown)}.",
+        )
+    keys = list(dict.fromkeys(key for field in fields for key in PHOTOGRAPHY_FIELDS[field][0]))
+    # Short hashes are resolved by the hash index, the ones it misses by a single query
+    requested = {}
+    resolved = await resolve_pixel_hashes(query.pixel_hashes, db)
+    for pixel_hash, full_pixel_hash in resolved.items():
+        requested.setdefault(full_pixel_hash, []).append(pixel_hash)
+
+    # Stored metadata may be a SQL NULL or a JSON null, both telling a file without metadata
+    has_meta_data = cast(FileStorage.meta_data, String).not_in(("null", "{}"))
+    stmt = select(
+        FileStorage.pixel_hash, has_meta_data, *(FileStorage.meta_data[key] for key in keys)
+    ).where(FileStorage.pixel_hash.in_(requested))
+    items = {}
+    for pixel_hash, has_meta_data, *values in (await db.execute(stmt)).all():
+        if not has_meta_data:
+            continue
+        photography = format_photography_metadata(dict(zip(keys, values, strict=True)), fields)
+        for requested_hash in requested[pixel_hash]:
+            items[requested_hash] = photography
+    return MetadataBatch(
+        items=items,
+        missing=[pixel_hash for pixel_hash in query.pixel_hashes if pixel_hash not in items],
+    )
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, status
+from fastapi.responses import PlainTextResponse
+
+from npo.core.metrics import REGISTRY
+
+# Content type of the Prometheus text exposition format
+EXPOSITION_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+metrics_router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@metrics_router.get(
+    "",
+    summary="Application metrics in Prometheus text format",
+    status_code=status.HTTP_200_OK,
+    response_class=PlainTextResponse,
+)
+async def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=EXPOSITION_MEDIA_TYPE)
@@ -0,0 +1,140 @@
+from typing import Annotated, Literal
+
+from fastapi import APIRouter, Depends, Header, Path, Query, Request, status
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from npo.core.metrics import UPLOADS_IN_PROGRESS
+from npo.database import get_session
+from npo.routers.files.schemas import File, FileUploadResult
+from npo.routers.files.services import get_upload_result
+from npo.routers.uploads.schemas import Upload, UploadCreate
+from npo.routers.uploads.services import (
+    create_upload,
+    delete_upload,
+    finalize_upload,
+    get_upload,
+    write_chunk,
+)
+from npo.routers.utils import create_route_decorator
+
+UPLOAD_NOT_FOUND = {
+    "description": "Upload not found",
+    "code": "UPLOAD_NOT_FOUND",
+    "message": "Upload {upload_id} not found.",
+}
+
+UploadId = Annotated[str, Path(pattern="^[0-9a-f]{32}$")]
+
+uploads_router = APIRouter(
+    prefix="/uploads",
+    tags=["uploads"],
+)
+uploads_route = create_route_decorator(uploads_router)
+
+
+def _offset_headers(upload: Upload) -> dict[str, str]:
+    return {
+        "Upload-Offset": str(upload.offset),
+        "Upload-Length": str(upload.size),
+        "Cache-Control": "no-store",
+    }
+
+
+@uploads_route(
+    "",
+    method="POST",
+    summary="Create a resumable upload",
+    status_code=status.HTTP_201_CREATED,
+    response_model=Upload,
+)
+async def post_upload(upload_create: UploadCreate, response: Response):
+    """
+    Declare a file to upload by chunks: send them with `PATCH /uploads/{id}`, from the offset
+    given by `HEAD /uploads/{id}` after an interruption, then finalize the upload.
+    """
+    upload = await create_upload(upload_create)
+    response.headers["Location"] = f"{uploads_router.prefix}/{upload.id}"
+    return upload
+
+
+@uploads_router.head("/{upload_id}", summary="Get the offset of a resumable upload")
+async def head_upload(upload_id: UploadId):
+    upload = await get_upload(upload_id)
+    return Response(headers=_offset_headers(upload))
+
+
+@uploads_route(
+    "/{upload_id}",
+    summary="Get the state of a resumable upload",
+    response_model=Upload,
+    override_404=UPLOAD_NOT_FOUND,
+)
+async def get_upload_state(upload_id: UploadId):
+    return await get_upload(upload_id)
+
+
+@uploads_route(
+    "/{upload_id}",
+    method="PATCH",
+    summary="Send a chunk of a resumable upload",
+    status_code=status.HTTP_204_NO_CONTENT,
+    response_class=Response,
+    override_404=UPLOAD_NOT_FOUND,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/offset+octet-stream": {
+                    "schema": {"type": "string", "format": "binary"}
+                }
+            },
+        }
+    },
+)
+async def patch_upload(
+    upload_id: UploadId,
+    request: Request,
+    upload_offset: Annotated[int, Header(ge=0)],
+    content_length: Annotated[int | None, Header(ge=0)] = None,
+):
+    """
+    Write the request body at `Upload-Offset`, which must be the current offset of the upload.
+    The body is streamed to the uploads directory, the new offset is in the response headers.
+    """
+    upload = await write_chunk(upload_id, upload_offset, content_length, request.stream())
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=_offset_headers(upload))
+
+
+@uploads_route(
+    "/{upload_id}/finalize",
+    method="POST",
+    summary="Ingest a complete resumable upload",
+    status_code=status.HTTP_201_CREATED,
+    response_model=dict[str, FileUploadResult | File],
+    override_404=UPLOAD_NOT_FOUND,
+)
+async def post_upload_finalize(
+    upload_id: UploadId,
+    db: Annotated[AsyncSession, Depends(get_session)],
+    include: Annotated[
+        list[Literal["meta_data"]] | None,
+        Query(description="meta_data adds the metadata of the file, raw and extracted."),
+    ] = None,
+):
+    """Run the files ingestion pipeline on the uploaded file, like `/files/upload` does."""
+    with UPLOADS_IN_PROGRESS.track_inprogress():
+        file = await finalize_upload(upload_id, db)
+    return {file.name: get_upload_result(file, include)}
+
+
+@uploads_route(
+    "/{upload_id}",
+    method="DELETE",
+    summary="Cancel a resumable upload",
+    status_code=status.HTTP_204_NO_CONTENT,
+    response_class=Response,
+    override_404=UPLOAD_NOT_FOUND,
+)
+async def delete_upload_data(upload_id: UploadId):
+    await delete_upload(upload_id)
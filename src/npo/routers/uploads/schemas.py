@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from pydantic import BaseModel, Field
+
+
+class UploadCreate(BaseModel):
+    """Declaration of a file to upload in several requests."""
+
+    name: str = Field(..., min_length=1, max_length=255)
+    size: int = Field(..., gt=0, description="Total size of the file in bytes.")
+    mime: str | None = None
+
+
+class Upload(BaseModel):
+    """State of a resumable upload, saved next to its data in the uploads directory."""
+
+    id: str
+    name: str
+    size: int
+    mime: str | None = None
+    offset: int = Field(0, description="Number of bytes received, where the next chunk starts.")
+    created_at: datetime
@@ -0,0 +1,240 @@
+import asyncio
+import contextlib
+import fcntl
+import hashlib
+import mimetypes
+import os
+import secrets
+import time
+from collections.abc import AsyncIterator
+from datetime import UTC, datetime
+
+from fastapi import status
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import ClientDisconnect
+
+from npo import config
+from npo.core.metrics import timed_stage
+from npo.routers.files.schemas import File
+from npo.routers.files.services import ingest_file
+from npo.routers.uploads.schemas import Upload, UploadCreate
+from npo.routers.utils import APIException
+
+# Each upload is a data file and a JSON state file in the uploads directory, so that an upload
+# can be resumed by any worker and after a restart, and a lock file held by the request using it
+STATE_SUFFIX = ".upload.json"
+DATA_SUFFIX = ".part"
+LOCK_SUFFIX = ".lock"
+
+# MD5 of the data received so far by this worker, with the offset it covers: chunks are hashed
+# as they arrive instead of reading the whole file again when the upload is finalized
+_hashers: dict[str, tuple[int, "hashlib._Hash"]] = {}
+_locks: dict[str, asyncio.Lock] = {}
+
+
+def _state_path(upload_id: str) -> str:
+    return os.path.join(config.settings.uploads_dir, upload_id + STATE_SUFFIX)
+
+
+def _data_path(upload_id: str) -> str:
+    return os.path.join(config.settings.uploads_dir, upload_id + DATA_SUFFIX)
+
+
+def _lock_path(upload_id: str) -> str:
+    return os.path.join(config.settings.uploads_dir, upload_id + LOCK_SUFFIX)
+
+
+def _save_state(upload: Upload) -> None:
+    # Replaced atomically, an interruption leaves the previous state
+    temporary_path = f"{_state_path(upload.id)}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as state_file:
+        state_file.write(upload.model_dump_json())
+    os.replace(temporary_path, _state_path(upload.id))
+
+
+def _remove_upload(upload_id: str) -> None:
+    for path in (_state_path(upload_id), _data_path(upload_id), _lock_path(upload_id)):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+    _hashers.pop(upload_id, None)
+    _locks.pop(upload_id, None)
+
+
+def purge_expired_uploads() -> None:
+    """Remove the uploads without activity for the expiry delay."""
+    expiry = time.time() - config.settings.upload_expiry
+    with os.scandir(config.settings.uploads_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(STATE_SUFFIX) and entry.stat().st_mtime < expiry:
+                _remove_upload(entry.name.removesuffix(STATE_SUFFIX))
+
+
+async def create_upload(upload_create: UploadCreate) -> Upload:
+    purge_expired_uploads()
+    upload = Upload(
+        id=secrets.token_hex(16),
+        name=os.path.basename(upload_create.name),
+        size=upload_create.size,
+        mime=upload_create.mime or mimetypes.guess_type(upload_create.name)[0],
+        created_at=datetime.now(UTC),
+    )
+    open(_data_path(upload.id), "wb").close()
+    _save_state(upload)
+    return upload
+
+
+async def get_upload(upload_id: str) -> Upload:
+    try:
+        with open(_state_path(upload_id), encoding="utf-8") as state_file:
+            return Upload.model_validate_json(state_file.read())
+    except FileNotFoundError:
+        raise APIException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            code="UPLOAD_NOT_FOUND",
+            message=f"Upload {upload_id} not found.",
+        ) from None
+
+
+def _get_hasher(upload: Upload) -> "hashlib._Hash":
+    cached = _hashers.get(upload.id)
+    if cached and cached[0] == upload.offset:
+        return cached[1]
+    # Chunks received by another worker or before a restart: hash the data received so far
+    hasher = hashlib.md5(usedforsecurity=False)
+    with open(_data_path(upload.id), "rb") as data_file:
+        remaining = upload.offset
+        while remaining:
+            chunk = data_file.read(min(remaining, 1 << 20))
+            hasher.update(chunk)
+            remaining -= len(chunk)
+    return hasher
+
+
+def check_chunk(upload: Upload, offset: int, length: int | None) -> None:
+    if offset != upload.offset:
+        raise APIException(
+            status_code=status.HTTP_409_CONFLICT,
+            code="UPLOAD_OFFSET_MISMATCH",
+            message=f"Upload {upload.id} expects data at offset {upload.offset}, not {offset}.",
+        )
+    if length is not None and offset + length > upload.size:
+        raise APIException(
+            status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+            code="UPLOAD_TOO_LARGE",
+            message=f"Upload {upload.id} is declared with {upload.size} bytes.",
+        )
+
+
+def _upload_in_progress(upload_id: str) -> APIException:
+    return APIException(
+        status_code=status.HTTP_409_CONFLICT,
+        code="UPLOAD_IN_PROGRESS",
+        message=f"Upload {upload_id} is used by another request.",
+    )
+
+
+@contextlib.asynccontextmanager
+async def _locked(upload_id: str):
+    """
+    Reserve an upload for a request, which fails if another one is using it, in this worker or
+    another process, and yield its current state.
+    """
+    # Checked first, for a missing upload not to leave a lock behind
+    await get_upload(upload_id)
+    # POSIX locks are held per process: the requests of this worker are told apart by a lock of
+    # their own. The lock file is opened by nothing else, as closing any descriptor of a locked
+    # file (the data file is read by the hashing and the ingestion) releases the lock.
+    lock = _locks.setdefault(upload_id, asyncio.Lock())
+    if lock.locked():
+        raise _upload_in_progress(upload_id)
+    async with lock:
+        with open(_lock_path(upload_id), "a") as lock_file:
+            try:
+                fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (BlockingIOError, PermissionError):
+                raise _upload_in_progress(upload_id) from None
+            try:
+                # Read again, as updated (or finalized and removed) by the previous request
+                upload = await get_upload(upload_id)
+            except APIException:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(_lock_path(upload_id))
+                raise
+            yield upload
+
+
+@timed_stage("write_chunk")
+async def write_chunk(
+    upload_id: str, offset: int, length: int | None, chunks: AsyncIterator[bytes]
+) -> Upload:
+    """
+    Append the received chunks to the upload data at the given offset, which must be the
+    current one. Data received before a disconnection is kept, for the upload to resume there.
+    """
+    async with _locked(upload_id) as upload:
+        check_chunk(upload, offset, length)
+        hasher = _get_hasher(upload)
+        with open(_data_path(upload.id), "r+b") as data_file:
+            # Drop data written after the saved offset by an interrupted request
+            data_file.truncate(upload.offset)
+            data_file.seek(upload.offset)
+            try:
+                async for chunk in chunks:
+                    check_chunk(upload, upload.offset, len(chunk))
+                    data_file.write(chunk)
+                    hasher.update(chunk)
+                    upload.offset += len(chunk)
+            except ClientDisconnect:
+                pass
+            finally:
+                # The saved offset never covers data which is not on disk
+                data_file.flush()
+                os.fsync(data_file.fileno())
+                _hashers[upload.id] = (upload.offset, hasher)
+                _save_state(upload)
+    return upload
+
+
+async def finalize_upload(upload_id: str, db: AsyncSession) -> File:
+    """Hand a complete upload to the ingestion pipeline."""
+    async with _locked(upload_id) as upload:
+        if upload.offset != upload.size:
+            raise APIException(
+                status_code=status.HTTP_409_CONFLICT,
+                code="UPLOAD_INCOMPLETE",
+                message=f"Upload {upload.id} has received {upload.offset} of {upload.size} bytes.",
+            )
+        file = File(
+            name=upload.name,
+            # Named with the extension of the file for the tools guessing the format from it
+            path=os.path.join(
+                config.settings.uploads_dir, upload.id + os.path.splitext(upload.name)[1]
+            ),
+            size=upload.size,
+            mime=upload.mime,
+            file_hash=_get_hasher(upload).hexdigest(),
+        )
+        os.replace(_data_path(upload.id), file.path)
+        try:
+            await ingest_file(file, db)
+        except APIException:
+            # Rejected files (duplicates, unsupported metadata), removed by the pipeline, cannot
+            # be finalized again
+            _remove_upload(upload.id)
+            raise
+        except Exception:
+            # Unexpected errors leave the upload to be finalized again, unless the file was
+            # already moved to the storage (file.path is then there), where it stays
+            not_moved = os.path.dirname(file.path) == os.path.dirname(_data_path(upload.id))
+            if not_moved and os.path.exists(file.path):
+                os.replace(file.path, _data_path(upload.id))
+            else:
+                _remove_upload(upload.id)
+            raise
+    _remove_upload(upload.id)
+    return file
+
+
+async def delete_upload(upload_id: str) -> None:
+    async with _locked(upload_id):
+        _remove_upload(upload_id)
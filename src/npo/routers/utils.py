@@ -1,5 +1,12 @@
+from contextlib import contextmanager
+from typing import Any
+
+import orjson
 from fastapi import APIRouter, HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 
+from npo.core.hash_index import AmbiguousHashError
 from npo.models.errors import ErrorDetail
 
 COMMON_RESPONSES = {
@@ -17,9 +24,36 @@ COMMON_RESPONSES = {
     },
 }
 
+AMBIGUOUS_PIXEL_HASH = {
+    "description": "Pixel hash prefix matching several files",
+    "code": "AMBIGUOUS_PIXEL_HASH",
+    "message": "Pixel hash {pixel_hash} matches several files, a longer prefix is needed.",
+}
+
+PIXEL_HASH_RESPONSES = {
+    status.HTTP_409_CONFLICT: {
+        "model": ErrorDetail,
+        "description": AMBIGUOUS_PIXEL_HASH["description"],
+    },
+}
+
 VALID_HTTP_METHODS = {"GET", "POST", "PUT", "DELETE", "PATCH"}
 
 
+class OrjsonResponse(JSONResponse):
+    """
+    JSON response encoded by orjson, which also encodes datetimes. Large contents (metadata) are
+    best returned in this response directly, skipping the slow jsonable_encoder walk of FastAPI.
+    """
+
+    def render(self, content: Any) -> bytes:
+        try:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            # Integers beyond 64 bits, which exiftool output can hold: standard encoder
+            return super().render(jsonable_encoder(content))
+
+
 class APIException(HTTPException):
     def __init__(self, status_code: int, code: str, message: str):
         super().__init__(
@@ -28,6 +62,19 @@ class APIException(HTTPException):
         )
 
 
+@contextmanager
+def pixel_hash_conflict():
+    """Answer a pixel hash prefix matching several files with a 409 Conflict."""
+    try:
+        yield
+    except AmbiguousHashError as error:
+        raise APIException(
+            status_code=status.HTTP_409_CONFLICT,
+            code=AMBIGUOUS_PIXEL_HASH["code"],
+            message=AMBIGUOUS_PIXEL_HASH["message"].format(pixel_hash=error.prefix),
+        ) from None
+
+
 def create_route_decorator(router: APIRouter):
     def route_decorator(
         path: str, method: str = "GET", responses: dict = None, override_404: dict = None, **kwargs
@@ -0,0 +1,160 @@
+"""Ingestion of the files dropped in a watched directory.
+
+File system events (inotify on Linux, through watchfiles) mark the files of the directory as
+pending, without polling it. A file is queued once settled, its size and modification time
+unchanged for the settle time, so that files still being written or synced are left alone. The
+queue is bounded: during bursts the files wait as pending entries instead of piling up in the
+worker pool, whose workers pull them from the queue at their own pace.
+
+Imported files and duplicates are removed from the directory once committed, files in error are
+left in place and retried only when they change.
+"""
+
+import asyncio
+import mimetypes
+import os
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from npo.importer import Importer, find_images
+
+
+def is_candidate(path: Path) -> bool:
+    """Tell if a path may be an image to ingest, skipping hidden and partial files."""
+    if path.name.startswith("."):
+        return False
+    mime = mimetypes.guess_type(path.name)[0]
+    return bool(mime and mime.startswith("image/"))
+
+
+@dataclass
+class PendingFile:
+    size: int
+    mtime_ns: int
+    since: float
+
+
+class Watcher:
+    def __init__(  # noqa: PLR0913
+        self,
+        importer: Importer,
+        directory: Path,
+        *,
+        settle_time: float = 2.0,
+        queue_size: int = 1000,
+        flush_interval: float = 1.0,
+        rescan_interval: float = 300.0,
+    ):
+        self.importer = importer
+        self.directory = directory.resolve()
+        self.settle_time = settle_time
+        self.flush_interval = flush_interval
+        self.rescan_interval = rescan_interval
+        self.pending: dict[Path, PendingFile] = {}
+        # Files from the queue to their result (commit for the imported ones), not to be queued
+        # again meanwhile
+        self.active: set[Path] = set()
+        # Files in error, with the (size, mtime_ns) they failed with
+        self.failed: dict[Path, tuple[int, int]] = {}
+        self.queue: asyncio.Queue[Path] = asyncio.Queue(queue_size)
+        importer.on_result = self._on_result
+
+    def _on_result(self, path: Path, status: str) -> None:
+        self.active.discard(path)
+        if status == "error":
+            stat = self._stat(path)
+            if stat:
+                self.failed[path] = stat
+
+    @staticmethod
+    def _stat(path: Path) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def touch(self, path: Path) -> None:
+        """Mark a file as changed, restarting its settle time."""
+        if path in self.active or not is_candidate(path):
+            return
+        stat = self._stat(path)
+        if stat is None:
+            self.pending.pop(path, None)
+        elif self.failed.get(path) != stat:
+            self.failed.pop(path, None)
+            self.pending[path] = PendingFile(*stat, time.monotonic())
+
+    def scan(self, directory: Path | None = None) -> None:
+        """Mark the files of a directory tree, for those created while not watching it."""
+        for path in find_images(directory or self.directory):
+            if path not in self.pending:
+                self.touch(path)
+
+    async def watch(self) -> None:
+        from watchfiles import Change, awatch  # noqa: PLC0415
+
+        # Events are debounced by watchfiles and delivered by batches, a burst of files costing
+        # a few iterations
+        async for changes in awatch(self.directory, recursive=True, debounce=200, step=50):
+            for change, path in changes:
+                if change == Change.deleted:
+                    self.pending.pop(Path(path), None)
+                elif os.path.isdir(path):
+                    # Files copied in a new directory before it is watched have no event
+                    self.scan(Path(path))
+                else:
+                    self.touch(Path(path))
+
+    async def settle(self) -> None:
+        """Queue the settled files, waiting for room in the queue during bursts."""
+        while True:
+            await asyncio.sleep(min(self.settle_time / 4, 0.5))
+            now = time.monotonic()
+            for path, pending in list(self.pending.items()):
+                # Entries may have been removed while waiting for room in the queue
+                if path not in self.pending or now - pending.since < self.settle_time:
+                    continue
+                stat = self._stat(path)
+                if stat is None:
+                    del self.pending[path]
+                elif stat != (pending.size, pending.mtime_ns):
+                    self.pending[path] = PendingFile(*stat, now)
+                else:
+                    del self.pending[path]
+                    self.active.add(path)
+                    await self.queue.put(path)
+
+    async def consume(self) -> None:
+        while True:
+            path = await self.queue.get()
+            try:
+                await self.importer.import_file(path)
+            finally:
+                self.queue.task_done()
+
+    async def maintain(self) -> None:
+        """Commit the partial batches and rescan the directory for missed events."""
+        last_scan = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.importer.flush()
+            if self.rescan_interval and time.monotonic() - last_scan >= self.rescan_interval:
+                self.scan()
+                last_scan = time.monotonic()
+
+    async def run(self) -> None:
+        """Ingest the files of the directory until cancelled."""
+        async with self.importer.running(self.directory):
+            print(f"Watching {self.directory}", file=sys.stderr, flush=True)
+            async with asyncio.TaskGroup() as tasks:
+                tasks.create_task(self.watch())
+                # Initial scan once watching, for the files dropped while stopped
+                self.scan()
+                tasks.create_task(self.settle())
+                tasks.create_task(self.maintain())
+                # Enough files in flight to keep the workers busy while the main process writes
+                for _ in range(self.importer.workers * 2):
+                    tasks.create_task(self.consume())
@@ -9,8 +9,11 @@ from httpx import ASGITransport, AsyncClient
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
 from npo import config
+from npo.core.hash_index import hash_index
 from npo.database import Base, get_session
 from npo.main import app
+from npo.routers.files.schemas import File
+from npo.routers.files.services import store_file_infos
 
 # URL for an in-memory SQLite database by default, specific to tests
 TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "sqlite+aiosqlite:///:memory:")
@@ -55,6 +58,9 @@ async def override_db_session():
             # Create tables directly from models (fast, suitable for most unit tests)
             await conn.run_sync(Base.metadata.create_all)
 
+    # The hash index of the previous test refers to its database
+    hash_index.clear()
+
     # Session factory for tests
     TestingSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -167,3 +173,30 @@ def verify_404(client):
         assert error_detail["message"] == expected_message
 
     return _verify
+
+
+@pytest.fixture()
+def store_files(override_db_session):
+    """
+    Fixture (Factory function) that stores files infos in the database without any image.
+    Useful for listing endpoints which do not need real images on disk.
+    """
+
+    async def _store(*files_data: dict) -> list[File]:
+        files = []
+        for index, data in enumerate(files_data):
+            pixel_hash = data.get("pixel_hash", f"{index:032x}")
+            values = {
+                "name": f"image_{index}.jpg",
+                "path": f"/storage/{pixel_hash}.jpg",
+                "file_hash": pixel_hash,
+                "pixel_hash": pixel_hash,
+                "mime": "image/jpeg",
+                **data,
+            }
+            file = File(**values)
+            await store_file_infos(file, override_db_session)
+            files.append(file)
+        return files
+
+    return _store
@@ -0,0 +1,53 @@
+import pstats
+
+from fastapi import status
+
+from npo import config
+
+ADMIN_TOKEN = "test-admin-token"
+
+
+async def test_admin_forbidden(client):
+    """Test admin routes are refused without a valid token."""
+
+    response = await client.get("/admin/memory", headers={"X-Admin-Token": "wrong"})
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    assert response.json()["detail"]["code"] == "ADMIN_FORBIDDEN"
+
+
+async def test_admin_profiles(client, override_settings, monkeypatch):
+    """Test CPU profiles, memory snapshots and statistics are returned by admin routes."""
+
+    monkeypatch.setattr(config.settings, "admin_token", ADMIN_TOKEN)
+    headers = {"X-Admin-Token": ADMIN_TOKEN}
+
+    response = await client.get("/admin/profile/cpu", params={"seconds": 0.1}, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-disposition"] == 'attachment; filename="cpu.pstats"'
+    pstats_path = override_settings / "cpu.pstats"
+    pstats_path.write_bytes(response.content)
+    pstats.Stats(str(pstats_path))
+
+    response = await client.get(
+        "/admin/profile/cpu", params={"seconds": 0.1, "format": "collapsed"}, headers=headers
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.text.splitlines()[0].rsplit(" ", 1)[1].isdigit()
+
+    response = await client.post("/admin/memory/tracemalloc/start", headers=headers)
+    assert response.json()["tracing"] is True
+    try:
+        response = await client.get("/admin/memory/tracemalloc/snapshot", headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.text.startswith("Top 50 allocations by lineno")
+
+        response = await client.get(
+            "/admin/memory/tracemalloc/snapshot", params={"format": "diff"}, headers=headers
+        )
+        assert response.text.startswith("Top 50 allocation differences")
+    finally:
+        await client.post("/admin/memory/tracemalloc/stop", headers=headers)
+
+    response = await client.get("/admin/memory", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert {"process", "vips_cache", "vips", "tile_cache"} <= set(response.json())
@@ -0,0 +1,158 @@
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+
+from sqlalchemy import func, select
+
+from npo.importer import Importer
+from npo.models.file import File as FileStorage
+from npo.routers.files import services
+from npo.watcher import Watcher
+
+
+async def test_import_directory(override_db_session, override_settings, shared_datadir):
+    """
+    Test the bulk import of a directory tree, with a duplicate, then its resumption.
+    Uses real image files via pytest-datadir.
+    """
+    photos_dir = override_settings / "photos"
+    (photos_dir / "2024").mkdir(parents=True)
+    shutil.copy(shared_datadir / "image_01.jpg", photos_dir / "image_01.jpg")
+    shutil.copy(shared_datadir / "image_02.jpg", photos_dir / "2024" / "image_02.jpg")
+    shutil.copy(shared_datadir / "image_01.jpg", photos_dir / "2024" / "image_01_copy.jpg")
+    checkpoint = override_settings / "checkpoint.jsonl"
+
+    importer = Importer(override_db_session, checkpoint, workers=1, batch_size=1)
+    first_run = await importer.run(photos_dir)
+
+    assert (first_run.imported, first_run.duplicates, first_run.errors) == (2, 1, 0)
+    records = {
+        record["path"]: record for record in map(json.loads, checkpoint.read_text().splitlines())
+    }
+    assert records["image_01.jpg"]["status"] == "imported"
+    assert records["2024/image_02.jpg"]["status"] == "imported"
+    assert records["2024/image_01_copy.jpg"]["status"] == "duplicate"
+
+    # The sources stay in place, the stored files and pyramids are in the hashed layout
+    assert (photos_dir / "image_01.jpg").exists()
+    stored = (await override_db_session.execute(select(FileStorage))).scalars().all()
+    for file_storage in stored:
+        assert file_storage.path.startswith(str(override_settings / "storage"))
+        assert file_storage.path.endswith(f"{file_storage.path_hash_file}.jpg")
+        assert os.path.exists(file_storage.path.removesuffix(".jpg") + ".szi")
+
+    # A second run skips the files recorded by the checkpoint
+    second_run = await Importer(override_db_session, checkpoint, workers=1).run(photos_dir)
+    assert (second_run.skipped, second_run.imported) == (3, 0)
+    count = await override_db_session.scalar(select(func.count()).select_from(FileStorage))
+    assert count == first_run.imported
+
+
+async def test_import_directory_concurrent_copies(
+    override_db_session, override_settings, shared_datadir
+):
+    """
+    Test two copies of an image analyzed at the same time: one is imported, the other rejected
+    as a duplicate.
+    """
+    photos_dir = override_settings / "photos"
+    photos_dir.mkdir()
+    shutil.copy(shared_datadir / "image_01.jpg", photos_dir / "image_01.jpg")
+    shutil.copy(shared_datadir / "image_01.jpg", photos_dir / "image_01_copy.jpg")
+
+    # Two workers, four files in flight
+    stats = await Importer(override_db_session, None, workers=2).run(photos_dir)
+
+    assert (stats.imported, stats.duplicates, stats.errors) == (1, 1, 0)
+    count = await override_db_session.scalar(select(func.count()).select_from(FileStorage))
+    assert count == 1
+
+
+async def test_import_directory_commit_error(
+    override_db_session, override_settings, shared_datadir, monkeypatch
+):
+    """
+    Test a file whose row cannot be written: the other files of its batch are imported, and its
+    stored copy and pyramid are removed.
+    """
+    photos_dir = override_settings / "photos"
+    photos_dir.mkdir()
+    shutil.copy(shared_datadir / "image_01.jpg", photos_dir / "image_01.jpg")
+    shutil.copy(shared_datadir / "image_02.jpg", photos_dir / "image_02.jpg")
+
+    add_file_infos = services.add_file_infos
+
+    async def failing_add_file_infos(file, db):
+        if file.name == "image_02.jpg":
+            raise ValueError("constraint violated")
+        return await add_file_infos(file, db)
+
+    monkeypatch.setattr(services, "add_file_infos", failing_add_file_infos)
+    stats = await Importer(override_db_session, None, workers=1, batch_size=2).run(photos_dir)
+
+    assert (stats.imported, stats.errors) == (1, 1)
+    stored = (await override_db_session.execute(select(FileStorage))).scalars().one()
+    storage_dir = override_settings / "storage"
+    assert [str(path) for path in storage_dir.rglob("*.jpg")] == [stored.path]
+    assert len(list(storage_dir.rglob("*.szi"))) == 1
+
+
+async def test_watch_directory(override_db_session, override_settings, shared_datadir):
+    """
+    Test the ingestion of a watched directory: a file present at startup, a file dropped while
+    watching, and a file in error which stays in place.
+    """
+    drop_dir = override_settings / "drop"
+    drop_dir.mkdir()
+    shutil.copy(shared_datadir / "image_01.jpg", drop_dir / "image_01.jpg")
+
+    importer = Importer(override_db_session, None, workers=1, remove_sources=True)
+    watcher = Watcher(importer, drop_dir, settle_time=0.2, flush_interval=0.1)
+    task = asyncio.create_task(watcher.run())
+    try:
+        (drop_dir / "2024").mkdir()
+        shutil.copy(shared_datadir / "image_02.jpg", drop_dir / "2024" / "image_02.jpg")
+        (drop_dir / "broken.jpg").write_bytes(b"not an image")
+        async with asyncio.timeout(60):
+            while importer.stats.processed < 3:  # noqa: PLR2004
+                await asyncio.sleep(0.1)
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    assert (importer.stats.imported, importer.stats.errors) == (2, 1)
+    assert sorted(path.name for path in drop_dir.rglob("*.jpg")) == ["broken.jpg"]
+    count = await override_db_session.scalar(select(func.count()).select_from(FileStorage))
+    assert count == importer.stats.imported
+
+
+async def test_watch_directory_concurrent_copies(
+    override_db_session, override_settings, shared_datadir
+):
+    """
+    Test two copies of an image dropped at the same time in the watched directory: one is
+    imported, the other rejected as a duplicate.
+    """
+    drop_dir = override_settings / "drop"
+    drop_dir.mkdir()
+
+    importer = Importer(override_db_session, None, workers=2, remove_sources=True)
+    watcher = Watcher(importer, drop_dir, settle_time=0.2, flush_interval=0.1)
+    task = asyncio.create_task(watcher.run())
+    try:
+        shutil.copy(shared_datadir / "image_01.jpg", drop_dir / "image_01.jpg")
+        shutil.copy(shared_datadir / "image_01.jpg", drop_dir / "image_01_copy.jpg")
+        async with asyncio.timeout(60):
+            while importer.stats.processed < 2 or importer.stats.imported < 1:  # noqa: PLR2004
+                await asyncio.sleep(0.1)
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    assert (importer.stats.imported, importer.stats.duplicates, importer.stats.errors) == (1, 1, 0)
+    count = await override_db_session.scalar(select(func.count()).select_from(FileStorage))
+    assert count == 1
@@ -0,0 +1,22 @@
+import pytest
+from alembic.script import ScriptDirectory
+
+from npo import database
+from npo.database import _alembic_config, get_head_revisions
+
+
+def test_head_revisions():
+    """The head revisions parsed from the migration scripts match the ones found by Alembic."""
+    script = ScriptDirectory.from_config(_alembic_config())
+    assert get_head_revisions() == set(script.get_heads())
+
+
+async def test_init_db_unknown_revision(monkeypatch):
+    """A database migrated by a newer release is not upgraded, the startup fails instead."""
+
+    async def get_current_revisions():
+        return {"0123456789ab"}
+
+    monkeypatch.setattr(database, "get_current_revisions", get_current_revisions)
+    with pytest.raises(RuntimeError, match="0123456789ab"):
+        await database.init_db()
@@ -1,15 +1,28 @@
+import csv
 import hashlib
+import json
+import os
+import struct
+from datetime import datetime
 
 import exiftool
+import pytest
 import pyvips
 from fastapi import status
+from sqlalchemy import func, select
 
 from npo import config
+from npo.core.file import sync_hash_index
+from npo.core.hash_index import hash_index
+from npo.core.metrics import DUPLICATES_REJECTED
+from npo.models.file import File as FileStorage
+from npo.routers.files.schemas import File, FileUploadResult
+from npo.routers.files.services import read_image_unique_id
 
 
 async def test_upload_file(client, shared_datadir):
     """
-    Test file upload via the /files/upload endpoint.
+    Test file upload via the /files/upload endpoint, with the metadata of the file.
     Uses a real image file via pytest-datadir.
     """
     # shared_datadir points to the temporary folder containing a copy of tests/data
@@ -20,7 +33,7 @@ async def test_upload_file(client, shared_datadir):
     # Open file in binary mode for upload
     with open(image_path, "rb") as f:
         files = {"files": (image_name, f, image_mime)}
-        response = await client.post("/files/upload", files=files)
+        response = await client.post("/files/upload", files=files, params={"include": "meta_data"})
 
     # Verify that the upload succeeded (Code 200 OK or 201 Created depending on your implementation)
     assert response.status_code == status.HTTP_201_CREATED
@@ -47,6 +60,11 @@ async def test_upload_file(client, shared_datadir):
         "altitude",
         "datetime_shooting",
         "datetime_digitized",
+        "camera_make",
+        "camera_model",
+        "lens_model",
+        "iso",
+        "focal_length",
         "meta_data",
     }
     assert expected_keys == set(response_data[image_name].keys())
@@ -159,19 +177,19 @@ async def test_upload_duplicate_file(client, shared_datadir, upload_image):
     image_name = "image_01.jpg"
 
     # First upload
-    response1_perceptual_hash = await upload_image(image_name, return_attribute="perceptual_hash")
+    response1_file_hash = await upload_image(image_name, return_attribute="file_hash")
 
-    # Second upload (duplicate)
+    # Second upload (duplicate), rejected by the file hash before any decoding
     response2 = await upload_image(image_name, return_full_response=True)
 
     assert response2.status_code == status.HTTP_409_CONFLICT
     response_data2 = response2.json()
     assert "detail" in response_data2
     error_detail = response_data2["detail"]
-    assert error_detail["code"] == "DUPLICATE_PERCEPTUAL_HASH"
+    assert error_detail["code"] == "DUPLICATE_FILE_HASH"
     assert (
         error_detail["message"]
-        == f"File {image_name} with perceptual hash {response1_perceptual_hash} already exists."
+        == f"File {image_name} with file hash {response1_file_hash} already exists."
     )
 
 
@@ -193,7 +211,8 @@ async def test_upload_duplicate_perceptual_file(client, shared_datadir, upload_i
     img = img.resize(0.99)
     modified_image_name = "image_01_modified.jpg"
     modified_image_path = shared_datadir / modified_image_name
-    img.write_to_file(str(modified_image_path))
+    # Without metadata, for the ImageUniqueID check not to reject it first
+    img.write_to_file(str(modified_image_path), keep="none")
 
     # Second upload (perceptual duplicate)
     response2 = await upload_image(modified_image_name, return_full_response=True)
@@ -209,6 +228,91 @@ async def test_upload_duplicate_perceptual_file(client, shared_datadir, upload_i
     )
 
 
+async def test_upload_files_streamed(client, shared_datadir, upload_image):
+    """
+    Test the upload of several files in one request, streamed to the storage filesystem:
+    the file hashes are computed while receiving, and no received file is left behind,
+    including a rejected duplicate.
+    Uses real image files via pytest-datadir.
+    """
+    files = [
+        ("files", (name, (shared_datadir / name).read_bytes(), "image/jpeg"))
+        for name in ("image_01.jpg", "image_02.jpg")
+    ]
+    response = await client.post("/files/upload", files=files, data={"comment": "ignored"})
+
+    assert response.status_code == status.HTTP_201_CREATED
+    response_data = response.json()
+    for _, (name, content, _) in files:
+        assert response_data[name]["file_hash"] == hashlib.md5(content).hexdigest()
+        assert response_data[name]["path"].startswith(config.settings.storage_dir)
+        # Compact result, without the metadata unless included
+        assert set(response_data[name]) == set(FileUploadResult.model_fields)
+
+    response = await upload_image("image_01.jpg", return_full_response=True)
+    assert response.status_code == status.HTTP_409_CONFLICT
+    incoming_dir = os.path.join(config.settings.storage_dir, ".incoming")
+    assert os.listdir(incoming_dir) == []
+
+
+async def test_upload_invalid_body(client):
+    """
+    Test uploads without a multipart body or without any file.
+    """
+    response = await client.post("/files/upload", content=b"not multipart")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"]["code"] == "INVALID_MULTIPART"
+
+    response = await client.post("/files/upload", files={"other": ("a.jpg", b"data")})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"]["code"] == "NO_FILES_UPLOADED"
+
+
+def _write_image_with_unique_id(path, image_unique_id: str, descending: bool) -> None:
+    """Write a gradient JPEG whose EXIF data only holds an ImageUniqueID."""
+    value = image_unique_id.encode() + b"\x00"
+    # Little endian TIFF header, IFD0 pointing to the Exif IFD, which holds the ASCII value
+    ifd0 = struct.pack("<HHHII", 1, 0x8769, 4, 1, 26) + struct.pack("<I", 0)
+    exif_ifd = struct.pack("<HHHII", 1, 0xA420, 2, len(value), 44) + struct.pack("<I", 0)
+    exif = b"Exif\x00\x00II*\x00" + struct.pack("<I", 8) + ifd0 + exif_ifd + value
+    gradient = pyvips.Image.xyz(256, 64)[0]
+    image = (255 - gradient if descending else gradient).cast("uchar").copy()
+    image.set_type(pyvips.GValue.blob_type, "exif-data", exif)
+    image.write_to_file(str(path))
+
+
+async def test_read_image_unique_id(tmp_path):
+    """
+    Test reading the ImageUniqueID from the image header, without exiftool.
+    """
+    image_path = tmp_path / "image.jpg"
+    _write_image_with_unique_id(image_path, "0123456789abcdef0123456789abcdef", False)
+    file = File(name=image_path.name, path=str(image_path))
+
+    await read_image_unique_id(file)
+
+    assert file.image_unique_id == "0123456789abcdef0123456789abcdef"
+
+
+async def test_upload_duplicate_image_unique_id(client, shared_datadir, upload_image):
+    """
+    Test the rejection of a different file with the same ImageUniqueID, before its pixels are
+    decoded, the rejected file being removed.
+    """
+    image_unique_id = "fedcba9876543210fedcba9876543210"
+    _write_image_with_unique_id(shared_datadir / "first.jpg", image_unique_id, False)
+    _write_image_with_unique_id(shared_datadir / "second.jpg", image_unique_id, True)
+    rejected = DUPLICATES_REJECTED.value(reason="image_unique_id")
+
+    assert await upload_image("first.jpg", return_attribute="image_unique_id") == image_unique_id
+    response = await upload_image("second.jpg", return_full_response=True)
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.json()["detail"]["code"] == "DUPLICATE_IMAGE_UNIQUE_ID"
+    assert DUPLICATES_REJECTED.value(reason="image_unique_id") == rejected + 1
+    assert os.listdir(os.path.join(config.settings.storage_dir, ".incoming")) == []
+
+
 async def test_get_tile(client, shared_datadir, upload_image):
     """
     Test tile image retrieve via the /files/{file_hash}/{zoom}/{x}/{y}.jpg endpoint.
@@ -314,3 +418,316 @@ async def test_get_image_not_found(verify_404):
         "FILE_NOT_FOUND",
         f"File {pixel_hash} not found.",
     )
+
+
+async def test_files_preflight(client, store_files, monkeypatch):
+    """
+    Test the upload preflight via the /files/preflight endpoint, with lookups split in chunks.
+    """
+    monkeypatch.setattr("npo.routers.files.services.PREFLIGHT_CHUNK_SIZE", 2)
+    stored = await store_files(
+        {"file_hash": "a" * 32},
+        {"file_hash": "b" * 32, "image_unique_id": "B-UNIQUE-ID"},
+        {"file_hash": "c" * 32},
+    )
+
+    query = [
+        {"file_hash": "A" * 32},
+        {"file_hash": "d" * 32, "image_unique_id": "B-UNIQUE-ID"},
+        {"file_hash": "e" * 32, "image_unique_id": "UNKNOWN"},
+        {"file_hash": "f" * 32},
+        {"file_hash": "c" * 32},
+    ]
+    response = await client.post("/files/preflight", json={"files": query})
+
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [(item["exists"], item["matched_by"]) for item in data["items"]] == [
+        (True, "file_hash"),
+        (True, "image_unique_id"),
+        (False, None),
+        (False, None),
+        (True, "file_hash"),
+    ]
+    assert data["items"][0]["pixel_hash"] == stored[0].pixel_hash
+    assert data["items"][1]["pixel_hash"] == stored[1].pixel_hash
+    assert data["missing"] == ["e" * 32, "f" * 32]
+
+    response = await client.post("/files/preflight", json={"files": [{"file_hash": "x"}]})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_CONTENT
+
+
+async def test_search_files(client, store_files):
+    """
+    Test files filtering via the /files/search endpoint.
+    """
+    await store_files(
+        {"camera_make": "NIKON", "camera_model": "D850", "iso": 100, "focal_length": 50.0},
+        {"camera_make": "NIKON", "camera_model": "D850", "iso": 3200, "focal_length": 200.0},
+        {"camera_make": "Canon", "camera_model": "EOS R5", "iso": 400, "focal_length": 35.0},
+    )
+
+    response = await client.get(
+        "/files/search", params={"camera_make": "NIKON", "camera_model": "D850", "iso_max": 800}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [item["iso"] for item in data["items"]] == [100]
+    assert data["next_cursor"] is None
+    assert "meta_data" not in data["items"][0]
+
+
+async def test_search_files_keyset_pagination(client, store_files):
+    """
+    Test that /files/search pages follow the shooting date order without overlap.
+    """
+    dated_files = [{"datetime_shooting": datetime(2024, 1, 5 - day, 12, 0, 0)} for day in range(5)]
+    await store_files(*dated_files, {"datetime_shooting": None})
+
+    seen = []
+    params = {"sort": "datetime_shooting", "limit": 2}
+    while True:
+        response = await client.get("/files/search", params=params)
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        seen.extend(item["datetime_shooting"] for item in data["items"])
+        if not data["next_cursor"]:
+            break
+        params["cursor"] = data["next_cursor"]
+
+    assert len(seen) == len(dated_files)
+    assert seen == sorted(seen)
+
+
+async def test_search_files_invalid_cursor(client):
+    """
+    Test the /files/search endpoint for 400 response with a malformed cursor.
+    """
+    response = await client.get("/files/search", params={"cursor": "not-a-cursor"})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"]["code"] == "INVALID_CURSOR"
+
+
+async def test_files_within(client, store_files):
+    """
+    Test geotagged files listing via the /files/within endpoint.
+    """
+    await store_files(
+        {"name": "paris.jpg", "latitude": 48.8566, "longitude": 2.3522},
+        {"name": "versailles.jpg", "latitude": 48.8049, "longitude": 2.1204},
+        {"name": "montpellier.jpg", "latitude": 43.6108, "longitude": 3.8767},
+        {"name": "no_gps.jpg"},
+    )
+
+    response = await client.get("/files/within", params={"bbox": "2.0,48.7,2.5,48.9"})
+
+    assert response.status_code == status.HTTP_200_OK
+    names = {item["name"] for item in response.json()["items"]}
+    assert names == {"paris.jpg", "versailles.jpg"}
+
+
+async def test_files_within_invalid_bbox(client):
+    """
+    Test the /files/within endpoint for 400 response with a malformed bounding box.
+    """
+    response = await client.get("/files/within", params={"bbox": "10,50,5"})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"]["code"] == "INVALID_BBOX"
+
+
+async def test_files_clusters(client, store_files):
+    """
+    Test geotagged files clustering via the /files/clusters endpoint.
+    """
+    await store_files(
+        {"name": "paris.jpg", "latitude": 48.8566, "longitude": 2.3522},
+        {"name": "versailles.jpg", "latitude": 48.8049, "longitude": 2.1204},
+        {"name": "montpellier.jpg", "latitude": 43.6108, "longitude": 3.8767},
+    )
+    france_bbox = "-5.0,41.0,10.0,51.5"
+
+    response = await client.get("/files/clusters", params={"bbox": france_bbox, "zoom": 2})
+
+    assert response.status_code == status.HTTP_200_OK
+    clusters = response.json()["items"]
+    assert sorted(cluster["count"] for cluster in clusters) == [1, 2]
+    paris_cluster = next(cluster for cluster in clusters if cluster["count"] > 1)
+    assert paris_cluster["latitude"] == (48.8566 + 48.8049) / 2
+
+    paris_bbox = "2.0,48.7,2.5,48.9"
+    response = await client.get("/files/clusters", params={"bbox": paris_bbox, "zoom": 12})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [cluster["count"] for cluster in response.json()["items"]] == [1, 1]
+
+
+async def test_files_moved_file_aggregates(client, store_files):
+    """
+    Test the clusters and shooting days of a file stored again with another position and
+    shooting date: counted in its new cell and day only, the old ones keeping a representative
+    file among those left.
+    """
+    await store_files(
+        {"pixel_hash": "a" * 32, "latitude": 48.8566, "longitude": 2.3522},
+        {"pixel_hash": "b" * 32, "latitude": 48.8049, "longitude": 2.1204},
+        {"pixel_hash": "c" * 32, "datetime_shooting": datetime(2024, 1, 5, 8, 15, 0)},
+        {"pixel_hash": "d" * 32, "datetime_shooting": datetime(2024, 1, 5, 9, 30, 0)},
+    )
+    await store_files(
+        {"pixel_hash": "a" * 32, "latitude": 43.6108, "longitude": 3.8767},
+        {"pixel_hash": "c" * 32, "datetime_shooting": datetime(2024, 2, 1, 12, 0, 0)},
+    )
+
+    response = await client.get(
+        "/files/clusters", params={"bbox": "-5.0,41.0,10.0,51.5", "zoom": 2}
+    )
+    clusters = sorted(response.json()["items"], key=lambda cluster: cluster["latitude"])
+    assert [(cluster["count"], cluster["pixel_hash"]) for cluster in clusters] == [
+        (1, "a" * 32),
+        (1, "b" * 32),
+    ]
+    assert clusters[1]["latitude"] == pytest.approx(48.8049)
+
+    response = await client.get("/files/timeline", params={"granularity": "day"})
+    assert [
+        (bucket["period"], bucket["count"], bucket["first_pixel_hash"])
+        for bucket in response.json()["buckets"]
+    ] == [("2024-01-05", 1, "d" * 32), ("2024-02-01", 1, "c" * 32)]
+
+
+async def test_files_timeline(client, store_files):
+    """
+    Test the shooting dates histogram via the /files/timeline endpoint.
+    """
+    await store_files(
+        {"pixel_hash": "a" * 32, "datetime_shooting": datetime(2023, 12, 31, 18, 0, 0)},
+        {"pixel_hash": "b" * 32, "datetime_shooting": datetime(2024, 1, 5, 9, 30, 0)},
+        {"pixel_hash": "c" * 32, "datetime_shooting": datetime(2024, 1, 5, 8, 15, 0)},
+        {"pixel_hash": "d" * 32, "datetime_shooting": datetime(2024, 2, 1, 12, 0, 0)},
+        {"pixel_hash": "e" * 32},
+    )
+
+    response = await client.get("/files/timeline", params={"granularity": "month"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["buckets"] == [
+        {
+            "period": "2023-12",
+            "count": 1,
+            "first_pixel_hash": "a" * 32,
+            "last_pixel_hash": "a" * 32,
+        },
+        {
+            "period": "2024-01",
+            "count": 2,
+            "first_pixel_hash": "c" * 32,
+            "last_pixel_hash": "b" * 32,
+        },
+        {
+            "period": "2024-02",
+            "count": 1,
+            "first_pixel_hash": "d" * 32,
+            "last_pixel_hash": "d" * 32,
+        },
+    ]
+
+    response = await client.get("/files/timeline", params={"granularity": "year"})
+
+    assert [bucket["count"] for bucket in response.json()["buckets"]] == [1, 3]
+
+
+async def test_files_export(client, store_files):
+    """
+    Test the streaming export of files metadata via the /files/export endpoint.
+    """
+    await store_files(
+        {"pixel_hash": "a" * 32, "iso": 100, "meta_data": {"EXIF:Make": "NIKON"}},
+        {"pixel_hash": "b" * 32, "datetime_shooting": datetime(2024, 1, 5, 9, 30, 0)},
+    )
+
+    response = await client.get(
+        "/files/export", params={"fields": "pixel_hash,iso,datetime_shooting"}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows == [
+        {"pixel_hash": "a" * 32, "iso": 100, "datetime_shooting": None},
+        {"pixel_hash": "b" * 32, "iso": None, "datetime_shooting": "2024-01-05T09:30:00"},
+    ]
+
+    response = await client.get(
+        "/files/export",
+        params={"format": "csv", "fields": "pixel_hash", "include_meta_data": True},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(response.text.splitlines()))
+    assert rows == [
+        ["pixel_hash", "meta_data"],
+        ["a" * 32, '{"EXIF:Make": "NIKON"}'],
+        ["b" * 32, ""],
+    ]
+
+
+async def test_files_export_invalid_field(client):
+    """
+    Test the /files/export endpoint for 400 response with an unknown field.
+    """
+    response = await client.get("/files/export", params={"fields": "pixel_hash,password"})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"]["code"] == "INVALID_EXPORT_FIELD"
+
+
+async def test_short_pixel_hash(client, store_files, monkeypatch):
+    """
+    Test pixel hash prefixes resolved by the hash index, an ambiguous prefix answered with a
+    409, and the shortest unique prefixes given by the /files/search endpoint.
+    """
+    monkeypatch.setattr(config.settings, "hash_partial_match_length", 4)
+    stored = await store_files(
+        {"pixel_hash": "abc1" + "0" * 28, "iso": 100},
+        {"pixel_hash": "abc2" + "0" * 28, "iso": 200},
+        {"pixel_hash": "abc20" + "1" * 27, "iso": 300},
+        {"pixel_hash": "f" * 32, "iso": 400},
+    )
+
+    response = await client.get("/metadata/ABC1")
+    assert response.status_code == status.HTTP_200_OK
+    for url in ("/metadata/abc", "/files/abc2", "/files/abc20/0/0/0.jpg"):
+        response = await client.get(url)
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.json()["detail"]["code"] == "AMBIGUOUS_PIXEL_HASH"
+
+    response = await client.get("/files/search", params={"sort": "id"})
+    short_hashes = [item["short_hash"] for item in response.json()["items"]]
+    assert short_hashes == ["abc1", "abc200", "abc201", "ffff"]
+    assert all(
+        file.pixel_hash.startswith(short) for file, short in zip(stored, short_hashes, strict=True)
+    )
+
+
+async def test_hash_index_late_commit(client, override_db_session, store_files):
+    """
+    Test a file row committed after a row with a higher id was read into the hash index: its
+    prefix is resolved once the index is synced again.
+    """
+    await store_files({"pixel_hash": "abc1" + "0" * 28}, {"pixel_hash": "abc2" + "0" * 28})
+    # As if the first row had not been committed yet when the second one was read
+    last_id = await override_db_session.scalar(select(func.max(FileStorage.id)))
+    hash_index.clear()
+    hash_index.add("abc2" + "0" * 28)
+    hash_index.synced_id = last_id
+    hash_index.recent_ids = {last_id}
+
+    await sync_hash_index(override_db_session, force=True)
+
+    response = await client.get("/files/abc")
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.json()["detail"]["code"] == "AMBIGUOUS_PIXEL_HASH"
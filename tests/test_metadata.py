@@ -1,5 +1,10 @@
+import time
+
 import exiftool
 from fastapi import status
+from sqlalchemy import event
+
+from npo.core.hash_index import hash_index
 
 
 async def test_metadata(client, shared_datadir, upload_image):
@@ -38,6 +43,16 @@ async def test_raw_metadata_not_found(verify_404):
     )
 
 
+async def test_raw_metadata_large_integer(client, store_files):
+    """Test raw metadata holding an integer beyond 64 bits, as some maker notes do."""
+    meta_data = {"MakerNotes:InternalSerialNumber": 2**70, "EXIF:Make": "Canon"}
+    await store_files({"pixel_hash": "a" * 32, "meta_data": meta_data})
+
+    response = await client.get(f"/metadata/{'a' * 32}")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == meta_data
+
+
 async def test_photography_metadata_not_found(verify_404):
     """Test the photography metadata endpoint for 404 response."""
 
@@ -58,3 +73,95 @@ async def test_metadata_catch_all(verify_404):
         "METADATA_WEBSERVICE_NOT_FOUND",
         f"Webservice /metadata/{unknown_path} requested not found.",
     )
+
+
+async def test_photography_metadata_batch(client, store_files):
+    """
+    Test the photography metadata of several files via the /metadata/batch endpoint, the same
+    as one file at a time, with a selection of fields.
+    """
+    meta_data = {
+        "EXIF:Make": "NIKON CORPORATION",
+        "EXIF:Model": "NIKON D850",
+        "EXIF:FNumber": 5.6,
+        "EXIF:ExposureTime": 0.002,
+        "EXIF:ISOSpeedRatings": 400,
+        "File:ImageWidth": 8256,
+    }
+    stored = await store_files(
+        {"pixel_hash": "a" * 32, "meta_data": meta_data},
+        {
+            "pixel_hash": "b" * 32,
+            "meta_data": {**meta_data, "EXIF:Model": "NIKON Z 9", "EXIF:ISO": 64},
+        },
+        {"pixel_hash": "c" * 32, "meta_data": None},
+    )
+    unknown_hash = "f" * 32
+    # The second file by a prefix of its pixel hash
+    pixel_hashes = [stored[0].pixel_hash, "bbbbbbbb", stored[2].pixel_hash]
+
+    response = await client.post(
+        "/metadata/batch", json={"pixel_hashes": [*pixel_hashes, unknown_hash]}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["missing"] == [stored[2].pixel_hash, unknown_hash]
+    single = await client.get(f"/metadata/{stored[0].pixel_hash}/photography")
+    assert data["items"][stored[0].pixel_hash] == single.json()
+    assert data["items"][pixel_hashes[1]]["iso"] == 64  # noqa: PLR2004
+
+    response = await client.post(
+        "/metadata/batch",
+        json={"pixel_hashes": pixel_hashes[:2], "fields": ["cameraModel", "shutterSpeed"]},
+    )
+    assert response.json()["items"] == {
+        pixel_hashes[0]: {"cameraModel": "NIKON D850", "shutterSpeed": "1/500"},
+        pixel_hashes[1]: {"cameraModel": "NIKON Z 9", "shutterSpeed": "1/500"},
+    }
+
+    response = await client.post(
+        "/metadata/batch", json={"pixel_hashes": pixel_hashes, "fields": ["lens"]}
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"]["code"] == "INVALID_PHOTOGRAPHY_FIELD"
+
+
+async def test_photography_metadata_batch_unindexed(client, store_files, override_db_session):
+    """
+    Test prefixes missing from the hash index, as for files just stored by another worker,
+    resolved by a single query before the one reading the metadata.
+    """
+    meta_data = {"EXIF:Model": "NIKON D850"}
+    await store_files(
+        {"pixel_hash": "a" * 32, "meta_data": meta_data},
+        {"pixel_hash": "b" * 32, "meta_data": meta_data},
+        {"pixel_hash": "bc" * 16, "meta_data": meta_data},
+    )
+    # Index just synced, before the files were stored
+    hash_index.clear()
+    hash_index.synced_at = time.monotonic()
+    statements = []
+
+    def record(conn, cursor, statement, *args):  # noqa: ARG001
+        statements.append(statement)
+
+    engine = override_db_session.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = await client.post(
+            "/metadata/batch", json={"pixel_hashes": ["aaaa", "b" * 32, "bc", "dddd"]}
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert set(response.json()["items"]) == {"aaaa", "b" * 32, "bc"}
+    assert response.json()["missing"] == ["dddd"]
+    assert len(statements) == 2  # noqa: PLR2004
+
+    # Matching several files once looked up
+    hash_index.clear()
+    hash_index.synced_at = time.monotonic()
+    response = await client.post("/metadata/batch", json={"pixel_hashes": ["b"]})
+    assert response.status_code == status.HTTP_409_CONFLICT
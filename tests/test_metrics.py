@@ -0,0 +1,67 @@
+import json
+
+import pytest
+from fastapi import status
+
+from npo import config
+from npo.core.metrics import HTTP_REQUEST_DURATION
+from npo.routers.files import routes as files_routes
+
+
+async def test_metrics(client):
+    """Test the metrics endpoint exposes request latencies by route template."""
+
+    pixel_hash = "abcdef1234567890abcdef1234567890"
+    await client.get("/health/ping")
+    await client.get(f"/files/{pixel_hash}/2/0/1.jpg")
+
+    response = await client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    content = response.text
+    assert "# TYPE npo_http_request_duration_seconds histogram" in content
+    assert (
+        'npo_http_request_duration_seconds_count{method="GET",route="/health/ping",status="200"}'
+        in content
+    )
+    # Raw paths must not leak into labels
+    assert 'route="/files/{pixel_hash}/{zoom}/{x}/{y}.jpg",status="404"' in content
+    assert pixel_hash not in content
+    assert "# TYPE npo_uploads_in_progress gauge" in content
+
+
+async def test_metrics_unhandled_exception(client, monkeypatch):
+    """Test a request failing with an unhandled exception is counted as a 500."""
+
+    async def failing_get_timeline(granularity, db):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(files_routes, "get_timeline", failing_get_timeline)
+    labels = {"method": "GET", "route": "/files/timeline", "status": "500"}
+    count = HTTP_REQUEST_DURATION.count(**labels)
+    with pytest.raises(RuntimeError):
+        await client.get("/files/timeline")
+
+    assert HTTP_REQUEST_DURATION.count(**labels) == count + 1
+
+
+async def test_server_timing(client, override_settings):
+    """Test the span tree of a request is reported in the Server-Timing header and trace file."""
+
+    trace_file = override_settings / "traces.jsonl"
+    config.settings.trace_file = str(trace_file)
+    try:
+        response = await client.get("/files/abcdef1234567890abcdef1234567890/2/0/1.jpg")
+    finally:
+        config.settings.trace_file = None
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    server_timing = response.headers["server-timing"]
+    assert server_timing.startswith("total;dur=")
+    assert "db_lookup;dur=" in server_timing
+
+    trace = json.loads(trace_file.read_text())
+    assert trace["trace_id"] == response.headers["x-trace-id"]
+    assert trace["route"] == "/files/{pixel_hash}/{zoom}/{x}/{y}.jpg"
+    assert [span["name"] for span in trace["children"]] == ["db_lookup"]
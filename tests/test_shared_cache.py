@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+
+import pyvips
+from fastapi import status
+
+from npo import config
+from npo.core.metrics import SHARED_CACHE_REQUESTS
+from npo.core.shared_cache import SharedCache, get_shared_cache
+from npo.routers.files.schemas import File
+from npo.routers.files.services import compute_hash_pathes, create_dzi, get_storage_path
+
+CACHE_SIZE = 1 << 20
+
+
+def test_shared_cache_between_processes(tmp_path):
+    """
+    Test values put by a process read by another one, and the oldest values overwritten once
+    the cache is full.
+    """
+    path = str(tmp_path / "cache")
+    code = (
+        "from npo.core.shared_cache import SharedCache\n"
+        f"SharedCache({path!r}, {CACHE_SIZE}).put(('tile', 'abc', 0, 0, 0), b'from child')\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True, env=os.environ)
+
+    cache = SharedCache(path, CACHE_SIZE)
+    assert cache.get(("tile", "abc", 0, 0, 0)) == b"from child"
+    assert cache.get(("tile", "abc", 0, 0, 1)) is None
+
+    for index in range(4 * CACHE_SIZE // 10000):
+        cache.put(("tile", "def", 0, 0, index), index.to_bytes(4) * 2500)
+    assert ("tile", "abc", 0, 0, 0) not in cache
+    assert ("tile", "def", 0, 0, 0) not in cache
+    last = 4 * CACHE_SIZE // 10000 - 1
+    assert cache.get(("tile", "def", 0, 0, last)) == last.to_bytes(4) * 2500
+    assert cache.stats()["bytes"] <= cache.stats()["max_bytes"]
+    cache.close()
+
+
+def test_shared_cache_other_layout(tmp_path):
+    """
+    Test a cache of another size, as mapped by workers of another deployment, leaving the
+    segment of the running workers intact.
+    """
+    path = str(tmp_path / "cache")
+    cache = SharedCache(path, CACHE_SIZE)
+    cache.put(("tile", "abc", 0, 0, 0), b"value")
+
+    other_cache = SharedCache(path, 2 * CACHE_SIZE)
+
+    assert other_cache.path != cache.path
+    assert other_cache.get(("tile", "abc", 0, 0, 0)) is None
+    assert cache.get(("tile", "abc", 0, 0, 0)) == b"value"
+    other_cache.close()
+    cache.close()
+    assert SharedCache(path, CACHE_SIZE).get(("tile", "abc", 0, 0, 0)) == b"value"
+
+
+async def test_shared_cache_routes(client, store_files, override_settings, monkeypatch):
+    """
+    Test the tiles and the pixel hash lookups of the routes served from the shared cache,
+    without the database nor the pyramid once cached.
+    """
+    monkeypatch.setattr(config.settings, "shared_cache_path", f"{override_settings}/cache")
+    monkeypatch.setattr(config.settings, "shared_cache_bytes", CACHE_SIZE)
+    file = File(name="image.jpg", path="", pixel_hash="12" * 16, mime="image/jpeg")
+    await compute_hash_pathes(file)
+    file.path = get_storage_path(file)
+    os.makedirs(os.path.dirname(file.path))
+    (pyvips.Image.xyz(600, 400)[0] % 256).cast("uchar").write_to_file(file.path)
+    await create_dzi(file)
+    await store_files(
+        file.model_dump(include={"pixel_hash", "path", "path_hash_dir", "path_hash_file"})
+    )
+    file_hits = SHARED_CACHE_REQUESTS.value(kind="file", result="hit")
+
+    tile = await client.get(f"/files/{file.pixel_hash}/0/0/0.jpg")
+    assert tile.status_code == status.HTTP_200_OK
+    # Looked up by prefix: not cached, the prefix could match another file later
+    response = await client.get(f"/files/{file.pixel_hash[:8]}/0/0/0.jpg")
+    assert response.content == tile.content
+    assert SHARED_CACHE_REQUESTS.value(kind="file", result="hit") == file_hits
+
+    os.remove(get_storage_path(file, ".szi"))
+    response = await client.get(f"/files/{file.pixel_hash}/0/0/0.jpg")
+    assert response.content == tile.content
+    assert SHARED_CACHE_REQUESTS.value(kind="file", result="hit") == file_hits + 1
+    # Child tiles prefetched with the first one
+    response = await client.get(f"/files/{file.pixel_hash}/1/0/0.jpg")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.content
+    # Every tile read but the first one
+    assert get_shared_cache().views["tile"].stats() == {
+        "hits": 3,
+        "misses": 1,
+        "hit_ratio": 0.75,
+        "hit_bytes": 2 * len(tile.content) + len(response.content),
+    }
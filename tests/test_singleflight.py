@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from npo.core.metrics import COALESCED_CALLS
+from npo.core.singleflight import SingleFlight
+
+
+async def test_single_flight():
+    """
+    Test concurrent calls of the same key running the work once, an error raised to every
+    caller and a cancelled caller not cancelling the work for the others.
+    """
+    flights = SingleFlight()
+    calls = []
+    coalesced = COALESCED_CALLS.value(kind="tile")
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    results = await asyncio.gather(
+        flights.do(("tile", "a"), lambda: work("a")),
+        flights.do(("tile", "a"), lambda: work("a")),
+        flights.do(("tile", "b"), lambda: work("b")),
+    )
+    assert results == ["a", "a", "b"]
+    assert sorted(calls) == ["a", "b"]
+    assert COALESCED_CALLS.value(kind="tile") == coalesced + 1
+    assert len(flights) == 0
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    results = await asyncio.gather(
+        flights.do(("tile", "c"), fail), flights.do(("tile", "c"), fail), return_exceptions=True
+    )
+    assert all(isinstance(result, ValueError) for result in results)
+
+    first = asyncio.create_task(flights.do(("tile", "d"), lambda: work("d")))
+    second = asyncio.create_task(flights.do(("tile", "d"), lambda: work("d")))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "d"
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    assert len(flights) == 0
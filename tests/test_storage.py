@@ -0,0 +1,115 @@
+import os
+from collections import Counter
+
+from fastapi import status
+from sqlalchemy import select
+
+from npo import config
+from npo.core import storage
+from npo.models.file import File as FileStorage
+from npo.routers.files.schemas import File
+from npo.routers.files.services import compute_hash_pathes
+
+# Files stored for each image: the original and its pyramid
+EXTENSIONS = (".jpg", ".szi")
+
+
+def test_select_volume(monkeypatch):
+    """
+    Test the placement of the shards in proportion to the volume weights, a new volume only
+    taking shards from the others.
+    """
+    shards = [f"{index:02x}" for index in range(256)]
+    monkeypatch.setattr(config.settings, "storage_volumes", {"/a/": 1.0, "/b/": 3.0})
+    before = {shard: storage.select_volume(shard) for shard in shards}
+    counts = Counter(before.values())
+    # About a quarter of the shards for a quarter of the total weight
+    assert len(shards) / 8 < counts["/a/"] < len(shards) / 3  # noqa: PLR2004
+    assert counts["/a/"] + counts["/b/"] == len(shards)
+
+    monkeypatch.setattr(
+        config.settings, "storage_volumes", {"/a/": 1.0, "/b/": 3.0, "/c/": 1.0, "/d/": 0.0}
+    )
+    after = {shard: storage.select_volume(shard) for shard in shards}
+    moved = {shard for shard in shards if after[shard] != before[shard]}
+    assert moved
+    assert {after[shard] for shard in moved} == {"/c/"}
+
+
+async def test_rebalance(client, override_db_session, override_settings, store_files, monkeypatch):
+    """
+    Test moving the files of a volume to a new one, the files being readable before and after.
+    """
+    volume_a = f"{override_settings}/volume_a/"
+    volume_b = f"{override_settings}/volume_b/"
+    monkeypatch.setattr(config.settings, "storage_volumes", {volume_a: 1.0})
+    pixel_hashes = [f"{index:02x}" + "0" * 30 for index in range(0, 256, 16)]
+    for pixel_hash in pixel_hashes:
+        file = File(name=f"{pixel_hash}.jpg", path="", pixel_hash=pixel_hash)
+        await compute_hash_pathes(file)
+        file.path = storage.get_path(f"{file.path_hash_dir}{file.path_hash_file}.jpg")
+        assert file.path.startswith(volume_a)
+        os.makedirs(os.path.dirname(file.path))
+        for extension in EXTENSIONS:
+            with open(file.path.removesuffix(".jpg") + extension, "wb") as stored_file:
+                stored_file.write(pixel_hash.encode())
+        await store_files(
+            file.model_dump(include={"pixel_hash", "path", "path_hash_dir", "path_hash_file"})
+        )
+
+    # Volume a drained: its files are found there until moved
+    monkeypatch.setattr(config.settings, "storage_volumes", {volume_a: 0.0, volume_b: 1.0})
+    response = await client.get(f"/files/{pixel_hashes[0]}")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.content == pixel_hashes[0].encode()
+
+    moved = []
+    moves = await storage.rebalance(
+        override_db_session, jobs=2, on_move=lambda *args: moved.append(args)
+    )
+
+    assert len(moves) == len(moved) == len(pixel_hashes)
+    assert all(count == len(EXTENSIONS) for _, count in moved)
+    assert os.listdir(volume_a) == []
+    assert list(storage.plan_rebalance()) == []
+    result = await override_db_session.execute(select(FileStorage.pixel_hash, FileStorage.path))
+    for pixel_hash, path in result.all():
+        assert path.startswith(volume_b)
+        with open(path, "rb") as stored_file:
+            assert stored_file.read() == pixel_hash.encode()
+    response = await client.get(f"/files/{pixel_hashes[0]}")
+    assert response.content == pixel_hashes[0].encode()
+
+
+async def test_rebalance_from_storage_dir(
+    client, override_db_session, override_settings, store_files, monkeypatch
+):
+    """
+    Test configuring volumes without the storage directory: the files stored there before are
+    found, then moved to the volumes.
+    """
+    pixel_hash = "ab" + "0" * 30
+    file = File(name=f"{pixel_hash}.jpg", path="", pixel_hash=pixel_hash)
+    await compute_hash_pathes(file)
+    file.path = storage.get_path(f"{file.path_hash_dir}{file.path_hash_file}.jpg")
+    assert file.path.startswith(config.settings.storage_dir)
+    os.makedirs(os.path.dirname(file.path))
+    with open(file.path, "wb") as stored_file:
+        stored_file.write(pixel_hash.encode())
+    await store_files(
+        file.model_dump(include={"pixel_hash", "path", "path_hash_dir", "path_hash_file"})
+    )
+
+    volume = f"{override_settings}/volume/"
+    monkeypatch.setattr(config.settings, "storage_volumes", {volume: 1.0})
+    assert storage.get_volumes() == {volume: 1.0, config.settings.storage_dir: 0.0}
+    response = await client.get(f"/files/{pixel_hash}")
+    assert response.content == pixel_hash.encode()
+
+    moves = await storage.rebalance(override_db_session)
+
+    assert [(move.source, move.target) for move in moves] == [(config.settings.storage_dir, volume)]
+    path = await override_db_session.scalar(select(FileStorage.path))
+    assert path.startswith(volume)
+    response = await client.get(f"/files/{pixel_hash}")
+    assert response.content == pixel_hash.encode()
@@ -0,0 +1,138 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pyvips
+
+from npo import config
+from npo.core import tiles
+from npo.core.metrics import TILE_CACHE_HIT_BYTES
+from npo.core.tile_cache import ENTRY_OVERHEAD, TileCache
+from npo.routers.files.schemas import File
+from npo.routers.files.services import (
+    compute_hash_pathes,
+    create_dzi,
+    get_storage_path,
+    get_tile_from_dzi,
+)
+
+
+async def _store_image(pixel_hash: str) -> File:
+    file = File(name="image.jpg", path="", pixel_hash=pixel_hash)
+    await compute_hash_pathes(file)
+    file.path = get_storage_path(file)
+    os.makedirs(os.path.dirname(file.path))
+    (pyvips.Image.xyz(600, 400)[0] % 256).cast("uchar").write_to_file(file.path)
+    return file
+
+
+async def test_convert_archives(override_settings, monkeypatch):
+    """
+    Test serving the tiles of an archive from the packs once converted, then without the
+    archive, and the pyramid of a new image created in the packs.
+    """
+    monkeypatch.setattr(config.settings, "tile_backend", "szi")
+    file = await _store_image("ab" * 16)
+    await create_dzi(file)
+    archive_tiles = {
+        (zoom, x, y): await get_tile_from_dzi(file, zoom, x, y)
+        for zoom, x, y in tiles.get_tile_store().list_tiles(file)
+    }
+    assert (0, 0, 0) in archive_tiles
+
+    # Served from the archive until converted
+    monkeypatch.setattr(config.settings, "tile_backend", "pack")
+    assert await get_tile_from_dzi(file, 0, 0, 0) == archive_tiles[0, 0, 0]
+
+    converted = []
+    count = tiles.convert_archives(remove=True, on_convert=lambda *args: converted.append(args))
+
+    assert count == 1
+    assert converted == [(get_storage_path(file, ".szi"), len(archive_tiles))]
+    assert not os.path.exists(get_storage_path(file, ".szi"))
+    for (zoom, x, y), data in archive_tiles.items():
+        assert await get_tile_from_dzi(file, zoom, x, y) == data
+    assert await get_tile_from_dzi(file, 9, 0, 0) is None
+
+    new_file = await _store_image("cd" * 16)
+    await create_dzi(new_file)
+    assert not os.path.exists(get_storage_path(new_file, ".szi"))
+    assert sorted(tiles.get_tile_store().list_tiles(new_file)) == sorted(archive_tiles)
+    packs_dir = f"{override_settings}/storage/{tiles.PACKS_DIR}"
+    packs = {name for name in os.listdir(packs_dir) if name.endswith(".sqlite")}
+    assert packs == {"tiles-a.sqlite", "tiles-c.sqlite"}
+
+
+def test_pack_concurrent_access(override_settings):
+    """
+    Test reading the tiles of a pack from several threads while they are rewritten.
+    """
+    store = tiles.PackTileStore()
+    file = File(name="image.jpg", path="", pixel_hash="ab" * 16)
+    pyramid = {(1, x, y): bytes([x, y]) * 100 for x in range(4) for y in range(4)}
+    store.write(file.pixel_hash, ((*coordinates, data) for coordinates, data in pyramid.items()))
+
+    def rewrite(_):
+        return store.write(
+            file.pixel_hash, ((*coordinates, data) for coordinates, data in pyramid.items())
+        )
+
+    def read(_):
+        return store.get_tiles(file, list(pyramid))
+
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            writes = executor.map(rewrite, range(20))
+            reads = executor.map(read, range(200))
+            assert set(writes) == {len(pyramid)}
+            assert all(result == pyramid for result in reads)
+    finally:
+        store.close()
+
+
+def test_tile_cache_budget():
+    """
+    Test the eviction of the least recently used tiles once the cache exceeds its budget.
+    """
+    cache = TileCache(3 * (1000 + ENTRY_OVERHEAD))
+    for x in range(3):
+        cache.put(("a", 0, x, 0), bytes(1000))
+    assert cache.get(("a", 0, 0, 0)) is not None
+
+    cache.put(("a", 0, 3, 0), bytes(1000))
+
+    assert ("a", 0, 1, 0) not in cache
+    assert all(("a", 0, x, 0) in cache for x in (0, 2, 3))
+    assert cache.size <= cache.max_bytes
+    # Larger than the whole budget: not cached
+    cache.put(("a", 1, 0, 0), bytes(cache.max_bytes))
+    assert ("a", 1, 0, 0) not in cache
+
+
+async def test_tile_cache_prefetch(override_settings, monkeypatch):
+    """
+    Test that a missed tile brings its neighbors and children in the cache, later read without
+    touching the archive.
+    """
+    monkeypatch.setattr(config.settings, "tile_backend", "szi")
+    monkeypatch.setattr(config.settings, "tile_cache_bytes", 1 << 20)
+    monkeypatch.setattr(config.settings, "shared_cache_path", None)
+    file = await _store_image("ef" * 16)
+    await create_dzi(file)
+    store = tiles.get_tile_store()
+    hit_bytes = TILE_CACHE_HIT_BYTES.value()
+
+    tile = await get_tile_from_dzi(file, 0, 0, 0)
+
+    assert store.cache.stats()["misses"] == 1
+    children = [(1, x, y) for x in (0, 1) for y in (0, 1)]
+    expected = store.store.get_tiles(file, children)
+    assert expected
+    os.remove(get_storage_path(file, ".szi"))
+    for coordinates, data in expected.items():
+        assert await get_tile_from_dzi(file, *coordinates) == data
+    assert await get_tile_from_dzi(file, 0, 0, 0) == tile
+
+    stats = tiles.get_tile_cache_statistics()
+    assert (stats["hits"], stats["misses"]) == (len(expected) + 1, 1)
+    assert stats["hit_ratio"] == stats["hits"] / (stats["hits"] + stats["misses"])
+    assert TILE_CACHE_HIT_BYTES.value() - hit_bytes == stats["hit_bytes"]
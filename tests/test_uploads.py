@@ -0,0 +1,165 @@
+import hashlib
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi import status
+
+from npo import config
+from npo.routers.files import services as files_services
+from npo.routers.uploads import services
+
+# Holds the lock of an upload in another process until its standard input is closed
+HOLD_LOCK = """
+import fcntl, sys
+with open(sys.argv[1], "a") as lock_file:
+    fcntl.lockf(lock_file, fcntl.LOCK_EX)
+    print("locked", flush=True)
+    sys.stdin.read()
+"""
+
+
+async def _create_upload(client, name: str, size: int) -> str:
+    response = await client.post("/uploads", json={"name": name, "size": size})
+    assert response.status_code == status.HTTP_201_CREATED
+    upload = response.json()
+    assert response.headers["location"] == f"/uploads/{upload['id']}"
+    assert (upload["name"], upload["size"], upload["offset"]) == (name, size, 0)
+    assert upload["mime"] == "image/jpeg"
+    return upload["id"]
+
+
+async def _patch(client, upload_id: str, offset: int, content: bytes):
+    return await client.patch(
+        f"/uploads/{upload_id}",
+        content=content,
+        headers={
+            "Upload-Offset": str(offset),
+            "Content-Type": "application/offset+octet-stream",
+        },
+    )
+
+
+async def test_upload_chunks(client):
+    """
+    Test sending the chunks of a resumable upload, a chunk at a wrong offset being rejected.
+    """
+    content = bytes(range(256)) * 40
+    upload_id = await _create_upload(client, "image.jpg", len(content))
+
+    response = await _patch(client, upload_id, 0, content[:4000])
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert response.headers["upload-offset"] == "4000"
+
+    # Resumed from the offset given by a HEAD request
+    response = await client.head(f"/uploads/{upload_id}")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["upload-offset"] == "4000"
+    assert response.headers["upload-length"] == str(len(content))
+
+    response = await _patch(client, upload_id, 1000, content[1000:])
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.json()["detail"]["code"] == "UPLOAD_OFFSET_MISMATCH"
+
+    response = await _patch(client, upload_id, 4000, content[4000:] + b"extra")
+    assert response.status_code == status.HTTP_413_CONTENT_TOO_LARGE
+    assert response.json()["detail"]["code"] == "UPLOAD_TOO_LARGE"
+
+    response = await _patch(client, upload_id, 4000, content[4000:])
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    response = await client.get(f"/uploads/{upload_id}")
+    assert response.json()["offset"] == len(content)
+    with open(f"{config.settings.uploads_dir}{upload_id}.part", "rb") as data_file:
+        assert data_file.read() == content
+
+
+async def test_upload_incomplete_and_delete(client, verify_404):
+    """
+    Test that an incomplete upload cannot be finalized, and that a deleted one is gone.
+    """
+    upload_id = await _create_upload(client, "image.jpg", 100)
+    await _patch(client, upload_id, 0, b"0" * 50)
+
+    response = await client.post(f"/uploads/{upload_id}/finalize")
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert response.json()["detail"]["code"] == "UPLOAD_INCOMPLETE"
+
+    response = await client.delete(f"/uploads/{upload_id}")
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    await verify_404(f"/uploads/{upload_id}", "UPLOAD_NOT_FOUND", f"Upload {upload_id} not found.")
+
+
+async def test_upload_finalize(client, shared_datadir):
+    """
+    Test a resumable upload of a real image handed to the ingestion pipeline, the worker
+    losing its incremental hash halfway as after a restart.
+    Uses real image files via pytest-datadir.
+    """
+    content = (shared_datadir / "image_01.jpg").read_bytes()
+    upload_id = await _create_upload(client, "image_01.jpg", len(content))
+    half = len(content) // 2
+    await _patch(client, upload_id, 0, content[:half])
+    services._hashers.clear()
+    await _patch(client, upload_id, half, content[half:])
+
+    response = await client.post(f"/uploads/{upload_id}/finalize")
+    assert response.status_code == status.HTTP_201_CREATED
+    data = response.json()["image_01.jpg"]
+    assert data["file_hash"] == hashlib.md5(content).hexdigest()
+    assert data["path"].startswith(config.settings.storage_dir)
+    assert data["pixel_hash"]
+
+    response = await client.get(f"/files/{data['pixel_hash']}")
+    assert response.status_code == status.HTTP_200_OK
+    response = await client.head(f"/uploads/{upload_id}")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def test_upload_locked_by_another_process(client):
+    """
+    Test that an upload used by a request of another worker process is not written meanwhile.
+    """
+    upload_id = await _create_upload(client, "image.jpg", 100)
+    lock_path = f"{config.settings.uploads_dir}{upload_id}.lock"
+    with subprocess.Popen(
+        [sys.executable, "-c", HOLD_LOCK, lock_path],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    ) as holder:
+        assert holder.stdout.readline() == "locked\n"
+        response = await _patch(client, upload_id, 0, b"0" * 50)
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.json()["detail"]["code"] == "UPLOAD_IN_PROGRESS"
+        holder.stdin.close()
+
+    response = await _patch(client, upload_id, 0, b"0" * 50)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+
+async def test_upload_finalize_error_after_storage(client, monkeypatch):
+    """
+    Test an unexpected error of the ingestion once the file is moved to the storage: the stored
+    file stays there and the upload is removed.
+    """
+    content = b"0" * 100
+    upload_id = await _create_upload(client, "image.jpg", len(content))
+    await _patch(client, upload_id, 0, content)
+
+    stored_paths = []
+
+    async def failing_ingest_file(file, db):
+        file.pixel_hash = "a" * 32
+        await files_services.compute_hash_pathes(file)
+        await files_services.move_file(file)
+        stored_paths.append(file.path)
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(services, "ingest_file", failing_ingest_file)
+    with pytest.raises(RuntimeError):
+        await client.post(f"/uploads/{upload_id}/finalize")
+
+    assert stored_paths[0].startswith(config.settings.storage_dir)
+    assert os.path.exists(stored_paths[0])
+    assert os.listdir(config.settings.uploads_dir) == []